@@ -15,13 +15,22 @@ from swarmit.testbed.controller import (
     CHUNK_SIZE,
     OTA_ACK_TIMEOUT_DEFAULT,
     OTA_MAX_RETRIES_DEFAULT,
+    VOLTAGE_WARNING,
     Controller,
     ControllerSettings,
     ResetLocation,
     print_transfer_status,
 )
+from swarmit.testbed.eventlog import (
+    EVENTLOG_DEVICE_BURST_DEFAULT,
+    EVENTLOG_DEVICE_RATE_DEFAULT,
+    EVENTLOG_GLOBAL_RATE_DEFAULT,
+)
 from swarmit.testbed.helpers import load_toml_config
 from swarmit.testbed.logger import setup_logging
+from swarmit.testbed.selector import parse_selector, split_devices
+from swarmit.testbed.simulator import SimulatorSettings
+from swarmit.testbed.telemetry import print_telemetry
 
 DEFAULTS = {
     "adapter": "edge",
@@ -33,6 +42,15 @@ DEFAULTS = {
     # See https://crystalfree.atlassian.net/wiki/spaces/Mari/pages/3324903426/Registry+of+Mari+Network+IDs
     "swarmit_network_id": "1200",
     "mqtt_use_tls": False,
+    "capture_path": "",
+    "replay_speed": "1",
+    "eventlog_path": "",
+    "eventlog_console_sample": 1,
+    "eventlog_device_rate": EVENTLOG_DEVICE_RATE_DEFAULT,
+    "eventlog_device_burst": EVENTLOG_DEVICE_BURST_DEFAULT,
+    "eventlog_global_rate": EVENTLOG_GLOBAL_RATE_DEFAULT,
+    "logstore_path": "",
+    "link_probe_period": 0,
     "verbose": False,
 }
 
@@ -48,7 +66,7 @@ DEFAULTS = {
     "-p",
     "--port",
     type=str,
-    help=f"Serial port to use to send the bitstream to the gateway. Default: {DEFAULTS['serial_port']}.",
+    help=f"Serial port to use to send the bitstream to the gateway, several ports separated with , shard the swarm across several gateways. Default: {DEFAULTS['serial_port']}.",
 )
 @click.option(
     "-b",
@@ -78,20 +96,40 @@ DEFAULTS = {
     "-n",
     "--network-id",
     type=str,
-    help=f"Marilib network ID to use. Default: 0x{DEFAULTS['swarmit_network_id']}",
+    help=f"Marilib network ID to use, several IDs separated with , shard the swarm across several networks. Default: 0x{DEFAULTS['swarmit_network_id']}",
 )
 @click.option(
     "-a",
     "--adapter",
-    type=click.Choice(["edge", "cloud"], case_sensitive=True),
+    type=click.Choice(["edge", "cloud", "sim", "replay"], case_sensitive=True),
     help=f"Choose the adapter to communicate with the gateway. Default: {DEFAULTS['adapter']}",
 )
+@click.option(
+    "--capture-path",
+    type=click.Path(dir_okay=False),
+    help="Capture file: frames are appended to it with the edge and cloud adapters, and read from it with the replay adapter.",
+)
+@click.option(
+    "--replay-speed",
+    type=str,
+    help=f"Replay speed factor, or 'max' to replay as fast as possible. Default: {DEFAULTS['replay_speed']}.",
+)
+@click.option(
+    "--eventlog-path",
+    type=click.Path(file_okay=False),
+    help="Directory where the event logs of the devices are written, as rotating compressed files.",
+)
+@click.option(
+    "--logstore-path",
+    type=click.Path(dir_okay=False),
+    help="SQLite file where the event logs of the devices are indexed by device and time.",
+)
 @click.option(
     "-d",
     "--devices",
     type=str,
     default="",
-    help="Subset list of device addresses to interact with, separated with ,",
+    help="Subset list of device addresses to interact with, separated with ,. Selectors, such as \"type=DotBotV3 & battery>2.5V\" or \"rect(x0,y0,x1,y1)\", select the devices matching them.",
 )
 @click.option(
     "-v",
@@ -111,12 +149,20 @@ def main(
     mqtt_use_tls,
     network_id,
     adapter,
+    capture_path,
+    replay_speed,
+    eventlog_path,
+    logstore_path,
     devices,
     verbose,
 ):
     config_data = load_toml_config(config_path)
     cli_args = {
         "adapter": adapter,
+        "capture_path": capture_path,
+        "replay_speed": replay_speed,
+        "eventlog_path": eventlog_path,
+        "logstore_path": logstore_path,
         "serial_port": port,
         "baudrate": baudrate,
         "mqtt_host": mqtt_host,
@@ -133,18 +179,44 @@ def main(
         **{k: v for k, v in config_data.items() if v is not None},
         **{k: v for k, v in cli_args.items() if v not in (None, False)},
     }
+    serial_ports = [p for p in final_config["serial_port"].split(",") if p]
+    network_ids = [
+        int(n, 16) for n in final_config["swarmit_network_id"].split(",") if n
+    ]
+    devices = split_devices(final_config["devices"])
+    for device in devices:
+        try:
+            parse_selector(device)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint="'--devices'")
 
     setup_logging()
     ctx.ensure_object(dict)
     ctx.obj["settings"] = ControllerSettings(
-        serial_port=final_config["serial_port"],
+        serial_port=serial_ports[0],
+        serial_ports=serial_ports,
         serial_baudrate=final_config["baudrate"],
         mqtt_host=final_config["mqtt_host"],
         mqtt_port=final_config["mqtt_port"],
         mqtt_use_tls=final_config["mqtt_use_tls"],
-        network_id=int(final_config["swarmit_network_id"], 16),
+        network_id=network_ids[0],
+        network_ids=network_ids,
         adapter=final_config["adapter"],
-        devices=[d for d in final_config["devices"].split(",") if d],
+        capture_path=final_config["capture_path"],
+        replay_speed=(
+            0
+            if final_config["replay_speed"] == "max"
+            else float(final_config["replay_speed"])
+        ),
+        eventlog_path=final_config["eventlog_path"],
+        eventlog_console_sample=final_config["eventlog_console_sample"],
+        eventlog_device_rate=final_config["eventlog_device_rate"],
+        eventlog_device_burst=final_config["eventlog_device_burst"],
+        eventlog_global_rate=final_config["eventlog_global_rate"],
+        logstore_path=final_config["logstore_path"],
+        link_probe_period=final_config["link_probe_period"],
+        simulator=SimulatorSettings(**final_config.get("simulator", {})),
+        devices=devices,
         verbose=final_config["verbose"],
     )
 
@@ -239,9 +311,34 @@ def reset(ctx, locations):
     show_default=True,
     help="Number of retries for each OTA message (start or chunk) transfer.",
 )
+@click.option(
+    "-m",
+    "--min-battery",
+    type=int,
+    default=VOLTAGE_WARNING,
+    show_default=True,
+    help="Minimum battery level in mV of the robots to flash, 0 to flash them all.",
+)
+@click.option(
+    "-w",
+    "--wave-size",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Number of robots flashed per wave, healthiest battery first, 0 to flash them all at once.",
+)
 @click.argument("firmware", type=click.File(mode="rb"), required=False)
 @click.pass_context
-def flash(ctx, yes, start, ota_timeout, ota_max_retries, firmware):
+def flash(
+    ctx,
+    yes,
+    start,
+    ota_timeout,
+    ota_max_retries,
+    min_battery,
+    wave_size,
+    firmware,
+):
     """Flash a firmware to the robots."""
     console = Console()
     if firmware is None:
@@ -250,6 +347,8 @@ def flash(ctx, yes, start, ota_timeout, ota_max_retries, firmware):
 
     ctx.obj["settings"].ota_timeout = ota_timeout
     ctx.obj["settings"].ota_max_retries = ota_max_retries
+    ctx.obj["settings"].ota_min_battery = min_battery
+    ctx.obj["settings"].ota_wave_size = wave_size
     fw = bytearray(firmware.read())
     controller = Controller(ctx.obj["settings"])
     if not controller.ready_devices:
@@ -257,39 +356,68 @@ def flash(ctx, yes, start, ota_timeout, ota_max_retries, firmware):
         controller.terminate()
         raise click.Abort()
 
-    print(
-        f"Devices to flash ([bold white]{len(controller.ready_devices)}):[/]"
-    )
-    pprint(controller.ready_devices, expand_all=True)
-    if yes is False:
-        click.confirm("Do you want to continue?", default=True, abort=True)
-
-    start_data = controller.start_ota(fw)
-    if controller.settings.verbose:
-        print("\n[b]Start OTA response:[/]")
-        pprint(start_data, indent_guides=False, expand_all=True)
-    if start_data["missed"]:
-        console = Console()
-        console.print(
-            f"[bold red]Error:[/] {len(start_data['missed'])} acknowledgments "
-            f"are missing ({', '.join(sorted(set(start_data['missed'])))}). "
-            "Aborting."
+    plan = controller.plan_ota()
+    if plan.skipped:
+        print(f"Devices skipped ([bold white]{len(plan.skipped)}):[/]")
+        pprint(plan.skipped, expand_all=True)
+    if plan.marginal:
+        print(
+            f"Devices with a marginal link ([bold white]{len(plan.marginal)}"
+            "[/]), their chunks are unicast:"
         )
-        controller.stop()
+        pprint(plan.marginal, expand_all=True)
+    if not plan.waves:
+        console.print("[bold red]Error:[/] No device to flash. Exiting.")
         controller.terminate()
         raise click.Abort()
 
-    print()
-    print(f"Image size: [bold cyan]{len(fw)}B[/]")
-    print(
-        f"Image hash: [bold cyan]{start_data['ota'].fw_hash.hex().upper()}[/]"
-    )
-    print(
-        f"Radio chunks ([bold]{CHUNK_SIZE}B[/bold]): {start_data['ota'].chunks}"
-    )
-    start_time = time.time()
-    data = controller.transfer(fw, start_data["acked"])
-    print(f"Elapsed: [bold cyan]{time.time() - start_time:.3f}s[/bold cyan]")
+    print(f"Devices to flash ([bold white]{len(plan.devices)}):[/]")
+    pprint(plan.devices, expand_all=True)
+    if yes is False:
+        click.confirm("Do you want to continue?", default=True, abort=True)
+
+    data = {}
+    for wave_index, wave in enumerate(plan.waves):
+        if len(plan.waves) > 1:
+            print(
+                f"\n[bold]Wave {wave_index + 1}/{len(plan.waves)}[/] "
+                f"({len(wave)} devices)"
+            )
+        start_data = (
+            controller.start_ota(fw)
+            if plan.broadcast
+            else controller.start_ota(fw, wave)
+        )
+        if controller.settings.verbose:
+            print("\n[b]Start OTA response:[/]")
+            pprint(start_data, indent_guides=False, expand_all=True)
+        if start_data["missed"]:
+            console = Console()
+            console.print(
+                f"[bold red]Error:[/] {len(start_data['missed'])} "
+                "acknowledgments are missing "
+                f"({', '.join(sorted(set(start_data['missed'])))}). "
+                "Aborting."
+            )
+            controller.stop()
+            controller.terminate()
+            raise click.Abort()
+
+        print()
+        print(f"Image size: [bold cyan]{len(fw)}B[/]")
+        print(
+            "Image hash: "
+            f"[bold cyan]{start_data['ota'].fw_hash.hex().upper()}[/]"
+        )
+        print(
+            f"Radio chunks ([bold]{CHUNK_SIZE}B[/bold]): "
+            f"{start_data['ota'].chunks}"
+        )
+        start_time = time.time()
+        data.update(controller.transfer(fw, start_data["acked"]))
+        print(
+            f"Elapsed: [bold cyan]{time.time() - start_time:.3f}s[/bold cyan]"
+        )
     print_transfer_status(data, start_data["ota"])
     if controller.settings.verbose:
         print("\n[b]Transfer data:[/]")
@@ -335,6 +463,24 @@ def status(ctx, watch):
     controller.terminate()
 
 
+@main.command()
+@click.option(
+    "-t",
+    "--duration",
+    type=float,
+    default=5,
+    show_default=True,
+    help="Duration in seconds of the measurement.",
+)
+@click.pass_context
+def stats(ctx, duration):
+    """Print radio frame rates, errors and latencies."""
+    controller = Controller(ctx.obj["settings"])
+    time.sleep(duration)
+    print_telemetry(controller.telemetry_snapshot())
+    controller.terminate()
+
+
 @main.command()
 @click.argument("message", type=str, required=True)
 @click.pass_context
@@ -71,6 +71,86 @@ export function usePersistedToken() {
   return { token, setToken };
 }
 
+export type FlashJob = {
+  id: string;
+  state: "pending" | "starting" | "transferring" | "done" | "failed" | "canceled";
+  error: string | null;
+  chunks: number;
+  acked: string[];
+  progress: Record<string, { acked: number; retries: number; success: boolean | null }>;
+  eta: number | null;
+};
+
+const FLASH_JOB_FINISHED = ["done", "failed", "canceled"];
+
+// Upload a firmware image as raw bytes, unless the server already has it.
+async function uploadFirmware(token: Token, file: File): Promise<string> {
+  const image = await file.arrayBuffer();
+  // crypto.subtle is only available in secure contexts
+  if (window.crypto?.subtle) {
+    const digest = await window.crypto.subtle.digest("SHA-256", image);
+    const hash = Array.from(new Uint8Array(digest))
+      .map((b) => b.toString(16).padStart(2, "0")).join("");
+    const res = await fetch(`${API_URL}/firmware/${hash}`);
+    if (res.ok) return hash;
+  }
+  const res = await fetch(`${API_URL}/firmware`, {
+    method: "POST",
+    headers: {
+      "Authorization": `Bearer ${token.token}`,
+      "Content-Type": "application/octet-stream"
+    },
+    body: image,
+  });
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.detail || "Unknown error");
+  return data.response.hash;
+}
+
+// Submit a flash job and follow its progress until it is finished. The
+// request returns right away, the progress is pushed by the server.
+export async function runFlashJob(
+  token: Token,
+  file: File,
+  devices: string[] | undefined,
+  onProgress: (job: FlashJob) => void,
+): Promise<FlashJob> {
+  const body = { firmware_hash: await uploadFirmware(token, file), devices };
+  return fetch(`${API_URL}/flash/jobs`, {
+    method: "POST",
+    headers: {
+      "Authorization": `Bearer ${token.token}`,
+      "Content-Type": "application/json"
+    },
+    body: JSON.stringify(body),
+  })
+    .then((res) => res.json().then((data) => {
+      if (!res.ok) throw new Error(data.detail || "Unknown error");
+      return data.response as FlashJob;
+    }))
+    .then((job) => new Promise<FlashJob>((resolve, reject) => {
+      const source = new EventSource(`${API_URL}/flash/jobs/${job.id}/stream`);
+      source.onmessage = (event) => {
+        const progress: FlashJob = JSON.parse(event.data);
+        onProgress(progress);
+        if (FLASH_JOB_FINISHED.includes(progress.state)) {
+          source.close();
+          resolve(progress);
+        }
+      };
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) reject(new Error("Lost the flash progress"));
+      };
+    }));
+}
+
+export function flashJobPercent(job: FlashJob): number {
+  const total = job.chunks * job.acked.length;
+  if (!total) return 0;
+  const acked = Object.values(job.progress).reduce((sum, device) => sum + device.acked, 0);
+  return Math.floor(100 * acked / total);
+}
+
 export interface SettingsResponse {
   network_id: number;
   area_width: number;
@@ -137,6 +217,10 @@ export default function MainDashboard() {
   }, [token]);
 
   useEffect(() => {
+    const toDotBot = (v: DotBotData): DotBotData => ({ ...v, battery: v.battery / 1000 });
+
+    // Fallback when the status stream is not available: poll every second
+    let interval: ReturnType<typeof setInterval> | null = null;
     const fetchStatus = () => {
       fetch(`${API_URL}/status`)
         .then((res) => {
@@ -146,17 +230,54 @@ export default function MainDashboard() {
         .then((json) => {
           const dotbots = Object.fromEntries(
             Object.entries(json.response as Record<string, DotBotData>)
-              .map(([k, v]) => [k, { ...v, battery: v.battery / 1000, pos_x: v.pos_x, pos_y: v.pos_y }]));
+              .map(([k, v]) => [k, toDotBot(v)]));
           setDotBots(dotbots);
         })
         .catch((_err) => {
         });
     };
+    const startPolling = () => {
+      if (interval) return;
+      fetchStatus();
+      interval = setInterval(fetchStatus, 1000);
+    };
+
+    if (typeof EventSource === "undefined") {
+      startPolling();
+      return () => { if (interval) clearInterval(interval); };
+    }
 
-    fetchStatus();
-    const interval = setInterval(fetchStatus, 1000);
+    // The server sends a snapshot of all the devices, then only the changed
+    // ones, so unchanged devices keep their object and are not re-rendered.
+    const source = new EventSource(`${API_URL}/status/stream`);
+    source.addEventListener("snapshot", (event) => {
+      const json = JSON.parse((event as MessageEvent).data);
+      setDotBots(Object.fromEntries(
+        Object.entries(json.devices as Record<string, DotBotData>)
+          .map(([k, v]) => [k, toDotBot(v)])));
+    });
+    source.addEventListener("update", (event) => {
+      const json = JSON.parse((event as MessageEvent).data);
+      setDotBots((current) => {
+        const dotbots = { ...current };
+        for (const [k, v] of Object.entries(json.updated as Record<string, DotBotData>)) {
+          dotbots[k] = toDotBot(v);
+        }
+        for (const k of json.removed as string[]) {
+          delete dotbots[k];
+        }
+        return dotbots;
+      });
+    });
+    source.onerror = () => {
+      // The browser reconnects by itself unless the stream is closed
+      if (source.readyState === EventSource.CLOSED) startPolling();
+    };
 
-    return () => clearInterval(interval);
+    return () => {
+      source.close();
+      if (interval) clearInterval(interval);
+    };
   }, []);
 
   const loginLabel: Record<tokenActivenessType, string> = {
@@ -11,7 +11,8 @@ interface DotBotsMapPointProps {
   };
 }
 
-function DotBotsMapPoint({
+// Memoized: with streamed status updates, only the moved robots re-render
+const DotBotsMapPoint = React.memo(function DotBotsMapPoint({
   dotbot,
   address,
   mapSize,
@@ -60,7 +61,7 @@ Position: ${posX}x${posY}`}</title>
       </g>
     </>
   );
-};
+});
 
 interface DotBotsMapProps {
   dotbots: Record<string, DotBotData>;
@@ -1,5 +1,5 @@
 import { useEffect, useState } from "react";
-import { tokenActivenessType, Token, DotBotData, API_URL } from "./App";
+import { tokenActivenessType, Token, DotBotData, API_URL, runFlashJob, flashJobPercent } from "./App";
 import { DotBotsMap } from "./BotMap";
 
 interface HomePageProps {
@@ -104,43 +104,27 @@ export default function HomePage({ token, tokenActiveness, dotbots, areaSize, ca
     }
 
     setLoading(true);
-    setMessage(null);
+    setMessage("Flashing...");
 
-    const reader = new FileReader();
-
-    reader.onload = () => {
-      const base64 = (reader.result as string).split(",")[1];
-      setMessage("Flashing...");
-
-      fetch(`${API_URL}/flash`, {
-        method: "POST",
-        headers: {
-          "Authorization": `Bearer ${token.token}`,
-          "Content-Type": "application/json"
-        },
-        body: JSON.stringify({ firmware_b64: base64 }),
+    runFlashJob(token, file, undefined, (job) => {
+      if (job.state === "transferring") {
+        const eta = job.eta !== null ? ` (${Math.ceil(job.eta)}s left)` : "";
+        setMessage(`Flashing... ${flashJobPercent(job)}%${eta}`);
+      }
+    })
+      .then((job) => {
+        if (job.state === "done") {
+          setMessage("File flashed successfully");
+        } else {
+          setMessage(job.error || `Flash ${job.state}`);
+        }
       })
-        .then((res) =>
-          res
-            .json()
-            .then((data) => ({ ok: res.ok, data }))
-            .catch(() => ({ ok: res.ok, data: { error: "Invalid response" } }))
-        )
-        .then(({ ok, data }) => {
-          if (ok) {
-            setMessage("File flashed successfully");
-          } else {
-            setMessage(data.detail || "Unknown error");
-          }
-          setLoading(false);
-        })
-        .catch((_err) => {
-          setMessage(`Error: couldn't authorize token`);
-          setLoading(false);
-        });
-    };
-
-    reader.readAsDataURL(file);
+      .catch((err) => {
+        setMessage(`Error: ${err.message}`);
+      })
+      .finally(() => {
+        setLoading(false);
+      });
   };
   const unixToLocale = (t: number) => new Date(t * 1000).toLocaleString();
 
@@ -1,5 +1,5 @@
 import { Dispatch, SetStateAction, useState } from "react";
-import { API_URL, checkTokenActiveness, DotBotData, StatusType, Token } from "./App";
+import { API_URL, checkTokenActiveness, DotBotData, runFlashJob, StatusType, Token } from "./App";
 
 // Pill-style status badges so the table reads at a glance. Colors mirror
 // the status colors used by the SVG dots on the map (BotMap.tsx).
@@ -114,25 +114,11 @@ export default function OnlineDotBotPage({ dotbots, token }: CalendarPageProps)
 
     setLoading(true);
 
-    const reader = new FileReader();
-
-    reader.onload = () => {
-      const base64 = (reader.result as string).split(",")[1];
-
-      fetch(`${API_URL}/flash`, {
-        method: "POST",
-        headers: {
-          "Authorization": `Bearer ${token.token}`,
-          "Content-Type": "application/json"
-        },
-        body: JSON.stringify({ firmware_b64: base64, devices: selected }),
-      })
-        .finally(() => {
-          setLoading(false);
-        });
-    };
-
-    reader.readAsDataURL(file);
+    runFlashJob(token, file, selected, () => {})
+      .catch(() => {})
+      .finally(() => {
+        setLoading(false);
+      });
   };
 
   return (
@@ -7,14 +7,21 @@ import uvicorn
 
 from swarmit import __version__
 from swarmit.cli.main import DEFAULTS
-from swarmit.testbed.controller import ControllerSettings
+from swarmit.testbed.controller import VOLTAGE_WARNING, ControllerSettings
 from swarmit.testbed.helpers import load_toml_config
+from swarmit.testbed.selector import split_devices
+from swarmit.testbed.simulator import SimulatorSettings
+from swarmit.testbed.stream import STATUS_STREAM_INTERVAL_DEFAULT
 from swarmit.testbed.webserver import api, init_api, mount_frontend
 
 DEFAULTS_DASHBOARD = {
     **DEFAULTS,
     "http_port": 8001,
     "map_size": "2500x2500",
+    "status_stream_interval": STATUS_STREAM_INTERVAL_DEFAULT,
+    "controller_process": False,
+    "ota_min_battery": VOLTAGE_WARNING,
+    "ota_wave_size": 0,
 }
 
 
@@ -29,7 +36,7 @@ DEFAULTS_DASHBOARD = {
     "-p",
     "--port",
     type=str,
-    help=f"Serial port to use to send the bitstream to the gateway. Default: {DEFAULTS_DASHBOARD['serial_port']}.",
+    help=f"Serial port to use to send the bitstream to the gateway, several ports separated with , shard the swarm across several gateways. Default: {DEFAULTS_DASHBOARD['serial_port']}.",
 )
 @click.option(
     "-b",
@@ -59,20 +66,40 @@ DEFAULTS_DASHBOARD = {
     "-n",
     "--network-id",
     type=str,
-    help=f"Marilib network ID to use. Default: 0x{DEFAULTS_DASHBOARD['swarmit_network_id']}",
+    help=f"Marilib network ID to use, several IDs separated with , shard the swarm across several networks. Default: 0x{DEFAULTS_DASHBOARD['swarmit_network_id']}",
 )
 @click.option(
     "-a",
     "--adapter",
-    type=click.Choice(["edge", "cloud"], case_sensitive=True),
+    type=click.Choice(["edge", "cloud", "sim", "replay"], case_sensitive=True),
     help=f"Choose the adapter to communicate with the gateway. Default: {DEFAULTS_DASHBOARD['adapter']}",
 )
+@click.option(
+    "--capture-path",
+    type=click.Path(dir_okay=False),
+    help="Capture file: frames are appended to it with the edge and cloud adapters, and read from it with the replay adapter.",
+)
+@click.option(
+    "--replay-speed",
+    type=str,
+    help=f"Replay speed factor, or 'max' to replay as fast as possible. Default: {DEFAULTS_DASHBOARD['replay_speed']}.",
+)
+@click.option(
+    "--eventlog-path",
+    type=click.Path(file_okay=False),
+    help="Directory where the event logs of the devices are written, as rotating compressed files.",
+)
+@click.option(
+    "--logstore-path",
+    type=click.Path(dir_okay=False),
+    help="SQLite file where the event logs of the devices are indexed by device and time.",
+)
 @click.option(
     "-d",
     "--devices",
     type=str,
     default="",
-    help="Subset list of device addresses to interact with, separated with ,",
+    help="Subset list of device addresses to interact with, separated with ,. Selectors, such as \"type=DotBotV3 & battery>2.5V\" or \"rect(x0,y0,x1,y1)\", select the devices matching them.",
 )
 @click.option(
     "-m",
@@ -116,6 +143,10 @@ def main(
     mqtt_use_tls,
     network_id,
     adapter,
+    capture_path,
+    replay_speed,
+    eventlog_path,
+    logstore_path,
     devices,
     map_size,
     calibration_distance,
@@ -125,6 +156,10 @@ def main(
     config_data = load_toml_config(config_path)
     cli_args = {
         "adapter": adapter,
+        "capture_path": capture_path,
+        "replay_speed": replay_speed,
+        "eventlog_path": eventlog_path,
+        "logstore_path": logstore_path,
         "serial_port": port,
         "baudrate": baudrate,
         "mqtt_host": mqtt_host,
@@ -144,28 +179,86 @@ def main(
         **{k: v for k, v in config_data.items() if v is not None},
         **{k: v for k, v in cli_args.items() if v not in (None, False)},
     }
-
-    controller_settings = ControllerSettings(
-        serial_port=final_config["serial_port"],
-        serial_baudrate=final_config["baudrate"],
-        mqtt_host=final_config["mqtt_host"],
-        mqtt_port=final_config["mqtt_port"],
-        mqtt_use_tls=final_config["mqtt_use_tls"],
-        network_id=int(final_config["swarmit_network_id"], 16),
-        adapter=final_config["adapter"],
-        devices=[d for d in final_config["devices"].split(",") if d],
-        map_size=final_config["map_size"],
-        calibration_distance=final_config.get("calibration_distance", 0) or 0,
-        verbose=final_config["verbose"],
-    )
+    # Each [[testbeds]] table of the config runs a testbed, with its own
+    # network ID and adapter, in the same dashboard
+    controller_settings = [
+        testbed_settings({**final_config, **testbed})
+        for testbed in final_config.get("testbeds") or [{}]
+    ]
+    check_testbed_paths(controller_settings)
 
     asyncio.run(
         async_web(controller_settings, final_config["http_port"], open_browser)
     )
 
 
+def testbed_settings(config: dict) -> ControllerSettings:
+    """Return the controller settings of a testbed of the dashboard."""
+    serial_ports = [p for p in config["serial_port"].split(",") if p]
+    network_ids = [
+        int(n, 16) for n in config["swarmit_network_id"].split(",") if n
+    ]
+
+    return ControllerSettings(
+        serial_port=serial_ports[0],
+        serial_ports=serial_ports,
+        serial_baudrate=config["baudrate"],
+        mqtt_host=config["mqtt_host"],
+        mqtt_port=config["mqtt_port"],
+        mqtt_use_tls=config["mqtt_use_tls"],
+        network_id=network_ids[0],
+        network_ids=network_ids,
+        adapter=config["adapter"],
+        capture_path=config["capture_path"],
+        replay_speed=(
+            0
+            if config["replay_speed"] == "max"
+            else float(config["replay_speed"])
+        ),
+        eventlog_path=config["eventlog_path"],
+        eventlog_console_sample=config["eventlog_console_sample"],
+        eventlog_device_rate=config["eventlog_device_rate"],
+        eventlog_device_burst=config["eventlog_device_burst"],
+        eventlog_global_rate=config["eventlog_global_rate"],
+        logstore_path=config["logstore_path"],
+        link_probe_period=config["link_probe_period"],
+        status_stream_interval=config["status_stream_interval"],
+        controller_process=config["controller_process"],
+        ota_min_battery=config["ota_min_battery"],
+        ota_wave_size=config["ota_wave_size"],
+        simulator=SimulatorSettings(**config.get("simulator", {})),
+        devices=split_devices(config["devices"]),
+        map_size=config["map_size"],
+        calibration_distance=config.get("calibration_distance", 0) or 0,
+        verbose=config["verbose"],
+    )
+
+
+def check_testbed_paths(settings: list[ControllerSettings]):
+    """Reject the testbeds writing to the same event log, log store or
+    capture file, their records would be interleaved."""
+    written = {}
+    for testbed in settings:
+        paths = {
+            "eventlog_path": testbed.eventlog_path,
+            "logstore_path": testbed.logstore_path,
+        }
+        if testbed.adapter in ("edge", "cloud"):
+            paths["capture_path"] = testbed.capture_path
+        for key, path in paths.items():
+            if not path:
+                continue
+            if path in written:
+                raise click.UsageError(
+                    f"testbeds {written[path]:04X} and "
+                    f"{testbed.network_id:04X} share the {key} '{path}', "
+                    "set a different one in each [[testbeds]] table"
+                )
+            written[path] = testbed.network_id
+
+
 async def async_web(
-    settings: ControllerSettings, http_port: int, open_browser: bool
+    settings: list[ControllerSettings], http_port: int, open_browser: bool
 ):
     tasks = []
     try:
@@ -199,7 +292,7 @@ async def async_web(
         print("Controller stopped")
 
 
-async def _serve_fast_api(settings: ControllerSettings, http_port: int):
+async def _serve_fast_api(settings: list[ControllerSettings], http_port: int):
     """Starts the web server application."""
     init_api(api, settings)
     mount_frontend(api)
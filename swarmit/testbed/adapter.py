@@ -1,8 +1,12 @@
 """Module containing classes for interfacing with the DotBot gateway."""
 
+import functools
+import os
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 from dotbot_utils.protocol import (
     Packet,
@@ -12,15 +16,65 @@ from dotbot_utils.protocol import (
 from marilib.communication_adapter import MQTTAdapter as MarilibMQTTAdapter
 from marilib.communication_adapter import SerialAdapter as MarilibSerialAdapter
 from marilib.mari_protocol import Frame as MariFrame
+from marilib.mari_protocol import Header as MariHeader
+from marilib.mari_protocol import MetricsProbePayload
 from marilib.marilib_cloud import MarilibCloud
 from marilib.marilib_edge import MarilibEdge
-from marilib.model import EdgeEvent, MariNode
+from marilib.model import SCHEDULES, EdgeEvent, MariNode
 from rich import print
 
+from swarmit.testbed.capture import (
+    CAPTURE_INBOUND,
+    CaptureWriter,
+    read_capture,
+)
+from swarmit.testbed.protocol import BROADCAST_ADDRESS, PayloadType
+from swarmit.testbed.scheduler import FairLock
+from swarmit.testbed.telemetry import Telemetry, payload_type_name
+
+READY_POLL_PERIOD = 0.01  # s
+# The node list is considered complete once it didn't change for this delay
+READY_SETTLE_TIME = 0.3  # s
+
 
 class GatewayAdapterBase(ABC):
     """Base class for interface adapters."""
 
+    @property
+    def telemetry(self) -> Telemetry:
+        """Return the adapter telemetry, created on first use."""
+        if not hasattr(self, "_telemetry"):
+            self._telemetry = Telemetry()
+        return self._telemetry
+
+    @property
+    def ready(self) -> threading.Event:
+        """Return the event set once the adapter is ready."""
+        if not hasattr(self, "_ready"):
+            self._ready = threading.Event()
+        return self._ready
+
+    def node_addresses(self) -> list[int] | None:
+        """Return the addresses of the nodes known by the gateway.
+
+        None means the adapter has no knowledge of the nodes.
+        """
+        return None
+
+    def _update_readiness(self):
+        """Update the ready event, called while waiting for readiness."""
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Wait until the adapter is ready, at most timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while not self.ready.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._update_readiness()
+            self.ready.wait(min(READY_POLL_PERIOD, remaining))
+        return self.ready.is_set()
+
     @abstractmethod
     def init(self, on_frame_received: callable):
         """Initialize the interface."""
@@ -33,6 +87,10 @@ class GatewayAdapterBase(ABC):
     def send_payload(self, destination: int, payload: Payload):
         """Send payload to the interface."""
 
+    def partition(self, addresses: list[int]) -> list[list[int]]:
+        """Split addresses in groups that can be reached in parallel."""
+        return [addresses]
+
 
 class MarilibEdgeAdapter(GatewayAdapterBase):
     """Class used to interface with Marilib."""
@@ -45,57 +103,142 @@ class MarilibEdgeAdapter(GatewayAdapterBase):
             if self.verbose:
                 print("[orange]Node left:[/]", event_data)
         elif event == EdgeEvent.NODE_DATA:
+            if self.capture is not None:
+                self.capture.write_inbound(
+                    event_data.header.source,
+                    event_data.header.destination,
+                    event_data.payload,
+                )
             try:
                 packet = Packet.from_bytes(event_data.payload)
             except (ValueError, ProtocolPayloadParserException) as exc:
+                self.telemetry.count("parse_errors")
                 if self.verbose:
                     print(f"[red]Error parsing packet: {exc}[/]")
                 return
+            self.telemetry.count(
+                "frames_received", payload_type_name(packet.payload_type)
+            )
             if not hasattr(self, "on_frame_received"):
+                self.telemetry.count("frames_dropped")
                 return
             self.on_frame_received(event_data.header, packet)
 
+    def on_probe(self, address: int, probe: MetricsProbePayload):
+        self.telemetry.count(
+            "frames_received", payload_type_name(PayloadType.METRICS_PROBE)
+        )
+        self.telemetry.record_probe(f"{address:08X}", probe)
+        self.on_frame_received(
+            MariHeader(
+                destination=self.mari.gateway.info.address, source=address
+            ),
+            Packet(payload_type=PayloadType.METRICS_PROBE, payload=probe),
+        )
+
+    def _collect_probes(self):
+        # Marilib keeps the probe replies to itself, they never reach
+        # on_event: the last probe of each node is read from its statistics
+        while not self._stop_event.wait(self.probe_period):
+            with self.mari.lock:
+                probes = {
+                    node.address: node.probe_stats_latest
+                    for node in self.mari.gateway.nodes
+                    if node.probe_stats_latest is not None
+                }
+            for address, probe in probes.items():
+                if self._probes.get(address) is not probe:
+                    self.on_probe(address, probe)
+            self._probes = probes
+
     def __init__(
         self,
         port: str,
         baudrate: int,
         verbose: bool = False,
         busy_wait_timeout: float = 3,
+        capture: CaptureWriter = None,
+        probe_period: float = 0,
     ):
         self.verbose = verbose
         self.busy_wait_timeout = busy_wait_timeout
+        self.capture = capture
+        self.probe_period = probe_period
         try:
+            # the probes measure the link quality of the nodes, 0 disables
             self.mari = MarilibEdge(
                 self.on_event,
                 MarilibSerialAdapter(port, baudrate),
-                metrics_probe_period=0,
+                metrics_probe_period=probe_period,
             )
         except Exception as exc:
             print(f"[red]Error initializing MarilibEdge: {exc}[/]")
             sys.exit(1)
+        self._nodes: set[int] = set()
+        self._nodes_changed_at = time.monotonic()
+        self.telemetry.gauge("nodes_queue_depth", self._nodes_queue_depth)
+        self._probes: dict[int, MetricsProbePayload] = {}
+        self._stop_event = threading.Event()
+        self._probes_thread = threading.Thread(
+            target=self._collect_probes, daemon=True
+        )
 
-    def _busy_wait(self):
-        """Wait for the condition to be met."""
-        while self.busy_wait_timeout > 0:
-            self.mari.update()
-            self.busy_wait_timeout -= 0.1
-            time.sleep(0.1)
+    def node_addresses(self) -> list[int]:
+        return self.mari.gateway.nodes_addresses
+
+    def _nodes_queue_depth(self) -> float:
+        # slotframes queued ahead of the probe replies, on the busiest node
+        schedule = SCHEDULES.get(self.mari.gateway.info.schedule_id)
+        if schedule is None:
+            return 0
+        with self.mari.lock:
+            return max(
+                (
+                    node.stats_queue_depth_slotframes(
+                        float(schedule["sf_duration"])
+                    )
+                    for node in self.mari.gateway.nodes
+                ),
+                default=0,
+            )
+
+    def _update_readiness(self):
+        # Ready once the gateway reported its info and the node list settled
+        self.mari.update()
+        nodes = set(self.node_addresses())
+        if nodes != self._nodes:
+            self._nodes = nodes
+            self._nodes_changed_at = time.monotonic()
+        if (
+            self.mari.gateway.info.address
+            and time.monotonic() - self._nodes_changed_at >= READY_SETTLE_TIME
+        ):
+            self.ready.set()
 
     def init(self, on_frame_received: callable):
         self.on_frame_received = on_frame_received
+        if self.probe_period:
+            self._probes_thread.start()
         if self.verbose:
-            self._busy_wait()
+            self.wait_ready(self.busy_wait_timeout)
             print("[yellow]Mari nodes available:[/]")
             print(self.mari.nodes)
 
     def close(self):
+        self._stop_event.set()
+        if self._probes_thread.is_alive():
+            self._probes_thread.join()
         self.mari.serial_interface.close()
 
     def send_payload(self, destination: int, payload: Payload):
-        self.mari.send_frame(
-            dst=destination,
-            payload=Packet.from_payload(payload).to_bytes(),
+        packet = Packet.from_payload(payload)
+        self.telemetry.count(
+            "frames_sent", payload_type_name(packet.payload_type)
         )
+        data = packet.to_bytes()
+        if self.capture is not None:
+            self.capture.write_outbound(0, destination, data)
+        self.mari.send_frame(dst=destination, payload=data)
 
 
 class MarilibCloudAdapter(GatewayAdapterBase):
@@ -109,13 +252,28 @@ class MarilibCloudAdapter(GatewayAdapterBase):
             if self.verbose:
                 print("[orange]Node left:[/]", event_data)
         elif event == EdgeEvent.NODE_DATA:
+            if self.capture is not None:
+                self.capture.write_inbound(
+                    event_data.header.source,
+                    event_data.header.destination,
+                    event_data.payload,
+                )
             try:
                 packet = Packet.from_bytes(event_data.payload)
             except (ValueError, ProtocolPayloadParserException) as exc:
+                self.telemetry.count("parse_errors")
                 if self.verbose:
                     print(f"[red]Error parsing packet: {exc}[/]")
                 return
+            self.telemetry.count(
+                "frames_received", payload_type_name(packet.payload_type)
+            )
+            if packet.payload_type == PayloadType.METRICS_PROBE:
+                self.telemetry.record_probe(
+                    f"{event_data.header.source:08X}", packet.payload
+                )
             if not hasattr(self, "on_frame_received"):
+                self.telemetry.count("frames_dropped")
                 return
             self.on_frame_received(event_data.header, packet)
 
@@ -127,9 +285,11 @@ class MarilibCloudAdapter(GatewayAdapterBase):
         network_id: int,
         verbose: bool = False,
         busy_wait_timeout: float = 3,
+        capture: CaptureWriter = None,
     ):
         self.verbose = verbose
         self.busy_wait_timeout = busy_wait_timeout
+        self.capture = capture
         try:
             self.mari = MarilibCloud(
                 self.on_event,
@@ -139,18 +299,29 @@ class MarilibCloudAdapter(GatewayAdapterBase):
         except Exception as exc:
             print(f"[red]Error initializing MarilibCloud: {exc}[/]")
             sys.exit(1)
+        self._nodes: set[int] = set()
+        self._nodes_changed_at = time.monotonic()
+
+    def node_addresses(self) -> list[int]:
+        return [node.address for node in self.mari.nodes]
 
-    def _busy_wait(self):
-        """Wait for the condition to be met."""
-        while self.busy_wait_timeout > 0:
-            self.mari.update()
-            self.busy_wait_timeout -= 0.1
-            time.sleep(0.1)
+    def _update_readiness(self):
+        # Ready once a gateway reported its info and the node list settled
+        self.mari.update()
+        nodes = set(self.node_addresses())
+        if nodes != self._nodes:
+            self._nodes = nodes
+            self._nodes_changed_at = time.monotonic()
+        if (
+            self.mari.gateways
+            and time.monotonic() - self._nodes_changed_at >= READY_SETTLE_TIME
+        ):
+            self.ready.set()
 
     def init(self, on_frame_received: callable):
         self.on_frame_received = on_frame_received
         if self.verbose:
-            self._busy_wait()
+            self.wait_ready(self.busy_wait_timeout)
             print("[yellow]Mari nodes available:[/]")
             print(self.mari.nodes)
 
@@ -158,7 +329,187 @@ class MarilibCloudAdapter(GatewayAdapterBase):
         pass
 
     def send_payload(self, destination: int, payload: Payload):
-        self.mari.send_frame(
-            dst=destination,
-            payload=Packet.from_payload(payload).to_bytes(),
+        packet = Packet.from_payload(payload)
+        self.telemetry.count(
+            "frames_sent", payload_type_name(packet.payload_type)
+        )
+        data = packet.to_bytes()
+        if self.capture is not None:
+            self.capture.write_outbound(0, destination, data)
+        self.mari.send_frame(dst=destination, payload=data)
+
+
+class MultiGatewayAdapter(GatewayAdapterBase):
+    """Adapter sharding a swarm across several gateway adapters.
+
+    Unicast frames are routed to the gateway the destination node was last
+    heard on, broadcast frames (and frames to unknown nodes) are sent to all
+    gateways in parallel.
+    """
+
+    def __init__(self, adapters: list[GatewayAdapterBase]):
+        if not adapters:
+            raise ValueError("at least one adapter is required")
+        self.adapters = adapters
+        # node address -> index of the gateway the node was last heard on
+        self.routes: dict[int, int] = {}
+        self._locks = [FairLock() for _ in adapters]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(adapters), thread_name_prefix="gateway"
+        )
+        self.telemetry.gauge("routes", lambda: len(self.routes))
+        # the counters of the gateways are merged, their gauges labeled
+        for adapter in adapters:
+            self.telemetry.sources.append(adapter.telemetry)
+        for name in {
+            name for adapter in adapters for name in adapter.telemetry.gauges
+        }:
+            self.telemetry.gauge(
+                name, functools.partial(self._gateways_gauge, name)
+            )
+        self.telemetry.gauge(
+            "gateway_sends_queued",
+            lambda: {
+                f"{index}": lock.queued
+                for index, lock in enumerate(self._locks)
+            },
+        )
+
+    def _gateways_gauge(self, name: str) -> dict:
+        return {
+            f"{index}": adapter.telemetry.gauges[name]()
+            for index, adapter in enumerate(self.adapters)
+            if name in adapter.telemetry.gauges
+        }
+
+    def _on_frame_received(self, index: int, header, packet: Packet):
+        self.routes[header.source] = index
+        self.telemetry.count("gateway_frames_received", f"{index}")
+        self.on_frame_received(header, packet)
+
+    def init(self, on_frame_received: callable):
+        self.on_frame_received = on_frame_received
+        # Adapters may wait for their network at init, do it concurrently
+        list(
+            self._executor.map(
+                lambda index: self.adapters[index].init(
+                    lambda header, packet: self._on_frame_received(
+                        index, header, packet
+                    )
+                ),
+                range(len(self.adapters)),
+            )
+        )
+
+    def node_addresses(self) -> list[int] | None:
+        addresses = [adapter.node_addresses() for adapter in self.adapters]
+        if all(nodes is None for nodes in addresses):
+            return None
+        return sorted({addr for nodes in addresses if nodes for addr in nodes})
+
+    def wait_ready(self, timeout: float) -> bool:
+        ready = all(
+            self._executor.map(
+                lambda adapter: adapter.wait_ready(timeout), self.adapters
+            )
+        )
+        if ready:
+            self.ready.set()
+        return ready
+
+    def close(self):
+        for adapter in self.adapters:
+            adapter.close()
+        self._executor.shutdown()
+
+    def _send(self, index: int, destination: int, payload: Payload):
+        with self._locks[index]:
+            self.adapters[index].send_payload(destination, payload)
+        self.telemetry.count("gateway_frames_sent", f"{index}")
+
+    def send_payload(self, destination: int, payload: Payload):
+        index = self.routes.get(destination)
+        if destination != BROADCAST_ADDRESS and index is not None:
+            self._send(index, destination, payload)
+            return
+        list(
+            self._executor.map(
+                lambda index: self._send(index, destination, payload),
+                range(len(self.adapters)),
+            )
         )
+
+    def partition(self, addresses: list[int]) -> list[list[int]]:
+        groups: dict[int, list[int]] = {}
+        for address in addresses:
+            groups.setdefault(self.routes.get(address, -1), []).append(address)
+        return list(groups.values())
+
+
+class ReplayAdapter(GatewayAdapterBase):
+    """Adapter feeding the inbound frames of a capture to the controller.
+
+    The speed is a time scaling factor: 1 replays at the original speed,
+    N at N times the original speed and 0 as fast as possible.
+    """
+
+    def __init__(self, path: str, speed: float = 1, verbose: bool = False):
+        if not os.path.isfile(path):
+            raise ValueError(f"capture file {path} not found")
+        self.path = path
+        self.speed = speed
+        self.verbose = verbose
+        self.frames_replayed = 0
+        self.frames_sent = 0
+        self.done = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        first_timestamp = None
+        start = time.monotonic()
+        for record in read_capture(self.path):
+            if self._stop_event.is_set():
+                break
+            if record.direction != CAPTURE_INBOUND:
+                continue
+            if first_timestamp is None:
+                first_timestamp = record.timestamp
+            if self.speed > 0:
+                due = start + (record.timestamp - first_timestamp) / self.speed
+                delay = due - time.monotonic()
+                if delay > 0 and self._stop_event.wait(delay):
+                    break
+            try:
+                packet = Packet.from_bytes(record.payload)
+            except (ValueError, ProtocolPayloadParserException) as exc:
+                self.telemetry.count("parse_errors")
+                if self.verbose:
+                    print(f"[red]Error parsing packet: {exc}[/]")
+                continue
+            self.frames_replayed += 1
+            self.telemetry.count(
+                "frames_received", payload_type_name(packet.payload_type)
+            )
+            self.on_frame_received(
+                MariHeader(
+                    destination=record.destination, source=record.source
+                ),
+                packet,
+            )
+        self.done.set()
+
+    def init(self, on_frame_received: callable):
+        self.on_frame_received = on_frame_received
+        self._thread.start()
+        self.ready.set()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def send_payload(self, destination: int, payload: Payload):
+        # Replayed nodes can't react to commands, outbound frames are dropped
+        self.frames_sent += 1
+        self.telemetry.count("frames_dropped")
@@ -0,0 +1,18 @@
+"""Module containing the file types of the frontend assets.
+
+Without dependencies, the build hook of the package loads it from the
+source tree.
+"""
+
+# served precompressed by the dashboard
+COMPRESSIBLE_EXTENSIONS = (
+    ".css",
+    ".html",
+    ".js",
+    ".json",
+    ".map",
+    ".mjs",
+    ".svg",
+    ".txt",
+    ".wasm",
+)
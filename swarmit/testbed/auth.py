@@ -0,0 +1,104 @@
+"""Module containing the caches of the dashboard authentication."""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+
+KEY_CHECK_PERIOD = 1  # s
+TOKEN_CACHE_SIZE = 1024
+
+
+class KeyFiles:
+    """Content of the key files, read again when a file changes.
+
+    Files are checked for changes at most once every `check_period`.
+    """
+
+    def __init__(self, check_period: float = KEY_CHECK_PERIOD):
+        self.check_period = check_period
+        # path -> (checked_at, (mtime, size, inode), content)
+        self._files: dict[str, tuple[float, tuple, str]] = {}
+        self._lock = threading.Lock()
+
+    def read(self, path: str) -> str:
+        """Return the content of a file, raise FileNotFoundError if missing."""
+        now = time.monotonic()
+        entry = self._files.get(path)
+        if entry is not None and now - entry[0] < self.check_period:
+            return entry[2]
+        with self._lock:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                self._files.pop(path, None)
+                raise
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            if entry is not None and entry[1] == signature:
+                content = entry[2]
+            else:
+                with open(path) as f:
+                    content = f.read()
+            self._files[path] = (now, signature, content)
+        return content
+
+
+@lru_cache(maxsize=8)
+def load_public_key(pem: str):
+    """Return the parsed key, the PEM as is when it can't be parsed.
+
+    PyJWT then reports the keys it can't use.
+    """
+    try:
+        return load_pem_public_key(pem.encode())
+    except ValueError:
+        return pem
+
+
+@lru_cache(maxsize=8)
+def load_private_key(pem: str):
+    """Return the parsed key, the PEM as is when it can't be parsed."""
+    try:
+        return load_pem_private_key(pem.encode(), password=None)
+    except ValueError:
+        return pem
+
+
+class TokenCache:
+    """Bounded LRU of the verified tokens and their payload.
+
+    Entries are bound to the key that verified them, so they are dropped
+    when the key changes. The time claims are checked by the caller.
+    """
+
+    def __init__(self, size: int = TOKEN_CACHE_SIZE):
+        self.size = size
+        self._tokens: OrderedDict[str, tuple[object, dict]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def get(self, token: str, key) -> dict | None:
+        entry = self._tokens.get(token)
+        if entry is None:
+            return None
+        if entry[0] is not key:
+            del self._tokens[token]
+            return None
+        self._tokens.move_to_end(token)
+        return entry[1]
+
+    def put(self, token: str, key, payload: dict):
+        self._tokens[token] = (key, payload)
+        self._tokens.move_to_end(token)
+        while len(self._tokens) > self.size:
+            self._tokens.popitem(last=False)
+
+    def discard(self, token: str):
+        self._tokens.pop(token, None)
@@ -0,0 +1,78 @@
+"""Module containing the frame capture file format."""
+
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+CAPTURE_MAGIC = b"SWCAP\x01"
+CAPTURE_INBOUND = 0
+CAPTURE_OUTBOUND = 1
+# timestamp, direction, source, destination, payload length
+CAPTURE_RECORD_HEADER = struct.Struct("<dBQQH")
+
+
+@dataclass
+class CaptureRecord:
+    """Class that holds a captured frame."""
+
+    timestamp: float
+    direction: int
+    source: int
+    destination: int
+    payload: bytes
+
+
+class CaptureWriter:
+    """Append-only writer of a binary frame capture file."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(CAPTURE_MAGIC)
+
+    def write(
+        self, direction: int, source: int, destination: int, payload: bytes
+    ):
+        """Append a frame to the capture."""
+        header = CAPTURE_RECORD_HEADER.pack(
+            time.time(), direction, source, destination, len(payload)
+        )
+        with self._lock:
+            self._file.write(header + payload)
+
+    def write_inbound(self, source: int, destination: int, payload: bytes):
+        self.write(CAPTURE_INBOUND, source, destination, payload)
+
+    def write_outbound(self, source: int, destination: int, payload: bytes):
+        self.write(CAPTURE_OUTBOUND, source, destination, payload)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path: str):
+    """Yield the records of a capture file, in order."""
+    with open(path, "rb") as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a swarmit capture file")
+        while True:
+            header = capture.read(CAPTURE_RECORD_HEADER.size)
+            if len(header) < CAPTURE_RECORD_HEADER.size:
+                # End of file, or last record truncated by a crash
+                return
+            timestamp, direction, source, destination, length = (
+                CAPTURE_RECORD_HEADER.unpack(header)
+            )
+            payload = capture.read(length)
+            if len(payload) < length:
+                return
+            yield CaptureRecord(
+                timestamp=timestamp,
+                direction=direction,
+                source=source,
+                destination=destination,
+                payload=payload,
+            )
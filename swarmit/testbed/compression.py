@@ -0,0 +1,245 @@
+"""Module containing the compression of the dashboard responses."""
+
+import gzip
+import os
+import re
+import tempfile
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from swarmit.testbed.assets import COMPRESSIBLE_EXTENSIONS
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+COMPRESSION_MINIMUM_SIZE = 1024  # bytes
+# Vite names the bundled assets after their content hash
+HASHED_ASSET_PATTERN = re.compile(r"^assets/.+-[\w-]{8,}\.\w+$")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# the other files, index.html first, are revalidated with their ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# file extension of each encoding, in order of preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+# responses sent as is, streamed or already compressed
+UNCOMPRESSED_CONTENT_TYPES = (
+    "application/gzip",
+    "application/zip",
+    "audio/",
+    "font/woff",
+    "image/",
+    "text/event-stream",
+    "video/",
+)
+
+
+def accepted_encodings(accept_encoding: str) -> list[str]:
+    """Return the supported encodings a client accepts, preferred first."""
+    accepted = set()
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00"):
+            continue
+        accepted.add(name.strip())
+    return [
+        encoding
+        for encoding in ENCODINGS
+        if encoding in accepted and (encoding != "br" or brotli is not None)
+    ]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data at the highest level, for content served many times."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(path: str, encoding: str, target: str = None) -> str:
+    """Write the compressed variant of a file, unless already up to date.
+
+    Return the path of the variant.
+    """
+    if target is None:
+        target = f"{path}{ENCODINGS[encoding]}"
+    try:
+        if os.stat(target).st_mtime >= os.stat(path).st_mtime:
+            return target
+    except FileNotFoundError:
+        pass
+    with open(path, "rb") as f:
+        data = compress(f.read(), encoding)
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return target
+
+
+class BrotliResponder:
+    """Compress a response with brotli, the start message is held until
+    the first body tells whether it is worth it."""
+
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send = None
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    async def __call__(self, scope, receive, send):
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+
+    async def send_compressed(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] == 206
+                or headers.get("content-type", "")
+                .lower()
+                .startswith(UNCOMPRESSED_CONTENT_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                self.start_message = message
+            return
+        if self.passthrough or message["type"] != "http.response.body":
+            if self.start_message is not None:
+                await self.send(self.start_message)
+                self.start_message = None
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if len(body) < self.minimum_size and not more_body:
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            # fast settings, the API responses change on every request
+            self.compressor = brotli.Compressor(quality=4)
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["content-encoding"] = "br"
+            del headers["content-length"]
+            body = self._compress(body, more_body)
+            if not more_body:
+                headers["content-length"] = str(len(body))
+            await self.send(start)
+        else:
+            body = self._compress(body, more_body)
+        await self.send({**message, "body": body})
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        if more_body:
+            return self.compressor.process(body) + self.compressor.flush()
+        return self.compressor.process(body) + self.compressor.finish()
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Compress the responses with brotli when installed, gzip otherwise.
+
+    Responses under `minimum_size`, event streams and responses already
+    encoded, such as the precompressed static files, are sent as is.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        super().__init__(app, minimum_size=minimum_size, compresslevel=6)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and accepted_encodings(
+            Headers(scope=scope).get("accept-encoding", "")
+        )[:1] == ["br"]:
+            responder = BrotliResponder(self.app, self.minimum_size)
+            await responder(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files served compressed, with cache headers.
+
+    The `.br` and `.gz` variants written next to the files at build time
+    are used when present. Otherwise they are compressed on first request
+    and kept in `cache_directory`, until the file changes.
+    """
+
+    def __init__(self, *args, cache_directory: str = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_directory = cache_directory
+
+    def _variant(self, path: str, encoding: str) -> str | None:
+        built = f"{path}{ENCODINGS[encoding]}"
+        try:
+            if os.stat(built).st_mtime >= os.stat(path).st_mtime:
+                return built
+        except FileNotFoundError:
+            pass
+        if self.cache_directory is None:
+            return None
+        relative = os.path.relpath(path, os.path.realpath(self.directory))
+        target = os.path.join(
+            self.cache_directory, f"{relative}{ENCODINGS[encoding]}"
+        )
+        try:
+            return precompress(path, encoding, target)
+        except OSError:
+            # cache not writable, the file is served as is
+            return None
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = await super().get_response(path, scope)
+        if isinstance(response, FileResponse) and response.status_code == 200:
+            response = await self._compressed(response, scope)
+        if response.status_code in (200, 304):
+            response.headers["cache-control"] = (
+                IMMUTABLE_CACHE_CONTROL
+                if HASHED_ASSET_PATTERN.match(path.replace(os.sep, "/"))
+                else REVALIDATE_CACHE_CONTROL
+            )
+        return response
+
+    async def _compressed(self, response: FileResponse, scope) -> Response:
+        path = os.fspath(response.path)
+        if os.path.splitext(path)[1] not in COMPRESSIBLE_EXTENSIONS:
+            return response
+        request_headers = Headers(scope=scope)
+        for encoding in accepted_encodings(
+            request_headers.get("accept-encoding", "")
+        ):
+            variant = await anyio.to_thread.run_sync(
+                self._variant, path, encoding
+            )
+            if variant is None:
+                continue
+            compressed = FileResponse(
+                variant,
+                stat_result=os.stat(variant),
+                media_type=response.media_type,
+                headers={
+                    "content-encoding": encoding,
+                    "vary": "Accept-Encoding",
+                },
+            )
+            if self.is_not_modified(compressed.headers, request_headers):
+                return NotModifiedResponse(compressed.headers)
+            return compressed
+        response.headers["vary"] = "Accept-Encoding"
+        return response
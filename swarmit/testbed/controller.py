@@ -1,9 +1,11 @@
 """Module containing the swarmit controller class."""
 
+import contextlib
 import dataclasses
 import threading
 import time
 from binascii import hexlify
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 
 from cryptography.hazmat.primitives import hashes
@@ -20,9 +22,25 @@ from swarmit.testbed.adapter import (
     GatewayAdapterBase,
     MarilibCloudAdapter,
     MarilibEdgeAdapter,
+    MultiGatewayAdapter,
+    ReplayAdapter,
 )
+from swarmit.testbed.capture import CaptureWriter
+from swarmit.testbed.eventlog import (
+    EVENTLOG_DEVICE_BURST_DEFAULT,
+    EVENTLOG_DEVICE_RATE_DEFAULT,
+    EVENTLOG_GLOBAL_RATE_DEFAULT,
+    EventLogConsole,
+    EventLogFile,
+    EventLogRateLimiter,
+    EventLogRecord,
+    EventLogSink,
+)
+from swarmit.testbed.links import LinkState, LinkTracker
 from swarmit.testbed.logger import LOGGER
+from swarmit.testbed.logstore import EventLogStore
 from swarmit.testbed.protocol import (
+    BROADCAST_ADDRESS,
     DeviceType,
     PayloadCalibrationData,
     PayloadMessage,
@@ -34,6 +52,19 @@ from swarmit.testbed.protocol import (
     PayloadType,
     StatusType,
 )
+from swarmit.testbed.scheduler import FairLock
+from swarmit.testbed.selector import StatusIndex, select_devices
+from swarmit.testbed.simulator import SimulatedAdapter, SimulatorSettings
+from swarmit.testbed.stream import (
+    STATUS_STREAM_INTERVAL_DEFAULT,
+    EventLogBroadcaster,
+    StatusBroadcaster,
+)
+from swarmit.testbed.telemetry import (
+    Telemetry,
+    payload_type_name,
+    prometheus_metrics,
+)
 
 CHUNK_SIZE = 128
 COMMAND_TIMEOUT = 2
@@ -44,8 +75,9 @@ STATUS_TIMEOUT = 2
 MONITOR_TIMEOUT = 60  # s
 OTA_MAX_RETRIES_DEFAULT = 10
 OTA_ACK_TIMEOUT_DEFAULT = 0.7
+# the chunks of the devices with a marginal link are resent N times sooner
+OTA_MARGINAL_RETRY_FACTOR = 2
 SERIAL_PORT_DEFAULT = get_default_port()
-BROADCAST_ADDRESS = 0xFFFFFFFFFFFFFFFF
 VOLTAGE_MAX = 3000  # mV
 VOLTAGE_FULL = 2900  # mV
 VOLTAGE_WARNING = 1500  # mV
@@ -60,7 +92,8 @@ class NodeStatus:
     battery: int = 0
     pos_x: int = 0
     pos_y: int = 0
-    last_updated_at: float = 0
+    # not compared: a status that is only refreshed is not a change
+    last_updated_at: float = dataclasses.field(default=0, compare=False)
 
 
 @dataclass
@@ -83,6 +116,23 @@ class StartOtaData:
     retries: int = 0
 
 
+@dataclass
+class OtaPlan:
+    """Class that holds the devices admitted to an OTA, in waves."""
+
+    waves: list[list[str]] = dataclasses.field(default_factory=lambda: [])
+    # devices left out of the OTA, with the reason
+    skipped: dict[str, str] = dataclasses.field(default_factory=lambda: {})
+    # a single wave of the whole testbed, started with a broadcast
+    broadcast: bool = False
+    # devices with a poor link, their chunks are unicast
+    marginal: list[str] = dataclasses.field(default_factory=lambda: [])
+
+    @property
+    def devices(self) -> list[str]:
+        return [addr for wave in self.waves for addr in wave]
+
+
 @dataclass
 class Chunk:
     """Class that holds chunk status."""
@@ -103,6 +153,14 @@ class TransferDataStatus:
     chunks: list[Chunk] = dataclasses.field(default_factory=lambda: [])
     success: bool = False
 
+    def progress(self) -> dict:
+        """Return the chunks acknowledged and retried, and the outcome."""
+        return {
+            "acked": sum(chunk.acked for chunk in self.chunks),
+            "retries": sum(chunk.retries for chunk in self.chunks),
+            "success": self.success,
+        }
+
 
 @dataclass
 class ResetLocation:
@@ -120,6 +178,14 @@ def addr_to_hex(addr: int) -> str:
     return hexlify(addr.to_bytes(8, "big")).decode().upper()
 
 
+def battery_level(level: int) -> str:
+    if level > VOLTAGE_FULL:
+        return "full"
+    if level > VOLTAGE_WARNING:
+        return "ok"
+    return "low"
+
+
 def battery_level_color(level: int):
     if level > VOLTAGE_FULL:
         return "cyan"
@@ -128,6 +194,43 @@ def battery_level_color(level: int):
     return "red"
 
 
+def parse_lh2_calibration(calibration_file: bytes) -> list[bytes]:
+    """Return the homography matrices of a LH2 calibration file."""
+    matrix_size = 3 * 3 * 4  # 3x3, each element is 4 bytes (int32_t)
+    if not calibration_file:
+        raise ValueError("Calibration file is empty")
+
+    # Supported format: 1-byte count + N * 36 bytes
+    if (
+        len(calibration_file) < 1
+        or (len(calibration_file) - 1) % matrix_size != 0
+    ):
+        raise ValueError(
+            f"Invalid calibration file size: expected 1+N*{matrix_size} bytes (count byte + matrices)"
+        )
+
+    homography_count = calibration_file[0]
+    matrices_bytes = calibration_file[1:]
+    expected_count = len(matrices_bytes) // matrix_size
+    if homography_count != expected_count:
+        raise ValueError(
+            "Invalid calibration file: count byte does not match matrix payload length"
+        )
+    if homography_count == 0:
+        raise ValueError(
+            "Invalid calibration file: homography count cannot be zero"
+        )
+
+    if homography_count > 16:
+        raise ValueError(
+            "Invalid calibration file: homography count exceeds LH2 limit (16)"
+        )
+    return [
+        matrices_bytes[index * matrix_size : (index + 1) * matrix_size]
+        for index in range(homography_count)
+    ]
+
+
 def generate_status(status_data, devices=[], status_message="found"):
     data = {
         addr: device_data
@@ -200,14 +303,6 @@ def print_transfer_status(
             )
 
 
-def wait_for_done(timeout):
-    """Wait for the condition to be met."""
-    while timeout > 0:
-        timeout -= 0.01
-        time.sleep(0.01)
-    return False
-
-
 @dataclass
 class ControllerSettings:
     """Class that holds controller settings."""
@@ -218,14 +313,43 @@ class ControllerSettings:
     mqtt_port: int = 1883
     mqtt_use_tls: bool = False
     network_id: int = 1
-    adapter: str = "serial"  # or "mqtt", "marilib-edge", "marilib-cloud"
+    # several gateways shard the swarm when more than one is given
+    serial_ports: list[str] = dataclasses.field(default_factory=lambda: [])
+    network_ids: list[int] = dataclasses.field(default_factory=lambda: [])
+    adapter: str = "edge"  # or "cloud", "sim", "replay"
     devices: list[str] = dataclasses.field(default_factory=lambda: [])
     map_size: str = "2500x2500"
     # in mm; 0 = infer from map_size as min(w, h) / 5
     calibration_distance: int = 0
     ota_max_retries: int = OTA_MAX_RETRIES_DEFAULT
     ota_timeout: float = OTA_ACK_TIMEOUT_DEFAULT
+    # devices reporting a lower battery are not flashed, in mV, 0 to disable
+    ota_min_battery: int = VOLTAGE_WARNING
+    # devices flashed per wave, healthiest battery first, 0 for a single wave
+    ota_wave_size: int = 0
+    # s between the metrics probes of a device, 0 to not track the links
+    link_probe_period: float = 0
     adapter_wait_timeout: float = 3
+    # frames are recorded to the capture file, or replayed from it
+    capture_path: str = ""
+    replay_speed: float = 1  # 0 = as fast as possible
+    # directory of the event log files, empty to disable
+    eventlog_path: str = ""
+    # render one event log out of N on the console, 0 to disable
+    eventlog_console_sample: int = 1
+    # event log ingestion limits in records/s, 0 to disable
+    eventlog_device_rate: float = EVENTLOG_DEVICE_RATE_DEFAULT
+    eventlog_device_burst: int = EVENTLOG_DEVICE_BURST_DEFAULT
+    eventlog_global_rate: float = EVENTLOG_GLOBAL_RATE_DEFAULT
+    # SQLite file where event logs are indexed, empty to disable
+    logstore_path: str = ""
+    # period over which status changes streamed to the dashboard coalesce
+    status_stream_interval: float = STATUS_STREAM_INTERVAL_DEFAULT
+    # run the controller in its own process, apart from the dashboard
+    controller_process: bool = False
+    simulator: SimulatorSettings = dataclasses.field(
+        default_factory=SimulatorSettings
+    )
     verbose: bool = False
 
 
@@ -236,45 +360,167 @@ class Controller:
         self.logger = LOGGER.bind(__context=__name__)
         self.settings = settings
         self._interface: GatewayAdapterBase = None
+        self._send_lock = FairLock()
         self.status_data: dict[str, NodeStatus] = {}
+        # incremented on each change of status_data
+        self.status_version = 0
+        self._status_version_lock = threading.Lock()
+        self.status_index = StatusIndex()
         self.chunks: list[DataChunk] = []
         self.start_ota_data: StartOtaData = StartOtaData()
         self.transfer_data: dict[str, TransferDataStatus] = {}
         self._known_devices: dict[str, StatusType] = {}
+        # device -> time the start of the OTA was first sent to the device
+        self._ota_start_sent_at: dict[str, float] = {}
+        self._ota_canceled = threading.Event()
+        # (device, chunk index) -> time the chunk was last sent to the device
+        self._chunks_sent_at: dict[tuple[str, int], float] = {}
+        self.telemetry = Telemetry()
+        self.telemetry.gauge("devices", lambda: len(self.status_data))
+        self.telemetry.gauge("devices_by_status", self._devices_by_status)
+        self.telemetry.gauge("devices_battery", self._devices_battery)
+        self.telemetry.gauge("sends_queued", self._sends_queued)
+        self.links: LinkTracker = None
+        if self.settings.link_probe_period:
+            self.links = LinkTracker(self.settings.link_probe_period)
+            self.telemetry.gauge("devices_link", self.links.states)
+        # device -> command, sent at, statuses confirming the command
+        self._commands_sent_at: dict[
+            str, tuple[str, float, tuple[StatusType, ...]]
+        ] = {}
+        self.status_stream = StatusBroadcaster(
+            self.status_data, self.settings.status_stream_interval
+        )
+        self.telemetry.gauge(
+            "status_subscribers", lambda: len(self.status_stream.subscribers)
+        )
+        eventlog_outputs = []
+        if self.settings.eventlog_path:
+            eventlog_outputs.append(EventLogFile(self.settings.eventlog_path))
+        self.logstore: EventLogStore = None
+        if self.settings.logstore_path:
+            self.logstore = EventLogStore(self.settings.logstore_path)
+            eventlog_outputs.append(self.logstore)
+        if self.settings.eventlog_console_sample:
+            eventlog_outputs.append(
+                EventLogConsole(self.settings.eventlog_console_sample)
+            )
+        self.eventlog_stream = EventLogBroadcaster()
+        eventlog_outputs.append(self.eventlog_stream)
+        self.eventlog = EventLogSink(eventlog_outputs, self.telemetry)
+        self.eventlog_limiter = EventLogRateLimiter(
+            device_rate=self.settings.eventlog_device_rate,
+            device_burst=self.settings.eventlog_device_burst,
+            global_rate=self.settings.eventlog_global_rate,
+            telemetry=self.telemetry,
+        )
         self._stop_event = threading.Event()
         self._cleanup_thread = threading.Thread(
             target=self._cleanup_loop, daemon=True
         )
+        self._capture: CaptureWriter = None
+        if self.settings.capture_path and self.settings.adapter in (
+            "edge",
+            "cloud",
+        ):
+            self._capture = CaptureWriter(self.settings.capture_path)
         if self.settings.adapter == "cloud":
-            self._interface = MarilibCloudAdapter(
-                self.settings.mqtt_host,
-                self.settings.mqtt_port,
-                self.settings.mqtt_use_tls,
-                self.settings.network_id,
-                verbose=self.settings.verbose,
-                busy_wait_timeout=self.settings.adapter_wait_timeout,
-            )
+            adapters = [
+                MarilibCloudAdapter(
+                    self.settings.mqtt_host,
+                    self.settings.mqtt_port,
+                    self.settings.mqtt_use_tls,
+                    network_id,
+                    verbose=self.settings.verbose,
+                    busy_wait_timeout=self.settings.adapter_wait_timeout,
+                    capture=self._capture,
+                )
+                for network_id in (
+                    self.settings.network_ids or [self.settings.network_id]
+                )
+            ]
+        elif self.settings.adapter == "sim":
+            adapters = [
+                SimulatedAdapter(
+                    self.settings.simulator,
+                    verbose=self.settings.verbose,
+                    probe_period=self.settings.link_probe_period,
+                )
+            ]
+        elif self.settings.adapter == "replay":
+            adapters = [
+                ReplayAdapter(
+                    self.settings.capture_path,
+                    speed=self.settings.replay_speed,
+                    verbose=self.settings.verbose,
+                )
+            ]
         else:
-            self._interface = MarilibEdgeAdapter(
-                self.settings.serial_port,
-                self.settings.serial_baudrate,
-                verbose=self.settings.verbose,
-                busy_wait_timeout=self.settings.adapter_wait_timeout,
-            )
+            adapters = [
+                MarilibEdgeAdapter(
+                    serial_port,
+                    self.settings.serial_baudrate,
+                    verbose=self.settings.verbose,
+                    busy_wait_timeout=self.settings.adapter_wait_timeout,
+                    capture=self._capture,
+                    probe_period=self.settings.link_probe_period,
+                )
+                for serial_port in (
+                    self.settings.serial_ports or [self.settings.serial_port]
+                )
+            ]
+        if len(adapters) == 1:
+            self._interface = adapters[0]
+        else:
+            self._interface = MultiGatewayAdapter(adapters)
+            # the gateways take their frames in turn themselves
+            self._send_lock = contextlib.nullcontext()
         self._interface.init(self.on_frame_received)
         self._cleanup_thread.start()
+        self.status_stream.start()
 
     @property
     def known_devices(self) -> dict[str, StatusType]:
         """Return the known devices."""
         if not self._known_devices:
-            wait_for_done(COMMAND_TIMEOUT)
+            self._wait_for_devices(COMMAND_TIMEOUT)
             self._known_devices = self.status_data
         return self._known_devices
 
+    def _wait_for_devices(self, timeout: float):
+        """Wait until the status of all nodes known by the adapter is received.
+
+        Returns early as soon as the adapter is ready and each node reported
+        its status, waits the full timeout if the adapter doesn't know its
+        nodes.
+        """
+        deadline = time.monotonic() + timeout
+        ready = self.interface.wait_ready(timeout)
+        while time.monotonic() < deadline:
+            nodes = self.interface.node_addresses()
+            if (
+                nodes is not None
+                and (nodes or ready)
+                and all(f"{addr:08X}" in self.status_data for addr in nodes)
+            ):
+                break
+            time.sleep(0.01)
+
+    def select_devices(self, devices: list[str] | None) -> list[str] | None:
+        """Return the addresses of a device list, its selectors resolved
+        on the current status. None for the whole testbed."""
+        return select_devices(devices, self.status_index)
+
+    @property
+    def selected_devices(self) -> set[str] | None:
+        """Return the devices of the settings, None for the whole testbed."""
+        selected = self.select_devices(self.settings.devices)
+        return None if selected is None else set(selected)
+
     @property
     def running_devices(self) -> list[str]:
         """Return the running devices."""
+        selected = self.selected_devices
         return [
             addr
             for addr, node in self.known_devices.items()
@@ -283,39 +529,33 @@ class Controller:
                     node.status == StatusType.Running
                     or node.status == StatusType.Programming
                 )
-                and (
-                    not self.settings.devices or addr in self.settings.devices
-                )
+                and (selected is None or addr in selected)
             )
         ]
 
     @property
     def resetting_devices(self) -> list[str]:
         """Return the resetting devices."""
+        selected = self.selected_devices
         return [
             device_addr
             for device_addr, node in self.known_devices.items()
             if (
                 node.status == StatusType.Resetting
-                and (
-                    not self.settings.devices
-                    or device_addr in self.settings.devices
-                )
+                and (selected is None or device_addr in selected)
             )
         ]
 
     @property
     def ready_devices(self) -> list[str]:
         """Return the ready devices."""
+        selected = self.selected_devices
         return [
             device_addr
             for device_addr, node in self.known_devices.items()
             if (
                 node.status == StatusType.Bootloader
-                and (
-                    not self.settings.devices
-                    or device_addr in self.settings.devices
-                )
+                and (selected is None or device_addr in selected)
             )
         ]
 
@@ -327,6 +567,8 @@ class Controller:
     def _cleanup_loop(self):
         while not self._stop_event.is_set():
             self.cleanup_inactive(INACTIVE_TIMEOUT)
+            for record in self.eventlog_limiter.pending_markers():
+                self.eventlog.put(record)
             time.sleep(1)
 
     def cleanup_inactive(self, timeout):
@@ -338,20 +580,93 @@ class Controller:
         ]
         for addr in inactive:
             del self.status_data[addr]
+            self.status_index.remove(addr)
+            if self.links is not None:
+                self.links.remove(addr)
+        if inactive:
+            self._status_changed()
+            self.status_stream.wake()
+
+    def _status_changed(self):
+        with self._status_version_lock:
+            self.status_version += 1
 
     def terminate(self):
         """Terminate the controller."""
         self._stop_event.set()
         self._cleanup_thread.join()
+        self.status_stream.stop()
         self.interface.close()
+        self.eventlog.close()
+        if self._capture is not None:
+            self._capture.close()
 
     def send_payload(self, destination: int, payload: Payload):
-        """Send a frame to the devices."""
-        self.interface.send_payload(destination, payload)
+        """Send a frame to the devices.
+
+        Concurrent operations take turns, in the order they send.
+        """
+        with self._send_lock:
+            self.interface.send_payload(destination, payload)
+
+    def _sends_queued(self) -> int:
+        # the gateways of a multi-gateway adapter queue the sends themselves
+        return getattr(self._send_lock, "queued", 0)
+
+    def telemetry_snapshot(self) -> dict[str, dict]:
+        """Return the adapter and controller telemetry."""
+        return {
+            "adapter": self.interface.telemetry.snapshot(),
+            "controller": {
+                **self.telemetry.snapshot(),
+                "eventlog_top_limited": self.eventlog_limiter.top_limited(),
+            },
+        }
+
+    def metrics(self) -> str:
+        """Return the adapter and controller telemetry, Prometheus format."""
+        telemetries = {"controller": self.telemetry}
+        if self.interface is not None:
+            telemetries["adapter"] = self.interface.telemetry
+        return prometheus_metrics(telemetries)
+
+    def _devices_by_status(self) -> dict[str, int]:
+        counts = {status.name: 0 for status in StatusType}
+        for node in list(self.status_data.values()):
+            counts[node.status.name] += 1
+        return counts
+
+    def _devices_battery(self) -> dict[str, int]:
+        counts = {"full": 0, "ok": 0, "low": 0}
+        for node in list(self.status_data.values()):
+            counts[battery_level(node.battery)] += 1
+        return counts
+
+    def _command_sent(
+        self, devices: list[str], command: str, statuses: tuple[StatusType]
+    ):
+        """Time the confirmation of a command by the devices status."""
+        now = time.time()
+        for device_addr in devices:
+            self._commands_sent_at[device_addr] = (command, now, statuses)
+
+    def _command_confirmed(self, device_addr: str, status: NodeStatus):
+        command = self._commands_sent_at.get(device_addr)
+        if command is None or status.status not in command[2]:
+            return
+        self._commands_sent_at.pop(device_addr, None)
+        self.telemetry.observe(
+            "command_confirm_latency",
+            status.last_updated_at - command[1],
+            label=command[0],
+        )
 
     def on_frame_received(self, header, packet: Packet):
         """Handle the received frame."""
         device_addr = f"{header.source:08X}"
+        self.telemetry.count(
+            "frames_handled", payload_type_name(packet.payload_type)
+        )
         if packet.payload_type == PayloadType.SWARMIT_STATUS:
             now = time.time()
             status = NodeStatus(
@@ -362,12 +677,25 @@ class Controller:
                 pos_y=packet.payload.pos_y,
                 last_updated_at=now,
             )
+            previous = self.status_data.get(device_addr)
             self.status_data.update({device_addr: status})
+            self.status_index.update(device_addr, status)
+            if previous != status:
+                self._status_changed()
+            if previous is None or previous.status != status.status:
+                # Only position and battery updates wait to be coalesced
+                self.status_stream.wake()
+                self._command_confirmed(device_addr, status)
         elif (
             packet.payload_type == PayloadType.SWARMIT_OTA_START_ACK
             and device_addr not in self.start_ota_data.addrs
         ):
             self.start_ota_data.addrs.append(device_addr)
+            sent_at = self._ota_start_sent_at.pop(device_addr, None)
+            if sent_at is not None:
+                self.telemetry.observe(
+                    "ota_start_ack_latency", time.time() - sent_at
+                )
         elif packet.payload_type == PayloadType.SWARMIT_OTA_CHUNK_ACK:
             try:
                 acked = bool(
@@ -386,20 +714,31 @@ class Controller:
                 self.transfer_data[device_addr].chunks[
                     packet.payload.index
                 ].acked = 1
+                sent_at = self._chunks_sent_at.pop(
+                    (device_addr, packet.payload.index), None
+                )
+                if sent_at is not None:
+                    self.telemetry.observe(
+                        "ota_chunk_ack_latency", time.time() - sent_at
+                    )
+        elif (
+            packet.payload_type == PayloadType.METRICS_PROBE
+            and self.links is not None
+        ):
+            self.links.record(device_addr, packet.payload)
         elif packet.payload_type == PayloadType.SWARMIT_EVENT_LOG:
-            if (
-                self.settings.devices
-                and device_addr not in self.settings.devices
-            ):
+            selected = self.selected_devices
+            if selected is not None and device_addr not in selected:
                 return
-            logger = self.logger.bind(
-                device_addr=device_addr,
-                notification=PayloadType(packet.payload_type).name,
-                timestamp=packet.payload.timestamp,
-                data_size=packet.payload.count,
-                data=packet.payload.data,
-            )
-            logger.info("LOG event")
+            for record in self.eventlog_limiter.admit(
+                EventLogRecord(
+                    device=device_addr,
+                    timestamp=packet.payload.timestamp,
+                    received_at=time.time(),
+                    data=bytes(packet.payload.data),
+                )
+            ):
+                self.eventlog.put(record)
 
     def _live_status(self, timeout, devices=[], message="found", watch=False):
         """Request the live status of the testbed."""
@@ -418,7 +757,11 @@ class Controller:
 
     def status(self, timeout=STATUS_TIMEOUT, watch=False):
         """Request the status of the testbed."""
-        self._live_status(timeout, devices=self.settings.devices, watch=watch)
+        self._live_status(
+            timeout,
+            devices=self.select_devices(self.settings.devices) or [],
+            watch=watch,
+        )
 
     def _send_start(self, device_addr: str):
         payload = PayloadStart()
@@ -427,20 +770,22 @@ class Controller:
     def start(self, devices=None, timeout=COMMAND_TIMEOUT):
         """Start the application."""
         if devices is None:
-            devices = self.settings.devices or []
+            devices = self.settings.devices
+        devices = self.select_devices(devices)
         ready_devices = self.ready_devices
         devices_to_start = (
             ready_devices
-            if not devices
+            if devices is None
             else [d for d in devices if d in ready_devices]
         )
+        self._command_sent(devices_to_start, "start", (StatusType.Running,))
         attempts = 0
         while attempts < COMMAND_MAX_ATTEMPTS and not all(
             addr in self.status_data
             and self.status_data[addr].status == StatusType.Running
             for addr in devices_to_start
         ):
-            if not devices:
+            if devices is None:
                 self._send_start(addr_to_hex(BROADCAST_ADDRESS))
             else:
                 for device_addr in devices_to_start:
@@ -450,25 +795,31 @@ class Controller:
         self._live_status(
             timeout, devices=devices_to_start, message="to start"
         )
+        return devices_to_start
 
     def stop(self, devices=None, timeout=COMMAND_TIMEOUT):
         """Stop the application."""
         if devices is None:
-            devices = self.settings.devices or []
+            devices = self.settings.devices
+        devices = self.select_devices(devices)
         stoppable_devices = self.running_devices + self.resetting_devices
         devices_to_stop = (
             stoppable_devices
-            if not devices
+            if devices is None
             else [d for d in devices if d in stoppable_devices]
         )
-
+        self._command_sent(
+            devices_to_stop,
+            "stop",
+            (StatusType.Stopping, StatusType.Bootloader),
+        )
         attempts = 0
         while attempts < COMMAND_MAX_ATTEMPTS and not all(
             self.status_data[addr].status
             in [StatusType.Stopping, StatusType.Bootloader]
             for addr in devices_to_stop
         ):
-            if not devices:
+            if devices is None:
                 self.send_payload(BROADCAST_ADDRESS, PayloadStop())
             else:
                 for device_addr in devices_to_stop:
@@ -476,6 +827,7 @@ class Controller:
             attempts += 1
             time.sleep(COMMAND_ATTEMPT_DELAY)
         self._live_status(timeout, devices=devices_to_stop, message="to stop")
+        return devices_to_stop
 
     def _send_reset(self, device_addr: int, location: ResetLocation):
         payload = PayloadReset(
@@ -484,16 +836,54 @@ class Controller:
         )
         self.send_payload(device_addr, payload)
 
-    def reset(self, locations: dict[str, ResetLocation]):
+    def reset(
+        self, locations: dict[str, ResetLocation], devices: list[str] = None
+    ) -> dict:
         """Reset the application."""
+        if devices is None:
+            devices = self.settings.devices
+        devices = self.select_devices(devices) or []
         ready_devices = self.ready_devices
-        for device_addr in self.settings.devices:
+        sent = []
+        for device_addr in devices:
             if device_addr not in ready_devices:
                 continue
             print(
                 f"Resetting device {device_addr} with location {locations[device_addr]}"
             )
             self._send_reset(int(device_addr, 16), locations[device_addr])
+            sent.append(device_addr)
+        return {
+            "devices": sent,
+            "skipped": [addr for addr in devices if addr not in sent],
+            "broadcast": False,
+        }
+
+    def _fan_out(
+        self, devices: list[str], eligible: list[str]
+    ) -> tuple[list[int], dict]:
+        """Return the destinations reaching the eligible devices among
+        `devices`, and a report of the devices reached.
+
+        None means the whole testbed. A single broadcast frame replaces the
+        unicast frames when all known devices are reached.
+        """
+        if devices is None:
+            return [BROADCAST_ADDRESS], {
+                "devices": eligible,
+                "skipped": [],
+                "broadcast": True,
+            }
+        targets = [addr for addr in devices if addr in eligible]
+        report = {
+            "devices": targets,
+            "skipped": [addr for addr in devices if addr not in eligible],
+            "broadcast": False,
+        }
+        if len(targets) > 1 and set(targets) == set(self.status_data):
+            report["broadcast"] = True
+            return [BROADCAST_ADDRESS], report
+        return [int(addr, 16) for addr in targets], report
 
     def monitor(
         self, timeout: float = MONITOR_TIMEOUT, run_forever: bool = True
@@ -511,80 +901,54 @@ class Controller:
         )
         self.send_payload(device_addr, payload)
 
-    def send_message(self, message):
+    def send_message(self, message, devices: list[str] = None) -> dict:
         """Send a message to the devices."""
-        running_devices = self.running_devices
-        if not self.settings.devices:
-            self._send_message(BROADCAST_ADDRESS, message)
-        else:
-            for addr in self.settings.devices:
-                if addr not in running_devices:
-                    continue
-                self._send_message(int(addr, 16), message)
-
-    def send_lh2_calibration(self, calibration_file: bytes):
-        matrix_size = 3 * 3 * 4  # 3x3, each element is 4 bytes (int32_t)
-        if not calibration_file:
-            raise ValueError("Calibration file is empty")
-
-        # Supported format: 1-byte count + N * 36 bytes
-        if (
-            len(calibration_file) < 1
-            or (len(calibration_file) - 1) % matrix_size != 0
-        ):
-            raise ValueError(
-                f"Invalid calibration file size: expected 1+N*{matrix_size} bytes (count byte + matrices)"
-            )
-
-        homography_count = calibration_file[0]
-        matrices_bytes = calibration_file[1:]
-        expected_count = len(matrices_bytes) // matrix_size
-        if homography_count != expected_count:
-            raise ValueError(
-                "Invalid calibration file: count byte does not match matrix payload length"
-            )
-        if homography_count == 0:
-            raise ValueError(
-                "Invalid calibration file: homography count cannot be zero"
-            )
-
-        if homography_count > 16:
-            raise ValueError(
-                "Invalid calibration file: homography count exceeds LH2 limit (16)"
-            )
+        if devices is None:
+            devices = self.settings.devices
+        devices = self.select_devices(devices)
+        destinations, report = self._fan_out(devices, self.running_devices)
+        for destination in destinations:
+            self._send_message(destination, message)
+        return report
+
+    def send_lh2_calibration(
+        self, calibration_file: bytes, devices: list[str] = None
+    ) -> dict:
+        matrices = parse_lh2_calibration(calibration_file)
+        homography_count = len(matrices)
 
         ready_devices = self.ready_devices
-        if not ready_devices:
+        devices = self.select_devices(devices)
+        if devices is None:
+            devices = ready_devices
+        destinations, report = self._fan_out(devices, ready_devices)
+        if report["broadcast"]:
             print(
                 f"Sending {homography_count} calibration matrix/matrices to {BROADCAST_ADDRESS}..."
             )
         else:
             print(
-                f"Sending {homography_count} calibration matrix/matrices to {len(ready_devices)} devices: {str(ready_devices)}..."
+                f"Sending {homography_count} calibration matrix/matrices to {len(report['devices'])} devices: {str(report['devices'])}..."
             )
 
-        for homography_index in range(homography_count):
+        for homography_index, homography in enumerate(matrices):
             print(f"Sending calibration matrix {homography_index}...")
-            start = homography_index * matrix_size
-            end = start + matrix_size
             payload = PayloadCalibrationData(
                 homography_count=homography_count,
                 homography_index=homography_index,
-                homography=matrices_bytes[start:end],
+                homography=homography,
             )
             if self.settings.verbose:
                 print(payload)
                 print(Packet.from_payload(payload).to_bytes())
             for _ in range(COMMAND_MAX_ATTEMPTS):
                 # simple strategy to bypass non-reliable link layer, just send the payload multiple times
-                if not ready_devices:
-                    self.send_payload(BROADCAST_ADDRESS, payload)
-                else:
-                    for device_addr in ready_devices:
-                        self.send_payload(int(device_addr, 16), payload)
+                for destination in destinations:
+                    self.send_payload(destination, payload)
                 time.sleep(
                     0.3
                 )  # give the device some time to process the payload
+        return report
 
     def _send_start_ota(
         self, device_addr: str, devices_to_flash: set[str], firmware: bytes
@@ -601,25 +965,103 @@ class Controller:
             fw_length=len(firmware),
             fw_chunk_count=len(self.chunks),
         )
+        recipients = (
+            devices_to_flash
+            if int(device_addr, 16) == BROADCAST_ADDRESS
+            else [device_addr]
+        )
         send_time = time.time()
+        # the latency includes the retries
+        for addr in recipients:
+            self._ota_start_sent_at.setdefault(addr, send_time)
         send = True
+        # counted per device, the unicast notifications are sent in turn
+        retries_count = 0
         while (
             not is_start_ota_acknowledged()
-            and self.start_ota_data.retries <= self.settings.ota_max_retries
+            and retries_count <= self.settings.ota_max_retries
+            and not self._ota_canceled.is_set()
         ):
             if send is True:
                 self.send_payload(int(device_addr, 16), payload)
                 send_time = time.time()
                 self.start_ota_data.retries += 1
+                retries_count += 1
             time.sleep(0.001)
             send = time.time() - send_time > self.settings.ota_timeout
 
+    def _link_state(self, addr: str) -> LinkState:
+        if self.links is None:
+            return LinkState.Unknown
+        return self.links.state(addr)
+
+    def _plan_ota(self, devices: list[str] | None) -> OtaPlan:
+        ready = devices is None
+        if ready:
+            devices = self.ready_devices
+        min_battery = self.settings.ota_min_battery
+        plan = OtaPlan()
+        admitted = []
+        for addr in devices:
+            node = self.status_data.get(addr)
+            link = self._link_state(addr)
+            # 0 is reported by the devices not measuring their battery
+            if node is not None and 0 < node.battery < min_battery:
+                plan.skipped[addr] = (
+                    f"battery {node.battery}mV below {min_battery}mV"
+                )
+            elif link == LinkState.OutOfRange:
+                plan.skipped[addr] = (
+                    f"link delivery {self.links.links[addr].delivery:.0%} "
+                    "out of range"
+                )
+            else:
+                admitted.append(addr)
+                if link == LinkState.Marginal:
+                    plan.marginal.append(addr)
+        admitted.sort(
+            key=lambda addr: -(
+                self.status_data[addr].battery
+                if addr in self.status_data
+                else 0
+            )
+        )
+        size = self.settings.ota_wave_size or len(admitted)
+        plan.waves = [
+            admitted[index : index + size]
+            for index in range(0, len(admitted), max(size, 1))
+        ]
+        plan.broadcast = ready and not plan.skipped and len(plan.waves) <= 1
+        return plan
+
+    def plan_ota(self, devices=None) -> OtaPlan:
+        """Admit the devices to flash and schedule them in waves.
+
+        A device browning out during the transfer wastes the airtime spent
+        on it, the devices whose battery is under `ota_min_battery` are
+        skipped. The others are flashed healthiest first, the weakest in
+        the last waves. With the links tracked, the devices out of range
+        are skipped too and the marginal ones listed.
+        """
+        if devices is None:
+            devices = self.settings.devices
+        return self._plan_ota(self.select_devices(devices))
+
     def start_ota(self, firmware, devices=None) -> dict:
         """Start the OTA process."""
         if devices is None:
-            devices = self.settings.devices or []
+            devices = self.settings.devices
+        plan = self._plan_ota(self.select_devices(devices))
+        if not plan.broadcast:
+            # a broadcast would also start the skipped devices
+            devices = plan.devices
+        else:
+            devices = None
+        self._ota_canceled.clear()
         self.start_ota_data = StartOtaData()
         self.chunks = []
+        self._ota_start_sent_at = {}
+        self._chunks_sent_at = {}
         digest = hashes.Hash(hashes.SHA256())
         chunks_count = int(len(firmware) / CHUNK_SIZE) + int(
             len(firmware) % CHUNK_SIZE != 0
@@ -651,14 +1093,18 @@ class Controller:
             )
         self.start_ota_data.fw_hash = digest.finalize()
         self.start_ota_data.chunks = len(self.chunks)
-        devices_to_flash = self.ready_devices
-        if not devices:
+        devices_to_flash = plan.devices
+        for addr, reason in plan.skipped.items():
+            print(f"Skipping {addr}, {reason}")
+        if devices is None:
             print("Broadcast start ota notification...")
             self._send_start_ota(
                 addr_to_hex(BROADCAST_ADDRESS), devices_to_flash, firmware
             )
         else:
             for addr in devices:
+                if self._ota_canceled.is_set():
+                    break
                 print(f"Sending start ota notification to {addr}...")
                 self._send_start_ota(addr, devices, firmware)
                 time.sleep(0.2)
@@ -666,8 +1112,9 @@ class Controller:
             "ota": self.start_ota_data,
             "acked": sorted(self.start_ota_data.addrs),
             "missed": sorted(
-                set(devices).difference(set(self.start_ota_data.addrs))
+                set(devices or []).difference(set(self.start_ota_data.addrs))
             ),
+            "skipped": plan.skipped,
         }
 
     def send_chunk(
@@ -675,16 +1122,20 @@ class Controller:
         chunk: DataChunk,
         device_addr: str,
         devices_to_flash: set[str],
+        timeout: float = None,
+        max_retries: int = None,
     ):
+        if timeout is None:
+            timeout = self.settings.ota_timeout
+        if max_retries is None:
+            max_retries = self.settings.ota_max_retries
+
         def is_chunk_acknowledged():
             if int(device_addr, 16) == BROADCAST_ADDRESS:
-                return sorted(self.transfer_data.keys()) == sorted(
-                    devices_to_flash
-                ) and all(
-                    [
-                        status.chunks[chunk.index].acked
-                        for status in self.transfer_data.values()
-                    ]
+                return all(
+                    addr in self.transfer_data
+                    and self.transfer_data[addr].chunks[chunk.index].acked
+                    for addr in devices_to_flash
                 )
             else:
                 return (
@@ -700,14 +1151,23 @@ class Controller:
             sha=chunk.sha,
             chunk=chunk.data,
         )
+        recipients = (
+            devices_to_flash
+            if int(device_addr, 16) == BROADCAST_ADDRESS
+            else [device_addr]
+        )
         send_time = time.time()
         send = True
         retries_count = 0
         while (
             not is_chunk_acknowledged()
-            and retries_count <= self.settings.ota_max_retries
+            and retries_count <= max_retries
+            and not self._ota_canceled.is_set()
         ):
             if send is True:
+                sent_at = time.time()
+                for addr in recipients:
+                    self._chunks_sent_at[(addr, chunk.index)] = sent_at
                 self.send_payload(int(device_addr, 16), payload)
                 if self.settings.verbose:
                     missing_acks = [
@@ -735,7 +1195,26 @@ class Controller:
                 send_time = time.time()
                 retries_count += 1
             time.sleep(0.001)
-            send = time.time() - send_time > self.settings.ota_timeout
+            send = time.time() - send_time > timeout
+
+    def cancel_ota(self):
+        """Interrupt the OTA in progress, the transfer fails."""
+        self._ota_canceled.set()
+
+    def transfer_progress(self) -> dict[str, dict]:
+        """Return the progress of the transfer in progress, per device."""
+        return {
+            addr: status.progress()
+            for addr, status in list(self.transfer_data.items())
+        }
+
+    def _partition(self, devices: list[str]) -> list[list[str]]:
+        """Group the devices by the gateway they are reachable through."""
+        addresses = {int(addr, 16): addr for addr in devices}
+        return [
+            [addresses[address] for address in group]
+            for group in self.interface.partition(list(addresses))
+        ]
 
     def transfer(self, firmware, devices) -> dict[str, TransferDataStatus]:
         """Transfer the firmware to the devices."""
@@ -759,18 +1238,52 @@ class Controller:
                 Chunk(index=f"{i:03d}", size=f"{self.chunks[i].size:03d}B")
                 for i in range(len(self.chunks))
             ]
+        marginal = {
+            addr
+            for addr in devices
+            if self._link_state(addr) == LinkState.Marginal
+        }
+        # a single device acknowledges a unicast chunk, it is resent sooner
+        # and more often, within the same time
+        marginal_window = (
+            self.settings.ota_timeout / OTA_MARGINAL_RETRY_FACTOR,
+            self.settings.ota_max_retries * OTA_MARGINAL_RETRY_FACTOR,
+        )
+        broadcast = not self.settings.devices and len(marginal) < len(devices)
+        if broadcast:
+            # the chunks the devices with a poor link missed are unicast
+            reliable = [addr for addr in devices if addr not in marginal]
+            groups = self._partition(sorted(marginal)) if marginal else []
+        else:
+            groups = self._partition(devices)
+        # Each gateway transfers the chunks to its own devices in parallel
+        executor = ThreadPoolExecutor(max_workers=max(len(groups), 1))
         for chunk in self.chunks:
-            if not self.settings.devices:
+            if self._ota_canceled.is_set():
+                break
+            if broadcast:
                 self.send_chunk(
                     chunk,
                     addr_to_hex(BROADCAST_ADDRESS),
-                    devices,
+                    reliable,
                 )
-            else:
-                for _addr in devices:
-                    self.send_chunk(chunk, _addr, devices)
+            list(
+                executor.map(
+                    lambda group: [
+                        self.send_chunk(
+                            chunk,
+                            _addr,
+                            devices,
+                            *(marginal_window if _addr in marginal else ()),
+                        )
+                        for _addr in group
+                    ],
+                    groups,
+                )
+            )
             if use_progress_bar:
                 progress.update(chunk.size)
+        executor.shutdown()
         if self.settings.verbose:
             retries_count = sum(
                 self.transfer_data[_addr].chunks[_chunk].retries
@@ -0,0 +1,297 @@
+"""Module containing the event log pipeline of the devices."""
+
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+from swarmit.testbed.logger import LOGGER
+from swarmit.testbed.telemetry import Telemetry
+
+EVENTLOG_QUEUE_SIZE = 65536
+EVENTLOG_BATCH_SIZE = 1024
+EVENTLOG_MAX_FILE_SIZE = 16 * 1024 * 1024  # uncompressed bytes
+EVENTLOG_MAX_FILES = 100
+EVENTLOG_DEVICE_RATE_DEFAULT = 0  # records/s, the devices aren't limited
+EVENTLOG_DEVICE_BURST_DEFAULT = 100  # records
+EVENTLOG_GLOBAL_RATE_DEFAULT = 5000  # records/s
+EVENTLOG_TOP_LIMITED = 10  # devices reported as the most rate limited
+
+
+@dataclass
+class EventLogRecord:
+    """Class that holds an event log sent by a device."""
+
+    device: str
+    timestamp: int  # device timestamp
+    received_at: float
+    data: bytes
+
+    def to_dict(self) -> dict:
+        return {
+            "device": self.device,
+            "timestamp": self.timestamp,
+            "received_at": self.received_at,
+            "data": self.data.decode(errors="backslashreplace"),
+        }
+
+
+class TokenBucket:
+    """Token bucket, refilled at `rate` tokens per second up to `capacity`."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class EventLogRateLimiter:
+    """Per-device and global rate limits of the event log ingestion.
+
+    Bursts are accepted up to the bucket capacity, so the first records of
+    a burst are kept. The records dropped for a device are summarized in a
+    marker record, emitted with the next accepted record of the device or
+    by `pending_markers`. A rate of 0 disables the corresponding limit.
+    """
+
+    def __init__(
+        self,
+        device_rate: float = EVENTLOG_DEVICE_RATE_DEFAULT,
+        device_burst: int = EVENTLOG_DEVICE_BURST_DEFAULT,
+        global_rate: float = EVENTLOG_GLOBAL_RATE_DEFAULT,
+        telemetry: Telemetry = None,
+    ):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.telemetry = telemetry or Telemetry()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._global_bucket = None
+        if global_rate:
+            self._global_bucket = TokenBucket(
+                global_rate, global_rate, time.monotonic()
+            )
+        self._dropped: dict[str, int] = {}
+        # records dropped per device since the start, too many devices to
+        # label the counter with
+        self._limited: Counter = Counter()
+        # the records are admitted by the gateway threads, the markers are
+        # collected by the cleanup thread
+        self._lock = threading.Lock()
+
+    def _marker(self, device: str, timestamp: int) -> EventLogRecord | None:
+        dropped = self._dropped.pop(device, 0)
+        if not dropped:
+            return None
+        return EventLogRecord(
+            device=device,
+            timestamp=timestamp,
+            received_at=time.time(),
+            data=f"<{dropped} records dropped>".encode(),
+        )
+
+    def _drop(self, device: str, limit: str):
+        self._dropped[device] = self._dropped.get(device, 0) + 1
+        self._limited[device] += 1
+        self.telemetry.count("eventlog_rate_limited", limit)
+
+    def admit(self, record: EventLogRecord) -> list[EventLogRecord]:
+        """Return the records to ingest: none, the record, or a marker and
+        the record."""
+        with self._lock:
+            return self._admit(record)
+
+    def _admit(self, record: EventLogRecord) -> list[EventLogRecord]:
+        now = time.monotonic()
+        if self.device_rate:
+            bucket = self._buckets.get(record.device)
+            if bucket is None:
+                bucket = self._buckets[record.device] = TokenBucket(
+                    self.device_rate, self.device_burst, now
+                )
+            if not bucket.take(now):
+                self._drop(record.device, "device")
+                return []
+        if self._global_bucket is not None and not self._global_bucket.take(
+            now
+        ):
+            self._drop(record.device, "global")
+            return []
+        marker = self._marker(record.device, record.timestamp)
+        if marker is not None:
+            return [marker, record]
+        return [record]
+
+    def top_limited(self, count: int = EVENTLOG_TOP_LIMITED) -> dict[str, int]:
+        """Return the devices with the most records dropped."""
+        with self._lock:
+            return dict(self._limited.most_common(count))
+
+    def pending_markers(self) -> list[EventLogRecord]:
+        """Return the markers of the records dropped since the last call."""
+        with self._lock:
+            markers = [
+                self._marker(device, 0) for device in list(self._dropped)
+            ]
+        return [marker for marker in markers if marker is not None]
+
+
+class EventLogFile:
+    """Rotating, gzip compressed, newline-delimited JSON event log files."""
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int = EVENTLOG_MAX_FILE_SIZE,
+        max_files: int = EVENTLOG_MAX_FILES,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_files = max_files
+        self.files: list[str] = []
+        self._index = 0
+        self._file = None
+        self._size = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        path = os.path.join(
+            self.directory,
+            f"eventlog-{time.strftime('%Y%m%d-%H%M%S')}-{self._index:04d}"
+            ".ndjson.gz",
+        )
+        self._index += 1
+        self._file = gzip.open(path, "ab")
+        self._size = 0
+        self.files.append(path)
+        while len(self.files) > self.max_files:
+            os.remove(self.files.pop(0))
+
+    def __call__(self, records: list[EventLogRecord]):
+        if self._file is None:
+            self._open()
+        data = b"".join(
+            json.dumps(record.to_dict(), separators=(",", ":")).encode()
+            + b"\n"
+            for record in records
+        )
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        if self._size >= self.max_size:
+            self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class EventLogConsole:
+    """Render one event log out of `sample` on the console."""
+
+    def __init__(self, sample: int = 1):
+        self.logger = LOGGER.bind(__context=__name__)
+        self.sample = sample
+        self._count = 0
+
+    def __call__(self, records: list[EventLogRecord]):
+        for record in records:
+            self._count += 1
+            if self._count % self.sample:
+                continue
+            self.logger.bind(
+                device_addr=record.device,
+                notification="SWARMIT_EVENT_LOG",
+                timestamp=record.timestamp,
+                data_size=len(record.data),
+                data=record.data,
+            ).info("LOG event")
+
+
+def read_eventlog(path: str):
+    """Yield the records of an event log file, in order."""
+    with gzip.open(path, "rt") as eventlog:
+        for line in eventlog:
+            yield json.loads(line)
+
+
+class EventLogSink:
+    """Batched event log pipeline.
+
+    The radio receive thread only enqueues the records, a background thread
+    hands them in batches to the outputs (callables taking a list of
+    records). Records are dropped, and counted, when the queue is full.
+    """
+
+    def __init__(
+        self,
+        outputs: list[callable],
+        telemetry: Telemetry = None,
+        queue_size: int = EVENTLOG_QUEUE_SIZE,
+        batch_size: int = EVENTLOG_BATCH_SIZE,
+    ):
+        self.logger = LOGGER.bind(__context=__name__)
+        self.outputs = outputs
+        self.telemetry = telemetry or Telemetry()
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.telemetry.gauge("eventlog_queued", self._queue.qsize)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, record: EventLogRecord):
+        """Enqueue a record, never blocks."""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.telemetry.count("eventlog_dropped")
+
+    def _write(self, batch: list[EventLogRecord]):
+        for output in self.outputs:
+            try:
+                output(batch)
+            except Exception as exc:
+                self.logger.warning("Event log output failed", error=str(exc))
+        self.telemetry.count("eventlog_records", value=len(batch))
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            batch = []
+            while record is not None:
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            if record is None:
+                break
+
+    def close(self):
+        """Write the pending records and close the outputs."""
+        self._queue.put(None)
+        self._thread.join()
+        for output in self.outputs:
+            if hasattr(output, "close"):
+                output.close()
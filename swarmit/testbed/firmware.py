@@ -0,0 +1,85 @@
+"""Module containing the content-addressed store of the firmware images."""
+
+import functools
+import hashlib
+import os
+import re
+import tempfile
+
+from anyio import to_thread
+
+FIRMWARE_MAX_SIZE = 2 * 1024 * 1024  # bytes
+FIRMWARE_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+class FirmwareTooLarge(Exception):
+    """Raised when an uploaded image exceeds the maximum size."""
+
+
+class FirmwareEmpty(Exception):
+    """Raised when an uploaded image is empty."""
+
+
+class FirmwareStore:
+    """Firmware images stored on disk under their SHA-256 hash.
+
+    Uploads are written to a temporary file while being hashed, then moved
+    in place, so a stored image is always complete. The file operations run
+    in worker threads, off the event loop.
+    """
+
+    def __init__(self, directory: str, max_size: int = FIRMWARE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, fw_hash: str) -> str:
+        if not FIRMWARE_HASH_PATTERN.match(fw_hash):
+            raise ValueError(f"invalid firmware hash: {fw_hash}")
+        return os.path.join(self.directory, f"{fw_hash}.bin")
+
+    def size(self, fw_hash: str) -> int | None:
+        """Return the size of a stored image, None if it is unknown."""
+        try:
+            return os.path.getsize(self.path(fw_hash))
+        except FileNotFoundError:
+            return None
+
+    def load(self, fw_hash: str) -> bytearray:
+        """Return a stored image, raise FileNotFoundError if unknown."""
+        with open(self.path(fw_hash), "rb") as image:
+            return bytearray(image.read())
+
+    async def store(self, chunks) -> tuple[str, int]:
+        """Store the image streamed by an async iterator of bytes.
+
+        Return its hash and size.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = await to_thread.run_sync(
+            functools.partial(
+                tempfile.mkstemp, dir=self.directory, suffix=".tmp"
+            )
+        )
+        try:
+            image = os.fdopen(fd, "wb")
+            try:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise FirmwareTooLarge(
+                            f"firmware larger than {self.max_size} bytes"
+                        )
+                    digest.update(chunk)
+                    await to_thread.run_sync(image.write, chunk)
+            finally:
+                await to_thread.run_sync(image.close)
+            if not size:
+                raise FirmwareEmpty("empty firmware")
+            fw_hash = digest.hexdigest()
+            await to_thread.run_sync(os.replace, tmp_path, self.path(fw_hash))
+        except BaseException:
+            await to_thread.run_sync(os.remove, tmp_path)
+            raise
+        return fw_hash, size
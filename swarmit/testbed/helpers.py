@@ -1,5 +1,18 @@
+import json
 import tomllib
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def json_dumps(data) -> bytes:
+    """Serialize to compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
 
 def load_toml_config(path):
     if not path:
@@ -0,0 +1,337 @@
+"""Module containing the flash jobs run in the background of the dashboard."""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from enum import Enum
+
+from anyio import to_thread
+
+from swarmit.testbed.controller import Controller
+from swarmit.testbed.logger import LOGGER
+from swarmit.testbed.scheduler import (
+    ALL_DEVICES,
+    DeviceLeases,
+    LeaseConflict,
+)
+from swarmit.testbed.stream import StreamSubscriber
+from swarmit.testbed.telemetry import DURATION_BUCKETS, Telemetry
+
+FLASH_PROGRESS_PERIOD = 0.5  # s
+FLASH_JOBS_KEPT = 100  # finished jobs kept for status queries
+
+
+class JobState(Enum):
+    """States of a flash job."""
+
+    Pending = "pending"
+    Starting = "starting"
+    Transferring = "transferring"
+    Done = "done"
+    Failed = "failed"
+    Canceled = "canceled"
+
+
+FINISHED_STATES = (JobState.Done, JobState.Failed, JobState.Canceled)
+FINISHED_STATE_VALUES = {state.value for state in FINISHED_STATES}
+
+
+class FlashJob:
+    """Flash of a firmware on a set of devices, run by the job manager."""
+
+    def __init__(self, firmware: bytearray, devices: list[str] = None):
+        self.id = uuid.uuid4().hex
+        self.firmware = firmware
+        self.firmware_size = len(firmware)
+        self.devices = devices
+        self.state = JobState.Pending
+        self.error: str = None
+        self.created_at = time.time()
+        self.started_at: float = None
+        self.transfer_started_at: float = None
+        self.finished_at: float = None
+        self.chunks = 0
+        self.acked: list[str] = []
+        self.missed: list[str] = []
+        # devices left out of the flash, with the reason
+        self.skipped: dict[str, str] = {}
+        # devices with a poor link, their chunks are unicast
+        self.marginal: list[str] = []
+        self.waves = 0
+        # of the waves transferred, the next job resets the controller's
+        self.transfer_data: dict = {}
+        self.canceled = threading.Event()
+        self.subscribers: list[StreamSubscriber] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def progress(self, controller: Controller) -> dict:
+        """Return the per-device chunk progress, retries and ETA."""
+        transfer_progress = {
+            addr: transfer.progress()
+            for addr, transfer in self.transfer_data.items()
+        }
+        if self.state == JobState.Transferring:
+            # only the counts, not the chunks, cross the controller process
+            transfer_progress.update(controller.transfer_progress())
+        devices = {}
+        acked_total = 0
+        if self.transfer_started_at is not None:
+            for addr in self.acked:
+                transfer = transfer_progress.get(addr)
+                if transfer is None:
+                    continue
+                acked_total += transfer["acked"]
+                devices[addr] = {
+                    **transfer,
+                    "success": transfer["success"] if self.finished else None,
+                }
+        eta = None
+        if self.state == JobState.Transferring and acked_total:
+            elapsed = time.time() - self.transfer_started_at
+            remaining = self.chunks * len(self.acked) - acked_total
+            eta = remaining * elapsed / acked_total
+        return {
+            "id": self.id,
+            "state": self.state.value,
+            "error": self.error,
+            "devices": self.devices,
+            "firmware_size": self.firmware_size,
+            "chunks": self.chunks,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "acked": self.acked,
+            "missed": self.missed,
+            "skipped": self.skipped,
+            "marginal": self.marginal,
+            "waves": self.waves,
+            "progress": devices,
+            "eta": eta,
+        }
+
+
+class FlashJobManager:
+    """Run the flash jobs one after the other in a background thread.
+
+    A job holds a lease on its devices while it runs, other operations on
+    disjoint devices run meanwhile. Jobs stay serialized, the OTA state of
+    the controller is shared. The devices of a job are flashed in the
+    waves planned by the controller, the skipped ones are reported.
+
+    The progress of the running job is serialized once every
+    `progress_period` and pushed to the clients watching it.
+    """
+
+    def __init__(
+        self,
+        controller: Controller,
+        progress_period: float = FLASH_PROGRESS_PERIOD,
+        leases: DeviceLeases = None,
+    ):
+        self.logger = LOGGER.bind(__context=__name__)
+        self.controller = controller
+        self.leases = leases or DeviceLeases()
+        self.progress_period = progress_period
+        self.jobs: OrderedDict[str, FlashJob] = OrderedDict()
+        self._queue: queue.Queue = queue.Queue()
+        self.telemetry = Telemetry()
+        self.telemetry.gauge("jobs_queued", self._queue.qsize)
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._runner = threading.Thread(target=self._run, daemon=True)
+        self._publisher = threading.Thread(target=self._publish, daemon=True)
+        self._runner.start()
+        self._publisher.start()
+
+    def submit(
+        self, firmware: bytearray, devices: list[str] = None
+    ) -> FlashJob:
+        """Queue a flash job and return it right away."""
+        job = FlashJob(firmware, devices)
+        with self._lock:
+            self.jobs[job.id] = job
+            finished = [j.id for j in self.jobs.values() if j.finished]
+            for job_id in finished[: max(len(finished) - FLASH_JOBS_KEPT, 0)]:
+                del self.jobs[job_id]
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> FlashJob | None:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job: FlashJob):
+        """Cancel a pending job, or interrupt the running one."""
+        with self._lock:
+            job.canceled.set()
+            if job.state == JobState.Pending:
+                self._set_state(job, JobState.Canceled)
+            elif not job.finished:
+                self.controller.cancel_ota()
+
+    async def subscribe(self, job: FlashJob) -> StreamSubscriber:
+        """Register a client, must be called from its event loop.
+
+        The current progress is the first message of the client, it is
+        read from the controller in a worker thread.
+        """
+        subscriber = StreamSubscriber(asyncio.get_running_loop())
+        message = await to_thread.run_sync(self._message, job)
+        with self._lock:
+            if job.finished:
+                # finished meanwhile, its progress doesn't read the controller
+                message = self._message(job)
+            subscriber.push([message])
+            if not job.finished:
+                job.subscribers = [*job.subscribers, subscriber]
+        return subscriber
+
+    def unsubscribe(self, job: FlashJob, subscriber: StreamSubscriber):
+        with self._lock:
+            job.subscribers = [
+                sub for sub in job.subscribers if sub is not subscriber
+            ]
+
+    async def wait(self, job: FlashJob):
+        """Wait for the end of a job, without holding a worker thread."""
+        subscriber = await self.subscribe(job)
+        try:
+            while not job.finished:
+                await subscriber.get()
+        finally:
+            self.unsubscribe(job, subscriber)
+
+    def _message(self, job: FlashJob) -> str:
+        return json.dumps(job.progress(self.controller))
+
+    def _notify(self, job: FlashJob):
+        with self._lock:
+            subscribers = job.subscribers
+            if job.finished:
+                job.subscribers = []
+            if not subscribers:
+                return
+            message = self._message(job)
+        for subscriber in subscribers:
+            subscriber.push([message])
+
+    def _set_state(self, job: FlashJob, state: JobState, error: str = None):
+        job.state = state
+        if error is not None:
+            job.error = error
+        if job.finished:
+            job.finished_at = time.time()
+            job.firmware = None
+            self.telemetry.count("jobs", state.value)
+            if job.started_at is not None:
+                self.telemetry.observe(
+                    "job_duration",
+                    job.finished_at - job.started_at,
+                    buckets=DURATION_BUCKETS,
+                )
+        self._notify(job)
+
+    def _flash(self, job: FlashJob):
+        try:
+            lease = self.leases.acquire(
+                job.devices or ALL_DEVICES,
+                f"flash job {job.id}",
+                cancel=job.canceled,
+            )
+        except LeaseConflict:
+            # canceled while waiting for its devices
+            return
+        with lease:
+            self._flash_devices(job)
+
+    def _flash_devices(self, job: FlashJob):
+        controller = self.controller
+        with self._lock:
+            if job.finished:
+                # canceled while pending
+                return
+            job.started_at = time.time()
+            self._set_state(job, JobState.Starting)
+        plan = controller.plan_ota(job.devices or None)
+        job.skipped = dict(plan.skipped)
+        job.marginal = plan.marginal
+        job.waves = len(plan.waves)
+        if not plan.waves and plan.skipped:
+            self._set_state(
+                job,
+                JobState.Failed,
+                f"no device to flash, {len(plan.skipped)} skipped",
+            )
+            return
+        for wave in plan.waves:
+            if job.state == JobState.Transferring:
+                # the previous wave is flashed
+                self._set_state(job, JobState.Starting)
+            start_data = (
+                controller.start_ota(job.firmware)
+                if plan.broadcast
+                else controller.start_ota(job.firmware, wave)
+            )
+            job.chunks = len(controller.chunks)
+            job.acked = [*job.acked, *start_data["acked"]]
+            job.missed = start_data["missed"]
+            job.skipped.update(start_data["skipped"])
+            if job.canceled.is_set():
+                self._set_state(job, JobState.Canceled)
+                return
+            if job.missed:
+                self._set_state(
+                    job,
+                    JobState.Failed,
+                    f"{len(job.missed)} acknowledgments are missing "
+                    f"({', '.join(sorted(set(job.missed)))})",
+                )
+                return
+            controller.transfer_data = {}
+            if job.transfer_started_at is None:
+                job.transfer_started_at = time.time()
+            self._set_state(job, JobState.Transferring)
+            data = controller.transfer(job.firmware, start_data["acked"])
+            job.transfer_data = {**job.transfer_data, **data}
+            if job.canceled.is_set():
+                self._set_state(job, JobState.Canceled)
+                return
+            if all(device.success for device in data.values()) is False:
+                self._set_state(job, JobState.Failed, "transfer failed")
+                return
+        self._set_state(job, JobState.Done)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            try:
+                self._flash(job)
+            except Exception as exc:
+                self.logger.warning("Flash job failed", error=str(exc))
+                self._set_state(job, JobState.Failed, str(exc))
+
+    def _publish(self):
+        while not self._stop_event.wait(self.progress_period):
+            with self._lock:
+                jobs = list(self.jobs.values())
+            for job in jobs:
+                if job.state in (JobState.Starting, JobState.Transferring):
+                    self._notify(job)
+
+    def close(self):
+        """Cancel the jobs and stop the background threads."""
+        for job in list(self.jobs.values()):
+            if not job.finished:
+                self.cancel(job)
+        self._queue.put(None)
+        self._stop_event.set()
+        self._runner.join()
+        self._publisher.join()
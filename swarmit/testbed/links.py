@@ -0,0 +1,134 @@
+"""Module containing the link quality of the devices, from the metrics
+probes of Mari.
+
+The probes carry the frame counters of the gateway and of the device, the
+delivery ratio of a link is computed over the frames exchanged since the
+previous probe, and smoothed over the last probes.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+from marilib.mari_protocol import MetricsProbePayload
+
+# ratio of the frames and their acknowledgment delivered
+LINK_DELIVERY_MARGINAL = 0.9  # below, the OTA chunks are unicast
+LINK_DELIVERY_OUT_OF_RANGE = 0.3  # below, the device is not flashed
+LINK_RSSI_MARGINAL = -85  # dBm
+LINK_SMOOTHING = 0.3  # weight of the last probe in the averages
+LINK_STALE_PROBES = 5  # probe periods after which a link is unknown
+
+
+class LinkState(Enum):
+    """Quality of the link of a device."""
+
+    Good = "good"
+    Marginal = "marginal"
+    OutOfRange = "out_of_range"
+    Unknown = "unknown"
+
+
+@dataclass
+class Link:
+    """Class that holds the smoothed link quality of a device, None until
+    measured."""
+
+    pdr_downlink: float | None = None
+    pdr_uplink: float | None = None
+    # of the weaker direction
+    rssi_dbm: float | None = None
+    updated_at: float = 0
+
+    @property
+    def delivery(self) -> float:
+        """Ratio of the frames sent to the device and acknowledged."""
+        return (1 if self.pdr_downlink is None else self.pdr_downlink) * (
+            1 if self.pdr_uplink is None else self.pdr_uplink
+        )
+
+
+def _ratio(received: int, sent: int) -> float | None:
+    if sent <= 0 or received < 0:
+        return None
+    return min(received / sent, 1)
+
+
+def _smooth(average: float | None, value: float | None) -> float | None:
+    if value is None:
+        return average
+    if average is None:
+        return value
+    return average + LINK_SMOOTHING * (value - average)
+
+
+class LinkTracker:
+    """Link quality of the devices, updated from their metrics probes."""
+
+    def __init__(self, probe_period: float):
+        self.probe_period = probe_period
+        self.links: dict[str, Link] = {}
+        self._probes: dict[str, MetricsProbePayload] = {}
+        self._lock = threading.Lock()
+
+    def record(self, addr: str, probe: MetricsProbePayload):
+        """Update the link of a device from one of its probes."""
+        with self._lock:
+            previous = self._probes.get(addr)
+            self._probes[addr] = probe
+            if previous is None or probe.gw_tx_count < previous.gw_tx_count:
+                # first probe, or the counters restarted
+                previous = MetricsProbePayload()
+            link = self.links.get(addr) or Link()
+            link.pdr_downlink = _smooth(
+                link.pdr_downlink,
+                _ratio(
+                    probe.node_rx_count - previous.node_rx_count,
+                    probe.gw_tx_count - previous.gw_tx_count,
+                ),
+            )
+            link.pdr_uplink = _smooth(
+                link.pdr_uplink,
+                _ratio(
+                    probe.gw_rx_count - previous.gw_rx_count,
+                    probe.node_tx_count - previous.node_tx_count,
+                ),
+            )
+            # 0 when not measured
+            rssi = [
+                value
+                for value in (probe.rssi_at_node_dbm(), probe.rssi_at_gw_dbm())
+                if value
+            ]
+            link.rssi_dbm = _smooth(link.rssi_dbm, min(rssi, default=None))
+            link.updated_at = time.time()
+            self.links[addr] = link
+
+    def remove(self, addr: str):
+        with self._lock:
+            self.links.pop(addr, None)
+            self._probes.pop(addr, None)
+
+    def state(self, addr: str) -> LinkState:
+        link = self.links.get(addr)
+        if (
+            link is None
+            or time.time() - link.updated_at
+            > LINK_STALE_PROBES * self.probe_period
+        ):
+            return LinkState.Unknown
+        if link.delivery < LINK_DELIVERY_OUT_OF_RANGE:
+            return LinkState.OutOfRange
+        if link.delivery < LINK_DELIVERY_MARGINAL or (
+            link.rssi_dbm is not None and link.rssi_dbm < LINK_RSSI_MARGINAL
+        ):
+            return LinkState.Marginal
+        return LinkState.Good
+
+    def states(self) -> dict[str, int]:
+        """Return the number of devices per link state."""
+        counts = {state.value: 0 for state in LinkState}
+        for addr in list(self.links):
+            counts[self.state(addr).value] += 1
+        return counts
@@ -0,0 +1,102 @@
+"""Module containing the indexed store of the device event logs."""
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.engine import Engine
+
+from swarmit.testbed.eventlog import EventLogRecord
+from swarmit.testbed.model import EventLogEntry, LogBase, create_db_engine
+
+LOGSTORE_QUERY_LIMIT_DEFAULT = 100
+LOGSTORE_QUERY_LIMIT_MAX = 10000
+
+
+def encode_cursor(received_at: float, id_: int) -> str:
+    return f"{received_at!r}:{id_}"
+
+
+def decode_cursor(cursor: str) -> tuple[float, int]:
+    received_at, id_ = cursor.split(":")
+    return float(received_at), int(id_)
+
+
+class EventLogStore:
+    """SQLite store of the event logs, indexed by device and by time.
+
+    It is an output of the event log sink: records are inserted in batches
+    by the sink writer thread.
+    """
+
+    def __init__(self, path: str):
+        self.engine: Engine = create_db_engine(f"sqlite:///{path}")
+        LogBase.metadata.create_all(bind=self.engine)
+
+    def __call__(self, records: list[EventLogRecord]):
+        with self.engine.begin() as conn:
+            conn.execute(
+                insert(EventLogEntry),
+                [
+                    {
+                        "device": record.device,
+                        "timestamp": record.timestamp,
+                        "received_at": record.received_at,
+                        "data": record.data.decode(errors="backslashreplace"),
+                    }
+                    for record in records
+                ],
+            )
+
+    def query(
+        self,
+        device: str = None,
+        start: float = None,
+        end: float = None,
+        contains: str = None,
+        cursor: str = None,
+        limit: int = LOGSTORE_QUERY_LIMIT_DEFAULT,
+    ) -> dict:
+        """Return a page of logs, ordered by reception time.
+
+        The returned cursor is passed to the next query to get the next page,
+        it is None on the last page.
+        """
+        limit = max(1, min(limit, LOGSTORE_QUERY_LIMIT_MAX))
+        query = select(EventLogEntry.__table__)
+        if device is not None:
+            query = query.where(EventLogEntry.device == device)
+        if start is not None:
+            query = query.where(EventLogEntry.received_at >= start)
+        if end is not None:
+            query = query.where(EventLogEntry.received_at < end)
+        if contains:
+            query = query.where(
+                EventLogEntry.data.contains(contains, autoescape=True)
+            )
+        if cursor is not None:
+            query = query.where(
+                tuple_(EventLogEntry.received_at, EventLogEntry.id_)
+                > tuple_(*decode_cursor(cursor))
+            )
+        query = query.order_by(
+            EventLogEntry.received_at, EventLogEntry.id_
+        ).limit(limit + 1)
+        with self.engine.connect() as conn:
+            rows = conn.execute(query).mappings().all()
+        logs = [
+            {
+                "id": row["id_"],
+                "device": row["device"],
+                "timestamp": row["timestamp"],
+                "received_at": row["received_at"],
+                "data": row["data"],
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor(
+                logs[-1]["received_at"], logs[-1]["id"]
+            )
+        return {"logs": logs, "next_cursor": next_cursor}
+
+    def close(self):
+        self.engine.dispose()
@@ -3,16 +3,21 @@ import datetime
 from sqlalchemy import (
     Column,
     DateTime,
+    Float,
+    Index,
     Integer,
     String,
     TypeDecorator,
     create_engine,
+    event,
     text,
 )
 from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 Base = declarative_base()
+# Event logs live in their own database, written at a much higher rate
+LogBase = declarative_base()
 
 
 class AwareDateTime(TypeDecorator):
@@ -38,9 +43,53 @@ class JWTRecord(Base):
     date_start = Column(AwareDateTime, nullable=False)
     date_end = Column(AwareDateTime, nullable=False)
 
+    # Covers the overlap checks and the /records range queries
+    __table_args__ = (
+        Index("ix_jwt_records_date_start_date_end", "date_start", "date_end"),
+    )
+
+
+class EventLogEntry(LogBase):
+    __tablename__ = "event_logs"
+
+    id_ = Column(Integer, primary_key=True)
+    device = Column(String, nullable=False)
+    timestamp = Column(Integer, nullable=False)  # device timestamp
+    received_at = Column(Float, nullable=False)
+    data = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index("ix_event_logs_device_received_at", "device", "received_at"),
+        Index("ix_event_logs_received_at", "received_at"),
+    )
+
+
+def set_sqlite_pragmas(dbapi_connection, _):
+    cursor = dbapi_connection.cursor()
+    # Readers don't block the writer, and commits don't wait for a full sync
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
 
 def create_db_engine(url: str) -> Engine:
-    return create_engine(url, connect_args={"check_same_thread": False})
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    return engine
+
+
+def init_db(engine: Engine):
+    """Create the tables, their indexes and the overlap triggers.
+
+    Indexes and triggers of existing databases are brought up to date.
+    """
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for index in JWTRecord.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+        create_prevent_overlap_trigger(conn)
 
 
 def create_session_factory(engine: Engine):
@@ -48,18 +97,27 @@ def create_session_factory(engine: Engine):
 
 
 def create_prevent_overlap_trigger(conn: Connection):
+    # The stored ranges never overlap, so the only candidate for an overlap
+    # is the last range starting before the end of the new one: a single
+    # lookup in the date_start index instead of a scan of the table.
+    # Triggers are replaced to upgrade the databases with the scanning ones.
+    conn.execute(text("DROP TRIGGER IF EXISTS prevent_overlap"))
     conn.execute(
         text(
             """
-        CREATE TRIGGER IF NOT EXISTS prevent_overlap
+        CREATE TRIGGER prevent_overlap
         BEFORE INSERT ON jwt_records
         FOR EACH ROW
         BEGIN
             SELECT CASE
                 WHEN EXISTS (
-                    SELECT 1 FROM jwt_records
+                    SELECT 1 FROM (
+                        SELECT date_end FROM jwt_records
+                        WHERE date_start < NEW.date_end
+                        ORDER BY date_start DESC, date_end DESC
+                        LIMIT 1
+                    )
                     WHERE NEW.date_start < date_end
-                    AND NEW.date_end > date_start
                 )
                 THEN RAISE (ABORT, 'Overlapping date range detected')
             END;
@@ -67,19 +125,24 @@ def create_prevent_overlap_trigger(conn: Connection):
     """
         )
     )
+    conn.execute(text("DROP TRIGGER IF EXISTS prevent_overlap_update"))
     conn.execute(
         text(
             """
-        CREATE TRIGGER IF NOT EXISTS prevent_overlap_update
+        CREATE TRIGGER prevent_overlap_update
         BEFORE UPDATE ON jwt_records
         FOR EACH ROW
         BEGIN
             SELECT CASE
                 WHEN EXISTS (
-                    SELECT 1 FROM jwt_records
-                    WHERE id_ != OLD.id_
-                    AND NEW.date_start < date_end
-                    AND NEW.date_end > date_start
+                    SELECT 1 FROM (
+                        SELECT date_end FROM jwt_records
+                        WHERE id_ != OLD.id_
+                        AND date_start < NEW.date_end
+                        ORDER BY date_start DESC, date_end DESC
+                        LIMIT 1
+                    )
+                    WHERE NEW.date_start < date_end
                 )
                 THEN RAISE (ABORT, 'Overlapping date range detected')
             END;
@@ -0,0 +1,419 @@
+"""Module running a controller in its own process.
+
+The dashboard process then only serves HTTP: the radio frames, the OTA
+loops and the event log ingestion don't contend with it for the GIL. The
+device status is published in a shared memory table, the commands are
+sent over a queue.
+"""
+
+import dataclasses
+import itertools
+import multiprocessing
+import multiprocessing.connection
+import pickle
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing.shared_memory import SharedMemory
+
+from swarmit.testbed.controller import (
+    Controller,
+    ControllerSettings,
+    NodeStatus,
+)
+from swarmit.testbed.eventlog import EventLogRecord
+from swarmit.testbed.logger import LOGGER
+from swarmit.testbed.logstore import EventLogStore
+from swarmit.testbed.protocol import DeviceType, StatusType
+from swarmit.testbed.selector import StatusIndex, select_devices
+from swarmit.testbed.stream import EventLogBroadcaster, StatusBroadcaster
+
+STATUS_TABLE_CAPACITY = 4096  # devices
+STATUS_POLL_PERIOD = 0.01  # s
+QUEUE_POLL_PERIOD = 0.1  # s
+CONTROLLER_START_TIMEOUT = 60  # s
+CONTROLLER_CALL_TIMEOUT = 300  # s, the firmware transfers aren't limited
+EVENTLOG_QUEUE_SIZE = 1024  # batches
+
+# Methods of the controller callable from the dashboard process
+CONTROLLER_METHODS = {
+    "start",
+    "stop",
+    "reset",
+    "send_message",
+    "send_lh2_calibration",
+    "plan_ota",
+    "start_ota",
+    "transfer",
+    "transfer_progress",
+    "cancel_ota",
+    "telemetry_snapshot",
+    "metrics",
+}
+# Attributes of the controller readable and writable from the dashboard
+CONTROLLER_ATTRIBUTES = {"chunks", "transfer_data"}
+# Methods running as long as the firmware transfer
+CONTROLLER_UNTIMED_METHODS = {"transfer"}
+
+
+class StatusTable:
+    """Status of the devices in shared memory, one writer, many readers.
+
+    A sequence number, odd while the writer updates the table, lets the
+    readers retry a copy that was torn by an update (seqlock). The devices
+    beyond the capacity are left out, with a warning.
+    """
+
+    HEADER = struct.Struct("<QQI4x")  # sequence, version, device count
+    SEQUENCE = struct.Struct("<Q")
+    VERSION = struct.Struct("<8xQ")
+    CONTENTS = struct.Struct("<8xQI")  # version, device count
+    # address, device, status, battery, pos_x, pos_y, last_updated_at
+    ROW = struct.Struct("<QBBHiid")
+
+    def __init__(
+        self, name: str = None, capacity: int = STATUS_TABLE_CAPACITY
+    ):
+        self.logger = LOGGER.bind(__context=__name__)
+        self.capacity = capacity
+        size = self.HEADER.size + capacity * self.ROW.size
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+        else:
+            self.shm = SharedMemory(name=name)
+        self.name = self.shm.name
+        self._sequence = 0
+        self._truncated = False
+
+    @property
+    def version(self) -> int:
+        return self.VERSION.unpack_from(self.shm.buf)[0]
+
+    def write(self, status_data: dict[str, NodeStatus], version: int):
+        """Publish the status of the devices, from the writer process."""
+        truncated = len(status_data) > self.capacity
+        if truncated and not self._truncated:
+            self.logger.warning(
+                "Status table full, devices left out",
+                devices=len(status_data),
+                capacity=self.capacity,
+            )
+        self._truncated = truncated
+        rows = b"".join(
+            self.ROW.pack(
+                int(addr, 16),
+                node.device.value,
+                node.status.value,
+                node.battery,
+                node.pos_x,
+                node.pos_y,
+                node.last_updated_at,
+            )
+            for addr, node in list(status_data.items())[: self.capacity]
+        )
+        buf = self.shm.buf
+        self._sequence += 1
+        self.SEQUENCE.pack_into(buf, 0, self._sequence)
+        buf[self.HEADER.size : self.HEADER.size + len(rows)] = rows
+        self.CONTENTS.pack_into(buf, 0, version, len(rows) // self.ROW.size)
+        # the readers accept the copy once the sequence is even again
+        self._sequence += 1
+        self.SEQUENCE.pack_into(buf, 0, self._sequence)
+
+    def read(self) -> tuple[int, dict[str, NodeStatus]]:
+        """Return the version and the status of the devices."""
+        buf = self.shm.buf
+        while True:
+            sequence, version, count = self.HEADER.unpack_from(buf)
+            if sequence % 2:
+                time.sleep(0)
+                continue
+            start = self.HEADER.size
+            rows = bytes(buf[start : start + count * self.ROW.size])
+            if self.SEQUENCE.unpack_from(buf)[0] == sequence:
+                break
+        return version, {
+            f"{addr:08X}": NodeStatus(
+                device=DeviceType(device),
+                status=StatusType(status),
+                battery=battery,
+                pos_x=pos_x,
+                pos_y=pos_y,
+                last_updated_at=last_updated_at,
+            )
+            for (
+                addr,
+                device,
+                status,
+                battery,
+                pos_x,
+                pos_y,
+                last_updated_at,
+            ) in self.ROW.iter_unpack(rows)
+        }
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class EventLogForwarder:
+    """Event log output sending the records to the dashboard process.
+
+    Records are dropped when the dashboard doesn't keep up.
+    """
+
+    def __init__(self, records: multiprocessing.Queue):
+        self.records = records
+
+    def __call__(self, records: list[EventLogRecord]):
+        try:
+            self.records.put_nowait(records)
+        except queue.Full:
+            pass
+
+
+def _picklable(exc: Exception) -> Exception:
+    try:
+        pickle.dumps(exc)
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+    return exc
+
+
+def run_controller(
+    settings: ControllerSettings,
+    table_name: str,
+    requests: multiprocessing.Queue,
+    responses: multiprocessing.Queue,
+    records: multiprocessing.Queue,
+):
+    """Entry point of the controller process."""
+    controller = Controller(settings)
+    controller.eventlog.outputs.append(EventLogForwarder(records))
+    table = StatusTable(name=table_name)
+    stop_event = threading.Event()
+
+    def publish():
+        version = None
+        while not stop_event.wait(STATUS_POLL_PERIOD):
+            if controller.status_version != version:
+                version = controller.status_version
+                table.write(controller.status_data, version)
+
+    def handle(request_id: int, method: str, args: tuple, kwargs: dict):
+        try:
+            if method == "get":
+                result = getattr(controller, args[0])
+            elif method == "set":
+                result = setattr(controller, args[0], args[1])
+            else:
+                result = getattr(controller, method)(*args, **kwargs)
+        except Exception as exc:
+            responses.put((request_id, None, _picklable(exc)))
+        else:
+            responses.put((request_id, result, None))
+
+    publisher = threading.Thread(target=publish, daemon=True)
+    publisher.start()
+    responses.put((None, "ready", None))
+    # operations run concurrently, as with the dashboard threads
+    with ThreadPoolExecutor(thread_name_prefix="command") as executor:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            executor.submit(handle, *request)
+    stop_event.set()
+    publisher.join()
+    controller.terminate()
+    table.close()
+
+
+class ControllerProcess:
+    """Controller running in a child process, as seen by the dashboard.
+
+    The status of the devices is mirrored from the shared memory table in
+    `status_data`, the commands are forwarded to the child process and
+    block until it answers, it exits or `CONTROLLER_CALL_TIMEOUT` elapses.
+    """
+
+    def __init__(self, settings: ControllerSettings):
+        self.logger = LOGGER.bind(__context=__name__)
+        self.settings = settings
+        self.status_data: dict[str, NodeStatus] = {}
+        self.status_version = 0
+        self.status_index = StatusIndex()
+        self.status_stream = StatusBroadcaster(
+            self.status_data, settings.status_stream_interval
+        )
+        self.eventlog_stream = EventLogBroadcaster()
+        self.logstore: EventLogStore = None
+        if settings.logstore_path:
+            # the child process writes, queries are served from here
+            self.logstore = EventLogStore(settings.logstore_path)
+        self._table = StatusTable()
+        self._request_ids = itertools.count()
+        self._pending: dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        # spawned, the threads of the dashboard are not forked
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._responses = context.Queue()
+        self._records = context.Queue(maxsize=EVENTLOG_QUEUE_SIZE)
+        self._process = context.Process(
+            target=run_controller,
+            args=(
+                dataclasses.replace(settings, controller_process=False),
+                self._table.name,
+                self._requests,
+                self._responses,
+                self._records,
+            ),
+            name="controller",
+            daemon=True,
+        )
+        self._process.start()
+        self._wait_ready()
+        self._threads = [
+            threading.Thread(target=target, daemon=True)
+            for target in (
+                self._receive_responses,
+                self._receive_records,
+                self._mirror_status,
+                self._watch_process,
+            )
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.status_stream.start()
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + CONTROLLER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                self._responses.get(timeout=0.1)
+            except queue.Empty:
+                if not self._process.is_alive():
+                    break
+                continue
+            return
+        self.logger.error("Controller process failed to start")
+        self._process.kill()
+        self._table.unlink()
+        raise RuntimeError("controller process failed to start")
+
+    def _received(self, source: multiprocessing.Queue):
+        # polled, a child process killed while writing can leave the queue
+        # locked and a sentinel put from here would never be read
+        while not self._stop_event.is_set():
+            try:
+                item = source.get(timeout=QUEUE_POLL_PERIOD)
+            except queue.Empty:
+                continue
+            yield item
+
+    def _receive_responses(self):
+        for request_id, result, error in self._received(self._responses):
+            with self._pending_lock:
+                future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _watch_process(self):
+        multiprocessing.connection.wait([self._process.sentinel])
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        if not self._stop_event.is_set():
+            self.logger.error(
+                "Controller process exited", exitcode=self._process.exitcode
+            )
+        for future in pending.values():
+            future.set_exception(RuntimeError("controller process exited"))
+
+    def _receive_records(self):
+        for records in self._received(self._records):
+            self.eventlog_stream(records)
+
+    def _mirror_status(self):
+        while not self._stop_event.wait(STATUS_POLL_PERIOD):
+            if self._table.version == self.status_version:
+                continue
+            version, status_data = self._table.read()
+            transition = status_data.keys() != self.status_data.keys() or any(
+                self.status_data[addr].status != node.status
+                for addr, node in status_data.items()
+            )
+            for addr in list(self.status_data):
+                if addr not in status_data:
+                    del self.status_data[addr]
+                    self.status_index.remove(addr)
+            self.status_data.update(status_data)
+            for addr, node in status_data.items():
+                self.status_index.update(addr, node)
+            self.status_version = version
+            if transition:
+                self.status_stream.wake()
+
+    def select_devices(self, devices: list[str] | None) -> list[str] | None:
+        """Resolve the selectors on the mirrored status."""
+        return select_devices(devices, self.status_index)
+
+    def call(self, method: str, *args, **kwargs):
+        """Run a controller method in the child process, return its result."""
+        if method not in CONTROLLER_METHODS | {"get", "set"}:
+            raise AttributeError(f"unknown controller method: {method}")
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._pending_lock:
+            if self._process.exitcode is not None:
+                raise RuntimeError("controller process exited")
+            self._pending[request_id] = future
+        self._requests.put((request_id, method, args, kwargs))
+        timeout = (
+            None
+            if method in CONTROLLER_UNTIMED_METHODS
+            else CONTROLLER_CALL_TIMEOUT
+        )
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise TimeoutError(f"controller {method} timed out") from None
+
+    def __getattr__(self, name: str):
+        if name in CONTROLLER_METHODS:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        if name in CONTROLLER_ATTRIBUTES:
+            return self.call("get", name)
+        raise AttributeError(name)
+
+    def __setattr__(self, name: str, value):
+        if name in CONTROLLER_ATTRIBUTES:
+            self.call("set", name, value)
+        else:
+            super().__setattr__(name, value)
+
+    def terminate(self):
+        """Terminate the controller process."""
+        self._stop_event.set()
+        self._requests.put(None)
+        self._process.join(timeout=10)
+        if self._process.is_alive():
+            self._process.kill()
+        for thread in self._threads:
+            thread.join()
+        self.status_stream.stop()
+        self._table.close()
+        self._table.unlink()
@@ -12,6 +12,8 @@ from dotbot_utils.protocol import (
 from marilib.mari_protocol import DefaultPayloadType as MariDefaultPayloadType
 from marilib.mari_protocol import MetricsProbePayload
 
+BROADCAST_ADDRESS = 0xFFFFFFFFFFFFFFFF
+
 
 class StatusType(Enum):
     """Types of device status."""
@@ -239,6 +241,22 @@ class PayloadMessage(Payload):
     message: bytes = dataclasses.field(default_factory=lambda: bytearray)
 
 
+class PayloadMetricsProbe(MetricsProbePayload):
+    """Marilib metrics probe, its type byte is the packet type.
+
+    The probe serializes its own type byte, which the packet already
+    writes and strips before parsing the payload.
+    """
+
+    def from_bytes(self, bytes_):
+        return super().from_bytes(
+            bytes([PayloadType.METRICS_PROBE]) + bytes(bytes_)
+        )
+
+    def to_bytes(self, byteorder="little") -> bytes:
+        return super().to_bytes(byteorder)[1:]
+
+
 # Register all swarmit specific parsers at module level
 register_parser(PayloadType.SWARMIT_STATUS, PayloadStatus)
 register_parser(PayloadType.SWARMIT_START, PayloadStart)
@@ -251,4 +269,4 @@ register_parser(PayloadType.SWARMIT_OTA_CHUNK_ACK, PayloadOTAChunkAck)
 register_parser(PayloadType.SWARMIT_EVENT_LOG, PayloadEvent)
 register_parser(PayloadType.SWARMIT_MESSAGE, PayloadMessage)
 register_parser(PayloadType.SWARMIT_LH2_CALIBRATION, PayloadCalibrationData)
-register_parser(PayloadType.METRICS_PROBE, MetricsProbePayload)
+register_parser(PayloadType.METRICS_PROBE, PayloadMetricsProbe)
@@ -0,0 +1,205 @@
+"""Module containing the scheduling of the operations sharing the testbed."""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+ALL_DEVICES = None  # lease on the whole testbed
+LEASE_TIMEOUT_DEFAULT = 5  # s
+
+
+class LeaseConflict(Exception):
+    """Raised when the devices of an operation stay leased by another one."""
+
+
+class FairLock:
+    """Lock granted in the order it was requested."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+    def acquire(self):
+        with self._condition:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            while ticket != self._serving:
+                self._condition.wait()
+
+    def release(self):
+        with self._condition:
+            self._serving += 1
+            self._condition.notify_all()
+
+    @property
+    def queued(self) -> int:
+        """Return the number of threads holding or waiting for the lock."""
+        return self._next_ticket - self._serving
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+
+class Lease:
+    """Exclusive use of a set of devices, `None` for the whole testbed."""
+
+    def __init__(self, leases: "DeviceLeases", devices, owner: str):
+        self.leases = leases
+        self.devices: frozenset[str] | None = devices
+        self.owner = owner
+        self.granted = False
+        self._notify = None
+
+    def overlaps(self, other: "Lease") -> bool:
+        if self.devices is ALL_DEVICES or other.devices is ALL_DEVICES:
+            return True
+        return not self.devices.isdisjoint(other.devices)
+
+    def release(self):
+        self.leases.release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.release()
+
+    def __repr__(self):
+        devices = "all" if self.devices is None else sorted(self.devices)
+        return f"Lease({self.owner}, {devices})"
+
+
+class DeviceLeases:
+    """Grant leases on device sets, in the order they are requested.
+
+    Operations on disjoint sets hold their leases at the same time. A
+    request waits for the leases it overlaps, and also for the earlier
+    requests it overlaps, so large sets are not starved by small ones.
+    `timeout` is the default wait of the requests from an event loop.
+    """
+
+    def __init__(self, timeout: float = LEASE_TIMEOUT_DEFAULT):
+        self.timeout = timeout
+        self.active: list[Lease] = []
+        self._waiting: deque[Lease] = deque()
+        self._lock = threading.Lock()
+
+    def _lease(self, devices: list[str] | None, owner: str) -> Lease:
+        if devices is not ALL_DEVICES:
+            devices = frozenset(device.upper() for device in devices)
+        return Lease(self, devices, owner)
+
+    def _grant(self):
+        waiting = []
+        for lease in self._waiting:
+            if any(lease.overlaps(other) for other in self.active) or any(
+                lease.overlaps(other) for other in waiting
+            ):
+                waiting.append(lease)
+                continue
+            lease.granted = True
+            self.active.append(lease)
+            lease._notify()
+        self._waiting = deque(waiting)
+
+    def _request(self, lease: Lease, notify: callable):
+        with self._lock:
+            lease._notify = notify
+            self._waiting.append(lease)
+            self._grant()
+
+    def _cancel(self, lease: Lease) -> LeaseConflict | None:
+        """Withdraw a request not granted in time, None if granted since."""
+        with self._lock:
+            if lease.granted:
+                return None
+            self._waiting.remove(lease)
+            self._grant()
+            holders = [other for other in self.active if lease.overlaps(other)]
+        if not holders:
+            return LeaseConflict(
+                "devices busy: queued behind other operations"
+            )
+        busy = []
+        for holder in holders:
+            if holder.devices is ALL_DEVICES or lease.devices is ALL_DEVICES:
+                devices = "all devices"
+                if holder.devices is not ALL_DEVICES:
+                    devices = ", ".join(sorted(holder.devices))
+            else:
+                devices = ", ".join(sorted(holder.devices & lease.devices))
+            busy.append(f"{devices} ({holder.owner})")
+        return LeaseConflict(f"devices busy: {'; '.join(busy)}")
+
+    def acquire(
+        self,
+        devices: list[str] | None,
+        owner: str,
+        timeout: float = None,
+        cancel: threading.Event = None,
+    ) -> Lease:
+        """Wait for a lease, from a thread.
+
+        Raise LeaseConflict after `timeout` or when `cancel` is set.
+        """
+        lease = self._lease(devices, owner)
+        granted = threading.Event()
+        self._request(lease, granted.set)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not granted.is_set():
+            if cancel is not None and cancel.is_set():
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            granted.wait(0.1)
+        if not granted.is_set():
+            conflict = self._cancel(lease)
+            if conflict is not None:
+                raise conflict
+        return lease
+
+    async def acquire_async(
+        self,
+        devices: list[str] | None,
+        owner: str,
+        timeout: float = None,
+    ) -> Lease:
+        """Wait for a lease, from an event loop, without holding a thread.
+
+        Raise LeaseConflict after `timeout`, 0 to not wait.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        lease = self._lease(devices, owner)
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        self._request(lease, notify)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except asyncio.TimeoutError:
+            conflict = self._cancel(lease)
+            if conflict is not None:
+                raise conflict
+        except asyncio.CancelledError:
+            if self._cancel(lease) is None:
+                lease.release()
+            raise
+        return lease
+
+    def release(self, lease: Lease):
+        with self._lock:
+            if lease in self.active:
+                self.active.remove(lease)
+                self._grant()
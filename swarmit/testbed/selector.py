@@ -0,0 +1,317 @@
+"""Module containing the device selectors and the index they query.
+
+A device list mixes addresses and selectors, the devices of all of them
+are selected. A selector is a set of clauses, separated with `&` or
+spaces, that the devices all match:
+
+- `type=DotBotV3`, `status=Running|Programming`, `status!=Bootloader`
+- `battery>=2.5V`, `battery<2800` (mV)
+- `seen<10` (s since the last status)
+- `addr=BC3D*` (address prefix)
+- `rect(x0,y0,x1,y1)`, `radius(x,y,r)`, `nearest(x,y,k)`, see spatial.py
+"""
+
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from swarmit.testbed.protocol import DeviceType, StatusType
+from swarmit.testbed.spatial import Region, SpatialIndex, parse_region
+
+BATTERY_BUCKET = 100  # mV
+CLAUSE_PATTERN = re.compile(
+    r"^(type|status|battery|seen|addr)(!=|<=|>=|=|<|>)(\S+)$"
+)
+OPERATOR_PATTERN = re.compile(r"\s*(!=|<=|>=|=|<|>)\s*")
+TOKEN_PATTERN = re.compile(r"[^\s&(]+(?:\([^)]*\))?")
+COMPARISONS = {
+    "=": lambda value, threshold: value == threshold,
+    "!=": lambda value, threshold: value != threshold,
+    "<": lambda value, threshold: value < threshold,
+    "<=": lambda value, threshold: value <= threshold,
+    ">": lambda value, threshold: value > threshold,
+    ">=": lambda value, threshold: value >= threshold,
+}
+
+
+class StatusIndex:
+    """Devices indexed by type, status, battery, address and position.
+
+    Kept up to date from the status frames, so that selectors are
+    resolved without scanning the status of every device.
+    """
+
+    def __init__(self):
+        self.positions = SpatialIndex()
+        # addr -> (device, status, battery)
+        self._nodes: dict[str, tuple[DeviceType, StatusType, int]] = {}
+        self._last_seen: dict[str, float] = {}
+        self._addresses: list[str] = []
+        self._by_device: dict[DeviceType, set[str]] = defaultdict(set)
+        self._by_status: dict[StatusType, set[str]] = defaultdict(set)
+        self._by_battery: dict[int, set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def _unindex(self, addr: str, node: tuple[DeviceType, StatusType, int]):
+        device, status, battery = node
+        for index, key in (
+            (self._by_device, device),
+            (self._by_status, status),
+            (self._by_battery, battery // BATTERY_BUCKET),
+        ):
+            index[key].discard(addr)
+            if not index[key]:
+                del index[key]
+
+    def update(self, addr: str, node):
+        """Index the status of a device, a NodeStatus."""
+        self._last_seen[addr] = node.last_updated_at
+        self.positions.update(addr, node.pos_x, node.pos_y)
+        indexed = (node.device, node.status, node.battery)
+        previous = self._nodes.get(addr)
+        if previous == indexed:
+            return
+        with self._lock:
+            if previous is None:
+                bisect.insort(self._addresses, addr)
+            else:
+                self._unindex(addr, previous)
+            self._nodes[addr] = indexed
+            self._by_device[node.device].add(addr)
+            self._by_status[node.status].add(addr)
+            self._by_battery[node.battery // BATTERY_BUCKET].add(addr)
+
+    def remove(self, addr: str):
+        self.positions.remove(addr)
+        with self._lock:
+            previous = self._nodes.pop(addr, None)
+            if previous is None:
+                return
+            self._last_seen.pop(addr, None)
+            del self._addresses[bisect.bisect_left(self._addresses, addr)]
+            self._unindex(addr, previous)
+
+    def all(self) -> set[str]:
+        with self._lock:
+            return set(self._nodes)
+
+    def by_device(self, devices: list[DeviceType]) -> set[str]:
+        with self._lock:
+            return set().union(*(self._by_device.get(d, ()) for d in devices))
+
+    def by_status(self, statuses: list[StatusType]) -> set[str]:
+        with self._lock:
+            return set().union(*(self._by_status.get(s, ()) for s in statuses))
+
+    def by_battery(self, operator: str, threshold: int) -> set[str]:
+        """Devices whose battery compares to the threshold, in mV.
+
+        Only the devices of the bucket of the threshold are compared.
+        """
+        compare = COMPARISONS[operator]
+        boundary = threshold // BATTERY_BUCKET
+        selected = set()
+        with self._lock:
+            for bucket, addrs in self._by_battery.items():
+                if bucket == boundary:
+                    selected.update(
+                        addr
+                        for addr in addrs
+                        if compare(self._nodes[addr][2], threshold)
+                    )
+                elif compare(bucket, boundary):
+                    # the whole bucket is on the same side of the threshold
+                    selected.update(addrs)
+        return selected
+
+    def by_prefix(self, prefix: str) -> set[str]:
+        with self._lock:
+            start = bisect.bisect_left(self._addresses, prefix)
+            end = bisect.bisect_right(self._addresses, prefix + "\uffff")
+            return set(self._addresses[start:end])
+
+    def by_last_seen(
+        self, operator: str, age: float, addrs: set[str] = None
+    ) -> set[str]:
+        """Devices by the age of their last status, in s."""
+        compare = COMPARISONS[operator]
+        now = time.time()
+        with self._lock:
+            if addrs is None:
+                addrs = self._nodes
+            return {
+                addr
+                for addr in addrs
+                if addr in self._last_seen
+                and compare(now - self._last_seen[addr], age)
+            }
+
+
+@dataclass
+class Clause:
+    """Condition on one indexed attribute of the devices."""
+
+    attribute: str
+    operator: str
+    value: object
+
+    def select(self, index: StatusIndex, candidates: set[str] = None):
+        if self.attribute == "seen":
+            return index.by_last_seen(self.operator, self.value, candidates)
+        if self.attribute == "battery":
+            return index.by_battery(self.operator, self.value)
+        if self.attribute == "addr":
+            selected = set().union(
+                *(
+                    (
+                        index.by_prefix(value[:-1])
+                        if value.endswith("*")
+                        else index.by_prefix(value) & {value}
+                    )
+                    for value in self.value
+                )
+            )
+        elif self.attribute == "type":
+            selected = index.by_device(self.value)
+        else:
+            selected = index.by_status(self.value)
+        if self.operator == "!=":
+            return index.all() - selected
+        return selected
+
+
+def _parse_enum(enum, names: str, text: str) -> list:
+    values = []
+    for name in names.split("|"):
+        member = next(
+            (m for m in enum if m.name.lower() == name.lower()), None
+        )
+        if member is None:
+            raise ValueError(
+                f"invalid selector {text}, {name} is not one of "
+                f"{', '.join(m.name for m in enum)}"
+            )
+        values.append(member)
+    return values
+
+
+def _parse_number(value: str, text: str, units: dict[str, float]) -> float:
+    lower = value.lower()
+    scale = 1
+    for unit, factor in units.items():
+        if lower.endswith(unit):
+            lower, scale = lower[: -len(unit)], factor
+            break
+    try:
+        return float(lower) * scale
+    except ValueError:
+        raise ValueError(
+            f"invalid selector {text}, {value} is not a number"
+        ) from None
+
+
+def parse_clause(token: str) -> Clause | Region:
+    match = CLAUSE_PATTERN.match(token)
+    if match is None:
+        region = parse_region(token)
+        if region is None:
+            raise ValueError(f"invalid selector {token}")
+        return region
+    attribute, operator, value = match.groups()
+    if attribute in ("type", "status", "addr") and operator not in (
+        "=",
+        "!=",
+    ):
+        raise ValueError(
+            f"invalid selector {token}, {attribute} takes = or !="
+        )
+    if attribute == "type":
+        value = _parse_enum(DeviceType, value, token)
+    elif attribute == "status":
+        value = _parse_enum(StatusType, value, token)
+    elif attribute == "addr":
+        value = [prefix.upper() for prefix in value.split("|")]
+    elif attribute == "battery":
+        value = int(_parse_number(value, token, {"mv": 1, "v": 1000}))
+    else:
+        value = _parse_number(value, token, {"ms": 0.001, "s": 1})
+    return Clause(attribute, operator, value)
+
+
+@dataclass
+class Selector:
+    """Devices matching all the clauses."""
+
+    clauses: list[Clause | Region]
+
+    def select(self, index: StatusIndex) -> list[str]:
+        selected = None
+        # the last seen age is not indexed, it filters the other clauses
+        for clause in sorted(
+            self.clauses,
+            key=lambda c: isinstance(c, Clause) and c.attribute == "seen",
+        ):
+            if isinstance(clause, Region):
+                addrs = set(clause.select(index.positions))
+            else:
+                addrs = clause.select(index, selected)
+            selected = addrs if selected is None else selected & addrs
+            if not selected:
+                return []
+        return sorted(selected)
+
+
+def is_selector(text: str) -> bool:
+    return any(char in text for char in "(=<>")
+
+
+def parse_selector(text: str) -> Selector | None:
+    """Return the selector, None for a device address.
+
+    Raise ValueError when the selector is malformed.
+    """
+    if not is_selector(text):
+        return None
+    tokens = TOKEN_PATTERN.findall(OPERATOR_PATTERN.sub(r"\1", text))
+    return Selector([parse_clause(token) for token in tokens])
+
+
+def split_devices(text: str) -> list[str]:
+    """Split a comma-separated list of devices and selectors."""
+    items, depth, start = [], 0, 0
+    for position, char in enumerate(f"{text},"):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth = max(depth - 1, 0)
+        elif char == "," and depth == 0:
+            items.append(text[start:position].strip())
+            start = position + 1
+    return [item for item in items if item]
+
+
+def select_devices(
+    devices: list[str] | None, index: StatusIndex
+) -> list[str] | None:
+    """Replace the selectors of a device list by their devices.
+
+    Return None, the whole testbed, when no device is given.
+    """
+    if not devices:
+        return None
+    if not any(is_selector(device) for device in devices):
+        return devices
+    selected = []
+    for device in devices:
+        selector = parse_selector(device)
+        if selector is None:
+            selected.append(device)
+        else:
+            selected.extend(selector.select(index))
+    return list(dict.fromkeys(selected))
@@ -0,0 +1,392 @@
+"""Module containing a simulated gateway adapter used for load testing."""
+
+import dataclasses
+import heapq
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from dotbot_utils.protocol import Packet, Payload
+from marilib.mari_protocol import Header as MariHeader
+
+from swarmit.testbed.adapter import GatewayAdapterBase
+from swarmit.testbed.protocol import (
+    BROADCAST_ADDRESS,
+    DeviceType,
+    PayloadMetricsProbe,
+    PayloadOTAChunk,
+    PayloadOTAChunkAck,
+    PayloadOTAStart,
+    PayloadOTAStartAck,
+    PayloadReset,
+    PayloadStart,
+    PayloadStatus,
+    PayloadStop,
+    PayloadType,
+    StatusType,
+)
+from swarmit.testbed.telemetry import payload_type_name
+
+UPLINK_PAYLOAD_TYPES = {
+    PayloadStatus: PayloadType.SWARMIT_STATUS,
+    PayloadOTAStartAck: PayloadType.SWARMIT_OTA_START_ACK,
+    PayloadOTAChunkAck: PayloadType.SWARMIT_OTA_CHUNK_ACK,
+    PayloadMetricsProbe: PayloadType.METRICS_PROBE,
+}
+RSSI_DBM = -60
+MARGINAL_RSSI_DBM = -88
+
+
+@dataclass
+class SimulatorSettings:
+    """Class that holds the simulated testbed settings."""
+
+    nodes: int = 100
+    first_address: int = 0x1
+    device_type: str = DeviceType.DotBotV3.name
+    status_interval: float = 0.5  # s, period of the status notifications
+    tick: float = 0.01  # s, duration of a simulation step
+    loss_rate: float = 0.0  # probability of losing a frame, per direction
+    marginal_rate: float = 0.0  # fraction of nodes with a poor link
+    marginal_loss_rate: float = 0.2  # loss_rate of the poor links
+    latency: float = 0.01  # s, mean one-way latency
+    latency_jitter: float = 0.005  # s, only used by "uniform"
+    latency_distribution: str = "uniform"  # or "exponential", "constant"
+    downlink_rate: float = 0  # frames/s sent by the gateway, 0 = unlimited
+    uplink_rate: float = 0  # frames/s received by the gateway, 0 = unlimited
+    max_queue_delay: float = 1.0  # s, frames queued longer are dropped
+    area_width: int = 2500  # mm
+    area_height: int = 2500  # mm
+    battery_min: int = 2000  # mV
+    battery_max: int = 3000  # mV
+    ota_write_delay: float = 0.0  # s, time to write a chunk before the ACK
+    ota_failure_rate: float = 0.0  # fraction of nodes failing mid-transfer
+    reset_delay: float = 0.5  # s, reboot to the bootloader after a reset
+    seed: int | None = None
+
+
+@dataclass
+class SimulatedNode:
+    """Class that holds the state of a simulated node."""
+
+    address: int
+    device: DeviceType = DeviceType.DotBotV3
+    status: StatusType = StatusType.Bootloader
+    battery: int = 3000
+    pos_x: int = 0
+    pos_y: int = 0
+    ota_chunks: int = 0
+    ota_received: set[int] = dataclasses.field(default_factory=set)
+    ota_should_fail: bool = False
+    ota_fail_index: int = 0
+    loss_rate: float = 0.0
+    rssi_dbm: int = RSSI_DBM
+    # frame counters reported by the metrics probes
+    gw_tx_count: int = 0
+    gw_rx_count: int = 0
+    node_tx_count: int = 0
+    node_rx_count: int = 0
+    probed_at: float = 0
+
+
+class SimulatedChannel:
+    """Shared radio channel with a maximum frame rate.
+
+    Frames are serialized on the channel: each one departs one slot after
+    the previous one. Frames that would wait longer than the maximum
+    queueing delay are dropped, like in a saturated gateway queue.
+    """
+
+    def __init__(self, rate: float, max_queue_delay: float):
+        self.slot = 1 / rate if rate > 0 else 0
+        self.max_queue_delay = max_queue_delay
+        self.next_free = 0.0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, now: float) -> float | None:
+        """Return the departure time of a new frame, None if dropped."""
+        if not self.slot:
+            return now
+        with self._lock:
+            departure = max(now, self.next_free)
+            if departure - now > self.max_queue_delay:
+                self.dropped += 1
+                return None
+            self.next_free = departure + self.slot
+        return departure
+
+    def queued(self, now: float) -> int:
+        """Return the number of frames waiting for the channel."""
+        if not self.slot:
+            return 0
+        # rounded first, the slots are floats
+        return max(0, math.ceil(round((self.next_free - now) / self.slot, 9)))
+
+
+class SimulatedAdapter(GatewayAdapterBase):
+    """Gateway adapter simulating a whole swarm in a single event loop."""
+
+    def __init__(
+        self,
+        settings: SimulatorSettings = None,
+        verbose: bool = False,
+        probe_period: float = 0,
+    ):
+        self.settings = settings or SimulatorSettings()
+        self.verbose = verbose
+        # s between the metrics probes of a node, 0 disables them
+        self.probe_period = probe_period
+        self.random = random.Random(self.settings.seed)
+        self.nodes: dict[int, SimulatedNode] = {}
+        device = DeviceType[self.settings.device_type]
+        for index in range(self.settings.nodes):
+            address = self.settings.first_address + index
+            node = SimulatedNode(
+                address=address,
+                device=device,
+                battery=self.random.randint(
+                    self.settings.battery_min, self.settings.battery_max
+                ),
+                pos_x=self.random.randint(0, self.settings.area_width),
+                pos_y=self.random.randint(0, self.settings.area_height),
+            )
+            node.ota_should_fail = (
+                self.random.random() < self.settings.ota_failure_rate
+            )
+            node.loss_rate = self.settings.loss_rate
+            if (
+                self.settings.marginal_rate
+                and self.random.random() < self.settings.marginal_rate
+            ):
+                node.loss_rate = self.settings.marginal_loss_rate
+                node.rssi_dbm = MARGINAL_RSSI_DBM
+            self.nodes[address] = node
+        # Nodes are spread over round-robin buckets, one bucket is processed
+        # per tick so each node notifies its status once per status interval
+        bucket_count = max(
+            1, round(self.settings.status_interval / self.settings.tick)
+        )
+        self._buckets: list[list[SimulatedNode]] = [
+            [] for _ in range(bucket_count)
+        ]
+        for index, node in enumerate(self.nodes.values()):
+            self._buckets[index % bucket_count].append(node)
+        self.downlink = SimulatedChannel(
+            self.settings.downlink_rate, self.settings.max_queue_delay
+        )
+        self.uplink = SimulatedChannel(
+            self.settings.uplink_rate, self.settings.max_queue_delay
+        )
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.frames_lost = 0
+        self._events: list[tuple[float, int, callable, tuple]] = []
+        self._events_lock = threading.Lock()
+        self._sequence = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.telemetry.gauge("sim_events_queued", lambda: len(self._events))
+        self.telemetry.gauge("sim_frames_queued", self._frames_queued)
+        self.telemetry.gauge(
+            "sim_frames_dropped",
+            lambda: self.downlink.dropped + self.uplink.dropped,
+        )
+        self.telemetry.gauge("sim_frames_lost", lambda: self.frames_lost)
+
+    def _frames_queued(self) -> dict[str, int]:
+        now = time.monotonic()
+        return {
+            "downlink": self.downlink.queued(now),
+            "uplink": self.uplink.queued(now),
+        }
+
+    def _latency(self) -> float:
+        if self.settings.latency_distribution == "exponential":
+            return self.random.expovariate(1 / self.settings.latency)
+        if self.settings.latency_distribution == "constant":
+            return self.settings.latency
+        return max(
+            0,
+            self.random.uniform(
+                self.settings.latency - self.settings.latency_jitter,
+                self.settings.latency + self.settings.latency_jitter,
+            ),
+        )
+
+    def _schedule(self, due: float, callback: callable, *args):
+        with self._events_lock:
+            self._sequence += 1
+            heapq.heappush(self._events, (due, self._sequence, callback, args))
+
+    def _run(self):
+        bucket_index = 0
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            due = []
+            with self._events_lock:
+                while self._events and self._events[0][0] <= now:
+                    due.append(heapq.heappop(self._events))
+            for _, _, callback, args in due:
+                callback(*args)
+            for node in self._buckets[bucket_index]:
+                self._send_status(node)
+            bucket_index = (bucket_index + 1) % len(self._buckets)
+            next_tick += self.settings.tick
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # The simulation can't keep up, don't try to catch up
+                next_tick = time.monotonic()
+
+    def _lost(self, node: SimulatedNode) -> bool:
+        if self.random.random() < node.loss_rate:
+            self.frames_lost += 1
+            return True
+        return False
+
+    def _uplink(self, node: SimulatedNode, payload: Payload):
+        node.node_tx_count += 1
+        departure = self.uplink.reserve(time.monotonic())
+        if departure is None or self._lost(node):
+            return
+        # counted on departure, the counters of a probe are consistent
+        node.gw_rx_count += 1
+        if isinstance(payload, PayloadMetricsProbe):
+            payload.gw_tx_count = node.gw_tx_count
+            payload.gw_rx_count = node.gw_rx_count
+            payload.node_tx_count = node.node_tx_count
+            payload.node_rx_count = node.node_rx_count
+        self._schedule(
+            departure + self._latency(), self._deliver, node.address, payload
+        )
+
+    def _deliver(self, source: int, payload: Payload):
+        packet = Packet(
+            payload_type=UPLINK_PAYLOAD_TYPES[type(payload)], payload=payload
+        )
+        self.frames_received += 1
+        self.telemetry.count(
+            "frames_received", payload_type_name(packet.payload_type)
+        )
+        if isinstance(payload, PayloadMetricsProbe):
+            self.telemetry.record_probe(f"{source:08X}", payload)
+        self.on_frame_received(
+            MariHeader(destination=0, source=source), packet
+        )
+
+    def _send_status(self, node: SimulatedNode):
+        self._uplink(
+            node,
+            PayloadStatus(
+                device=node.device.value,
+                status=node.status.value,
+                battery=node.battery,
+                pos_x=node.pos_x,
+                pos_y=node.pos_y,
+            ),
+        )
+        now = time.monotonic()
+        if self.probe_period and now - node.probed_at >= self.probe_period:
+            node.probed_at = now
+            self._uplink(
+                node,
+                PayloadMetricsProbe(
+                    rssi_at_node=node.rssi_dbm + 255,
+                    rssi_at_gw=node.rssi_dbm + 255,
+                ),
+            )
+
+    def _handle_payload(self, node: SimulatedNode, payload: Payload):
+        """Mimic the bootloader and application behavior of a node."""
+        if isinstance(payload, PayloadStart):
+            if node.status == StatusType.Bootloader:
+                node.status = StatusType.Running
+        elif isinstance(payload, PayloadStop):
+            node.status = StatusType.Bootloader
+        elif isinstance(payload, PayloadReset):
+            if node.status == StatusType.Bootloader:
+                node.status = StatusType.Resetting
+                node.pos_x = payload.pos_x
+                node.pos_y = payload.pos_y
+                self._schedule(
+                    time.monotonic() + self.settings.reset_delay,
+                    self._reboot,
+                    node,
+                )
+        elif isinstance(payload, PayloadOTAStart):
+            if node.status not in (
+                StatusType.Bootloader,
+                StatusType.Programming,
+            ):
+                return
+            node.status = StatusType.Programming
+            node.ota_chunks = payload.fw_chunk_count
+            node.ota_received = set()
+            if node.ota_should_fail:
+                node.ota_fail_index = self.random.randrange(
+                    max(1, node.ota_chunks)
+                )
+            self._uplink(node, PayloadOTAStartAck())
+        elif isinstance(payload, PayloadOTAChunk):
+            if node.status != StatusType.Programming:
+                return
+            if node.ota_should_fail and payload.index >= node.ota_fail_index:
+                return
+            node.ota_received.add(payload.index)
+            self._schedule(
+                time.monotonic() + self.settings.ota_write_delay,
+                self._uplink,
+                node,
+                PayloadOTAChunkAck(index=payload.index),
+            )
+            if len(node.ota_received) == node.ota_chunks:
+                node.status = StatusType.Bootloader
+
+    def _reboot(self, node: SimulatedNode):
+        if node.status == StatusType.Resetting:
+            node.status = StatusType.Bootloader
+            self._send_status(node)
+
+    def _receive(self, destination: int, payload: Payload):
+        if destination == BROADCAST_ADDRESS:
+            nodes = self.nodes.values()
+        elif destination in self.nodes:
+            nodes = [self.nodes[destination]]
+        else:
+            return
+        for node in nodes:
+            node.gw_tx_count += 1
+            if not self._lost(node):
+                node.node_rx_count += 1
+                self._handle_payload(node, payload)
+
+    def node_addresses(self) -> list[int]:
+        return list(self.nodes)
+
+    def init(self, on_frame_received: callable):
+        self.on_frame_received = on_frame_received
+        self._thread.start()
+        self.ready.set()
+
+    def close(self):
+        self._stop_event.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def send_payload(self, destination: int, payload: Payload):
+        self.frames_sent += 1
+        self.telemetry.count(
+            "frames_sent",
+            payload_type_name(Packet.from_payload(payload).payload_type),
+        )
+        departure = self.downlink.reserve(time.monotonic())
+        if departure is None:
+            return
+        self._schedule(
+            departure + self._latency(), self._receive, destination, payload
+        )
@@ -0,0 +1,177 @@
+"""Module containing the spatial index of the device positions."""
+
+import math
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+
+SPATIAL_CELL_SIZE_DEFAULT = 250  # mm
+REGION_PATTERN = re.compile(r"^\s*(rect|radius|nearest)\((.*)\)\s*$")
+REGION_ARGUMENTS = {
+    "rect": ("x0", "y0", "x1", "y1"),
+    "radius": ("x", "y", "r"),
+    "nearest": ("x", "y", "k"),
+}
+
+
+class SpatialIndex:
+    """Uniform grid over the positions of the devices, in mm.
+
+    A moving device changes cell in constant time, and the queries only
+    visit the cells overlapping their region.
+    """
+
+    def __init__(self, cell_size: int = SPATIAL_CELL_SIZE_DEFAULT):
+        self.cell_size = cell_size
+        self._positions: dict[str, tuple[int, int]] = {}
+        self._cells: dict[tuple[int, int], set[str]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def _cell(self, x: int, y: int) -> tuple[int, int]:
+        return x // self.cell_size, y // self.cell_size
+
+    def _discard(self, addr: str, position: tuple[int, int]):
+        cell = self._cell(*position)
+        self._cells[cell].discard(addr)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def update(self, addr: str, x: int, y: int):
+        """Record the position of a device."""
+        previous = self._positions.get(addr)
+        if previous == (x, y):
+            return
+        with self._lock:
+            if previous is not None:
+                self._discard(addr, previous)
+            self._positions[addr] = (x, y)
+            self._cells[self._cell(x, y)].add(addr)
+
+    def remove(self, addr: str):
+        with self._lock:
+            position = self._positions.pop(addr, None)
+            if position is not None:
+                self._discard(addr, position)
+
+    def _candidates(
+        self, x0: int, y0: int, x1: int, y1: int
+    ) -> list[tuple[str, tuple[int, int]]]:
+        """Devices of the cells overlapping a rectangle, with positions."""
+        (cx0, cy0), (cx1, cy1) = self._cell(x0, y0), self._cell(x1, y1)
+        with self._lock:
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+                # larger than the occupied area, only visit occupied cells
+                addrs = [
+                    addr
+                    for (cx, cy), cell in self._cells.items()
+                    if cx0 <= cx <= cx1 and cy0 <= cy <= cy1
+                    for addr in cell
+                ]
+            else:
+                addrs = [
+                    addr
+                    for cx in range(cx0, cx1 + 1)
+                    for cy in range(cy0, cy1 + 1)
+                    for addr in self._cells.get((cx, cy), ())
+                ]
+            return [(addr, self._positions[addr]) for addr in addrs]
+
+    def within_rect(self, x0: int, y0: int, x1: int, y1: int) -> list[str]:
+        """Return the devices inside a rectangle, bounds included."""
+        x0, x1 = sorted((x0, x1))
+        y0, y1 = sorted((y0, y1))
+        return sorted(
+            addr
+            for addr, (x, y) in self._candidates(x0, y0, x1, y1)
+            if x0 <= x <= x1 and y0 <= y <= y1
+        )
+
+    def within_radius(self, x: int, y: int, radius: int) -> list[str]:
+        """Return the devices at most `radius` away from a point."""
+        return sorted(
+            addr
+            for addr, position in self._candidates(
+                x - radius, y - radius, x + radius, y + radius
+            )
+            if math.dist(position, (x, y)) <= radius
+        )
+
+    def nearest(self, x: int, y: int, k: int) -> list[str]:
+        """Return the `k` devices closest to a point, closest first.
+
+        Rings of cells around the point are visited until the devices
+        found are closer than any device of the next ring.
+        """
+        if k <= 0:
+            return []
+        cx, cy = self._cell(x, y)
+        with self._lock:
+            if not self._cells:
+                return []
+            reach = max(
+                max(abs(ox - cx), abs(oy - cy)) for ox, oy in self._cells
+            )
+            found = []
+            for ring in range(reach + 1):
+                cells = (
+                    [(cx, cy)]
+                    if ring == 0
+                    else [
+                        (cx + dx, cy + dy)
+                        for dx in range(-ring, ring + 1)
+                        for dy in range(-ring, ring + 1)
+                        if max(abs(dx), abs(dy)) == ring
+                    ]
+                )
+                for cell in cells:
+                    for addr in self._cells.get(cell, ()):
+                        position = self._positions[addr]
+                        found.append((math.dist(position, (x, y)), addr))
+                found.sort()
+                # the devices of the next rings are at least that far
+                horizon = ring * self.cell_size
+                if len(found) >= k and found[k - 1][0] <= horizon:
+                    break
+        return [addr for _, addr in found[:k]]
+
+
+@dataclass
+class Region:
+    """Devices selected by their position, `rect(x0,y0,x1,y1)`,
+    `radius(x,y,r)` or `nearest(x,y,k)`."""
+
+    kind: str
+    args: tuple[int, ...]
+
+    def select(self, index: SpatialIndex) -> list[str]:
+        if self.kind == "rect":
+            return index.within_rect(*self.args)
+        if self.kind == "radius":
+            return index.within_radius(*self.args)
+        return index.nearest(*self.args)
+
+
+def parse_region(text: str) -> Region | None:
+    """Return the region of a selector, None for a device address.
+
+    Raise ValueError when the selector is malformed.
+    """
+    match = REGION_PATTERN.match(text)
+    if match is None:
+        return None
+    kind, args = match.groups()
+    expected = REGION_ARGUMENTS[kind]
+    try:
+        values = tuple(int(float(arg)) for arg in args.split(","))
+    except ValueError:
+        values = ()
+    if len(values) != len(expected):
+        raise ValueError(
+            f"invalid selector {text.strip()}, "
+            f"expected {kind}({','.join(expected)})"
+        )
+    return Region(kind, values)
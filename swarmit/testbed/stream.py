@@ -0,0 +1,228 @@
+"""Module containing the fan-out of live data to streaming clients."""
+
+import asyncio
+import json
+import threading
+from collections import deque
+
+from swarmit.testbed.eventlog import EventLogRecord
+
+STREAM_BUFFER_SIZE = 1000  # messages per client
+STREAM_KEEPALIVE = 15  # s
+STATUS_STREAM_INTERVAL_DEFAULT = 0.1  # s
+
+
+class StreamSubscriber:
+    """Bounded buffer of the messages waiting to be sent to a client.
+
+    Messages are pushed from any thread, the oldest ones are dropped when
+    the client is too slow to keep up.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        devices: list[str] = None,
+        buffer_size: int = STREAM_BUFFER_SIZE,
+    ):
+        self.devices = set(devices or [])
+        self.dropped = 0
+        self._buffer: deque[str] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def push(self, messages: list[str]):
+        with self._lock:
+            overflow = len(self._buffer) + len(messages) - self._buffer.maxlen
+            if overflow > 0:
+                self.dropped += overflow
+            self._buffer.extend(messages)
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # The event loop of the client is closed
+            pass
+
+    async def get(self) -> tuple[list[str], int]:
+        """Wait for messages, return them with the number of dropped ones."""
+        await self._event.wait()
+        self._event.clear()
+        with self._lock:
+            messages = list(self._buffer)
+            self._buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+        return messages, dropped
+
+
+class EventLogBroadcaster:
+    """Fan-out of the event logs to the streaming clients.
+
+    It is an output of the event log sink: each record is serialized once,
+    whatever the number of clients.
+    """
+
+    def __init__(self, buffer_size: int = STREAM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.subscribers: list[StreamSubscriber] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, devices: list[str] = None) -> StreamSubscriber:
+        """Register a client, must be called from its event loop."""
+        subscriber = StreamSubscriber(
+            asyncio.get_running_loop(), devices, self.buffer_size
+        )
+        with self._lock:
+            self.subscribers = [*self.subscribers, subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        with self._lock:
+            self.subscribers = [
+                sub for sub in self.subscribers if sub is not subscriber
+            ]
+
+    def __call__(self, records: list[EventLogRecord]):
+        subscribers = self.subscribers
+        if not subscribers:
+            return
+        messages = [
+            (record.device, json.dumps(record.to_dict())) for record in records
+        ]
+        for subscriber in subscribers:
+            selected = [
+                message
+                for device, message in messages
+                if not subscriber.devices or device in subscriber.devices
+            ]
+            if selected:
+                subscriber.push(selected)
+
+
+class StatusBroadcaster:
+    """Fan-out of the device status changes to the streaming clients.
+
+    A client first receives a snapshot of all the devices, then updates
+    with only the devices that changed or were removed. Changes are
+    published every `interval` seconds, so position updates are coalesced,
+    or right away when `wake` is called (e.g. on a status transition). Each
+    message is serialized once, whatever the number of clients.
+    """
+
+    def __init__(
+        self,
+        status_data: dict,
+        interval: float = STATUS_STREAM_INTERVAL_DEFAULT,
+        buffer_size: int = STREAM_BUFFER_SIZE,
+    ):
+        self.status_data = status_data
+        self.interval = interval
+        self.buffer_size = buffer_size
+        self.subscribers: list[StreamSubscriber] = []
+        self.version = 0
+        self._state: dict[str, dict] = {}
+        self._snapshot: str = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _serialize(status) -> dict:
+        return {
+            "device": status.device.name,
+            "status": status.status.name,
+            "battery": status.battery,
+            "pos_x": status.pos_x,
+            "pos_y": status.pos_y,
+        }
+
+    def _publish(self):
+        state = {
+            addr: self._serialize(status)
+            for addr, status in list(self.status_data.items())
+        }
+        updated = {
+            addr: device
+            for addr, device in state.items()
+            if self._state.get(addr) != device
+        }
+        removed = [addr for addr in self._state if addr not in state]
+        if not updated and not removed:
+            return
+        self._state = state
+        self._snapshot = None
+        self.version += 1
+        message = (
+            "event: update\ndata: "
+            + json.dumps(
+                {
+                    "version": self.version,
+                    "updated": updated,
+                    "removed": removed,
+                }
+            )
+            + "\n\n"
+        )
+        for subscriber in self.subscribers:
+            subscriber.push([message])
+
+    def publish(self):
+        """Send the changes since the last call to the clients."""
+        with self._lock:
+            if self.subscribers:
+                self._publish()
+
+    def snapshot(self) -> str:
+        """Return the snapshot message of the last published version."""
+        with self._lock:
+            return self._snapshot_message()
+
+    def _snapshot_message(self) -> str:
+        if self._snapshot is None:
+            self._snapshot = (
+                "event: snapshot\ndata: "
+                + json.dumps({"version": self.version, "devices": self._state})
+                + "\n\n"
+            )
+        return self._snapshot
+
+    def subscribe(self) -> StreamSubscriber:
+        """Register a client, must be called from its event loop.
+
+        The snapshot is the first message of the client.
+        """
+        subscriber = StreamSubscriber(
+            asyncio.get_running_loop(), buffer_size=self.buffer_size
+        )
+        with self._lock:
+            # Bring the state up to date, it isn't while nobody listens
+            self._publish()
+            subscriber.push([self._snapshot_message()])
+            self.subscribers = [*self.subscribers, subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        with self._lock:
+            self.subscribers = [
+                sub for sub in self.subscribers if sub is not subscriber
+            ]
+
+    def wake(self):
+        """Publish the pending changes without waiting for the interval."""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.publish()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join()
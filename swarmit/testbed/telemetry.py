@@ -0,0 +1,366 @@
+"""Module containing the telemetry counters of the adapters and controller."""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from dataclasses import asdict, dataclass
+
+from marilib.mari_protocol import MetricsProbePayload
+from rich import print
+from rich.table import Table
+
+from swarmit.testbed.protocol import PayloadType
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+METRICS_PREFIX = "swarmit"
+# name of the label of the metrics, "label" when not listed
+METRICS_LABELS = {
+    "frames_received": "payload_type",
+    "frames_sent": "payload_type",
+    "frames_handled": "payload_type",
+    "gateway_frames_received": "gateway",
+    "gateway_frames_sent": "gateway",
+    "gateway_sends_queued": "gateway",
+    "nodes_queue_depth": "gateway",
+    "sim_frames_queued": "channel",
+    "eventlog_rate_limited": "limit",
+    "devices_by_status": "status",
+    "devices_battery": "level",
+    "devices_link": "state",
+    "command_confirm_latency": "command",
+    "jobs": "state",
+    "responses": "status_code",
+    "request_latency": "route",
+}
+PAYLOAD_TYPE_NAMES = {int(type_): type_.name for type_ in PayloadType}
+
+
+def payload_type_name(payload_type: int) -> str:
+    """Return the name of a payload type, its hex value if unknown."""
+    return PAYLOAD_TYPE_NAMES.get(payload_type, f"0x{payload_type:02X}")
+
+
+class Histogram:
+    """Histogram with fixed bucket boundaries."""
+
+    def __init__(self, buckets: tuple[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        """Add the samples of a histogram with the same buckets."""
+        for index, count in enumerate(list(other.counts)):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket containing the quantile."""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= rank:
+                break
+        if index == len(self.buckets):
+            return float("inf")
+        return self.buckets[index]
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(
+                    (*self.buckets, "+Inf"), self.counts, strict=True
+                )
+            },
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+@dataclass
+class LinkQuality:
+    """Class that holds the link quality of a device."""
+
+    rssi_node_dbm: int = 0
+    rssi_gw_dbm: int = 0
+    pdr_downlink: float = 0
+    pdr_uplink: float = 0
+    updated_at: float = 0
+
+
+class _TelemetryShard:
+    """Counters and histograms updated by a single thread, or retired from
+    the threads that ended when `thread` is None."""
+
+    __slots__ = ("counters", "histograms", "thread")
+
+    def __init__(self, thread: threading.Thread = None):
+        self.counters: dict[str, Counter] = {}
+        self.histograms: dict[tuple[str, str], Histogram] = {}
+        self.thread = thread
+
+    @property
+    def retired(self) -> bool:
+        return self.thread is None or not self.thread.is_alive()
+
+    def merge(self, other: "_TelemetryShard"):
+        for name, counter in list(other.counters.items()):
+            self.counters.setdefault(name, Counter()).update(dict(counter))
+        for key, histogram in list(other.histograms.items()):
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(histogram.buckets)
+            self.histograms[key].merge(histogram)
+
+
+class Telemetry:
+    """Counters, gauges and histograms of an adapter or a controller.
+
+    Each thread records its samples in its own shard, without lock, the
+    shards are only aggregated when a snapshot is requested. The shards of
+    the threads that ended are folded in a single one when a thread
+    registers its own. Gauges are callables returning a value, or a dict
+    of values by label.
+    """
+
+    def __init__(self):
+        self.gauges: dict[str, callable] = {}
+        self.links: dict[str, LinkQuality] = {}
+        # merged in the counters, histograms and links, not in the gauges
+        self.sources: list[Telemetry] = []
+        self._local = threading.local()
+        self._shards: list[_TelemetryShard] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> _TelemetryShard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _TelemetryShard(threading.current_thread())
+            self._local.shard = shard
+            with self._shards_lock:
+                retired = [s for s in self._shards if s.retired]
+                shards = [s for s in self._shards if not s.retired]
+                if len(retired) > 1:
+                    # a new shard, the ones of the readers stay unchanged
+                    folded = _TelemetryShard()
+                    for retired_shard in retired:
+                        folded.merge(retired_shard)
+                    retired = [folded]
+                self._shards = [*retired, *shards, shard]
+        return shard
+
+    def count(self, name: str, label: str = "", value: int = 1):
+        counters = self._shard().counters
+        counter = counters.get(name)
+        if counter is None:
+            counter = counters[name] = Counter()
+        counter[label] += value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        label: str = "",
+        buckets: tuple[float] = LATENCY_BUCKETS,
+    ):
+        histograms = self._shard().histograms
+        histogram = histograms.get((name, label))
+        if histogram is None:
+            histogram = histograms[(name, label)] = Histogram(buckets)
+        histogram.observe(value)
+
+    def gauge(self, name: str, getter: callable):
+        """Register a callable returning the current value of a gauge."""
+        self.gauges[name] = getter
+
+    @property
+    def counters(self) -> dict[str, Counter]:
+        """Return the counters of all the threads."""
+        counters: dict[str, Counter] = {}
+        for shard in self._shards:
+            for name, counter in list(shard.counters.items()):
+                counters.setdefault(name, Counter()).update(dict(counter))
+        for source in self.sources:
+            for name, counter in source.counters.items():
+                counters.setdefault(name, Counter()).update(counter)
+        return counters
+
+    @property
+    def histograms(self) -> dict[tuple[str, str], Histogram]:
+        """Return the histograms of all the threads, by name and label."""
+        histograms: dict[tuple[str, str], Histogram] = {}
+        for items in (
+            *(list(shard.histograms.items()) for shard in self._shards),
+            *(source.histograms.items() for source in self.sources),
+        ):
+            for key, histogram in items:
+                if key not in histograms:
+                    histograms[key] = Histogram(histogram.buckets)
+                histograms[key].merge(histogram)
+        return histograms
+
+    def record_probe(self, device_addr: str, probe: MetricsProbePayload):
+        """Update the link quality of a device from a metrics probe."""
+        self.links[device_addr] = LinkQuality(
+            rssi_node_dbm=probe.rssi_at_node_dbm(),
+            rssi_gw_dbm=probe.rssi_at_gw_dbm(),
+            pdr_downlink=probe.pdr_downlink_radio(),
+            pdr_uplink=probe.pdr_uplink_radio(),
+            updated_at=time.time(),
+        )
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": {
+                name: dict(counter) for name, counter in self.counters.items()
+            },
+            "gauges": {name: getter() for name, getter in self.gauges.items()},
+            "histograms": {
+                f"{name} {label}" if label else name: histogram.as_dict()
+                for (name, label), histogram in self.histograms.items()
+            },
+            "links": {
+                addr: asdict(link)
+                for telemetry in (*self.sources, self)
+                for addr, link in list(telemetry.links.items())
+            },
+        }
+
+
+def _metric_labels(name: str, label: str, **extra) -> str:
+    labels = {METRICS_LABELS.get(name, "label"): label} if label else {}
+    labels.update(extra)
+    if not labels:
+        return ""
+    escaped = (
+        (key, f"{value}".replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def prometheus_metrics(telemetries: dict[str, Telemetry]) -> str:
+    """Return the metrics in the Prometheus text format.
+
+    Metrics are named after their source, `swarmit_<source>_<name>`.
+    """
+    lines = []
+    for source, telemetry in telemetries.items():
+        prefix = f"{METRICS_PREFIX}_{source}"
+        for name, counter in sorted(telemetry.counters.items()):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for label, value in sorted(counter.items()):
+                lines.append(f"{metric}{_metric_labels(name, label)} {value}")
+        for name, getter in sorted(telemetry.gauges.items()):
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            value = getter()
+            values = value if isinstance(value, dict) else {"": value}
+            for label, value in values.items():
+                lines.append(f"{metric}{_metric_labels(name, label)} {value}")
+        histograms: dict[str, list] = {}
+        for (name, label), histogram in telemetry.histograms.items():
+            histograms.setdefault(name, []).append((label, histogram))
+        for name, labeled in sorted(histograms.items()):
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for label, histogram in sorted(labeled, key=lambda h: h[0]):
+                cumulated = 0
+                for bound, count in zip(
+                    (*histogram.buckets, "+Inf"), histogram.counts, strict=True
+                ):
+                    cumulated += count
+                    lines.append(
+                        f"{metric}_bucket"
+                        f"{_metric_labels(name, label, le=bound)} {cumulated}"
+                    )
+                labels = _metric_labels(name, label)
+                lines.append(f"{metric}_sum{labels} {histogram.sum}")
+                lines.append(f"{metric}_count{labels} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+def print_telemetry(snapshot: dict[str, dict]) -> None:
+    """Print telemetry snapshots, keyed by source (adapter, controller)."""
+    for source, data in snapshot.items():
+        print()
+        print(f"[bold]{source.capitalize()} telemetry:[/]")
+        counters_table = Table()
+        counters_table.add_column("Counter", style="magenta", no_wrap=True)
+        counters_table.add_column("Label", style="cyan")
+        counters_table.add_column("Value", style="green", justify="right")
+        for name, counter in sorted(data["counters"].items()):
+            for label, value in sorted(counter.items()):
+                counters_table.add_row(name, label, f"{value}")
+        for name, value in sorted(data["gauges"].items()):
+            values = value if isinstance(value, dict) else {"": value}
+            for label, value in values.items():
+                counters_table.add_row(name, label, f"{value}")
+        print(counters_table)
+        if data["histograms"]:
+            histograms_table = Table()
+            histograms_table.add_column(
+                "Latency", style="magenta", no_wrap=True
+            )
+            for column in ("Count", "Mean", "P50", "P90", "P99"):
+                histograms_table.add_column(
+                    column, style="green", justify="right"
+                )
+            for name, histogram in sorted(data["histograms"].items()):
+                mean = (
+                    histogram["sum"] / histogram["count"]
+                    if histogram["count"]
+                    else 0
+                )
+                histograms_table.add_row(
+                    name,
+                    f"{histogram['count']}",
+                    f"{mean * 1000:.1f}ms",
+                    f"<{histogram['p50'] * 1000:.0f}ms",
+                    f"<{histogram['p90'] * 1000:.0f}ms",
+                    f"<{histogram['p99'] * 1000:.0f}ms",
+                )
+            print(histograms_table)
+        if data["links"]:
+            links_table = Table()
+            links_table.add_column(
+                "Device Addr", style="magenta", no_wrap=True
+            )
+            for column in ("RSSI node", "RSSI gw", "PDR down", "PDR up"):
+                links_table.add_column(column, style="cyan", justify="center")
+            for addr, link in sorted(data["links"].items()):
+                links_table.add_row(
+                    addr,
+                    f"{link['rssi_node_dbm']}dBm",
+                    f"{link['rssi_gw_dbm']}dBm",
+                    f"{link['pdr_downlink'] * 100:.1f}%",
+                    f"{link['pdr_uplink'] * 100:.1f}%",
+                )
+            print(links_table)
+        if data.get("eventlog_top_limited"):
+            limited_table = Table()
+            limited_table.add_column(
+                "Device Addr", style="magenta", no_wrap=True
+            )
+            limited_table.add_column(
+                "Event logs dropped", style="green", justify="right"
+            )
+            for addr, dropped in data["eventlog_top_limited"].items():
+                limited_table.add_row(addr, f"{dropped}")
+            print(limited_table)
@@ -3,13 +3,18 @@
 import asyncio
 import base64
 import datetime
+import json
 import os
+import secrets
+import threading
+import time
 from contextlib import asynccontextmanager
 from dataclasses import asdict
-from typing import List, Optional, Union
+from typing import Annotated, List, Literal, Optional, Union
 
 import jwt
 from fastapi import (
+    APIRouter,
     Depends,
     FastAPI,
     HTTPException,
@@ -18,26 +23,63 @@ from fastapi import (
 from fastapi import status as fastapi_status
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, BeforeValidator, Field, field_validator
 from sqlalchemy import asc
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from swarmit import __version__
-from swarmit.testbed.controller import Controller, ControllerSettings
+from swarmit.testbed.auth import (
+    KeyFiles,
+    TokenCache,
+    load_private_key,
+    load_public_key,
+)
+from swarmit.testbed.compression import (
+    CompressionMiddleware,
+    PrecompressedStaticFiles,
+)
+from swarmit.testbed.controller import (
+    Controller,
+    ControllerSettings,
+    NodeStatus,
+    ResetLocation,
+    parse_lh2_calibration,
+)
+from swarmit.testbed.firmware import (
+    FirmwareEmpty,
+    FirmwareStore,
+    FirmwareTooLarge,
+)
+from swarmit.testbed.helpers import json_dumps
+from swarmit.testbed.jobs import (
+    FINISHED_STATE_VALUES,
+    FlashJob,
+    FlashJobManager,
+    JobState,
+)
+from swarmit.testbed.logstore import LOGSTORE_QUERY_LIMIT_DEFAULT
 from swarmit.testbed.model import (
-    Base,
     JWTRecord,
     create_db_engine,
-    create_prevent_overlap_trigger,
     create_session_factory,
+    init_db,
 )
+from swarmit.testbed.process import ControllerProcess
 from swarmit.testbed.protocol import StatusType
+from swarmit.testbed.scheduler import (
+    ALL_DEVICES,
+    DeviceLeases,
+    LeaseConflict,
+)
+from swarmit.testbed.selector import parse_selector, split_devices
+from swarmit.testbed.stream import STREAM_KEEPALIVE
+from swarmit.testbed.telemetry import Telemetry, prometheus_metrics
 
 DATA_DIR = "./.data"
+RECORDS_CACHE_TTL = 60  # s
 API_DB_URL = f"sqlite:///{DATA_DIR}/database.db"
 
 
@@ -66,52 +108,157 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
-# Global lock to prevent concurrent controller access
-controller_lock = asyncio.Lock()
+
+class LatencyMiddleware:
+    """Time the handlers, until their response starts, per route."""
+
+    def __init__(self, app, telemetry: Telemetry):
+        self.app = app
+        self.telemetry = telemetry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                route = getattr(scope.get("route"), "path", "other")
+                self.telemetry.observe(
+                    "request_latency",
+                    time.perf_counter() - started_at,
+                    label=f"{scope['method']} {route}",
+                )
+                self.telemetry.count("responses", f"{message['status']}")
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
+
+HTTP_TELEMETRY = Telemetry()
+api.add_middleware(LatencyMiddleware, telemetry=HTTP_TELEMETRY)
+api.add_middleware(CompressionMiddleware)
+
+# Routes of a testbed, see get_testbed
+testbed_api = APIRouter()
+
+
+# Load Ed25519 keys, cached until the files change
+KEY_FILES = KeyFiles()
 
 
-# Load Ed25519 keys
 def get_private_key() -> str:
-    with open(f"{DATA_DIR}/private.pem") as f:
-        return f.read()
+    return KEY_FILES.read(f"{DATA_DIR}/private.pem")
 
 
 def get_public_key() -> str:
-    with open(f"{DATA_DIR}/public.pem") as f:
-        return f.read()
+    return KEY_FILES.read(f"{DATA_DIR}/public.pem")
 
 
 ALGORITHM = "EdDSA"
 security = HTTPBearer()
 
 
-def verify_jwt(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def token_expired():
+    return HTTPException(
+        status_code=fastapi_status.HTTP_401_UNAUTHORIZED,
+        detail="Token expired",
+    )
+
+
+async def verify_jwt(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
     try:
-        public_key = get_public_key()
+        public_key = load_public_key(get_public_key())
     except FileNotFoundError:
         raise HTTPException(
             status_code=fastapi_status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="public.pem not found; public key unavailable",
         )
+    token = credentials.credentials
+    tokens: TokenCache = request.app.state.token_cache
+    payload = tokens.get(token, public_key)
+    if payload is not None:
+        # Same time claims checks as jwt.decode
+        now = time.time()
+        if "exp" in payload and now >= payload["exp"]:
+            tokens.discard(token)
+            raise token_expired()
+        if "nbf" not in payload or now >= payload["nbf"]:
+            return payload
     try:
-        payload = jwt.decode(
-            credentials.credentials, public_key, algorithms=[ALGORITHM]
-        )
-        return payload
+        payload = jwt.decode(token, public_key, algorithms=[ALGORITHM])
     except jwt.ExpiredSignatureError:
-        raise HTTPException(
-            status_code=fastapi_status.HTTP_401_UNAUTHORIZED,
-            detail="Token expired",
-        )
+        raise token_expired()
     except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=fastapi_status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
         )
+    tokens.put(token, public_key, payload)
+    return payload
 
 
-def init_api(api: FastAPI, settings: ControllerSettings):
-    controller = Controller(settings)
+def network_key(network_id: int) -> str:
+    return f"{network_id:04X}"
+
+
+class Testbed:
+    """A controller and the state the dashboard keeps about it."""
+
+    def __init__(self, controller: Controller):
+        self.controller = controller
+        self.status_cache = StatusCache(controller)
+        self.device_leases = DeviceLeases()
+        self.flash_jobs: FlashJobManager = None
+
+    def start(self):
+        self.flash_jobs = FlashJobManager(
+            self.controller, leases=self.device_leases
+        )
+
+    def stop(self):
+        self.flash_jobs.close()
+        self.controller.terminate()
+
+
+def get_testbed(request: Request) -> Testbed:
+    """Return the testbed of the request, the first one outside /networks."""
+    testbeds: dict[str, Testbed] = request.app.state.testbeds
+    network_id = request.path_params.get("network_id")
+    if network_id is None:
+        return next(iter(testbeds.values()))
+    testbed = testbeds.get(network_id.upper().removeprefix("0X"))
+    if testbed is None:
+        raise HTTPException(
+            status_code=404, detail=f"unknown network: {network_id}"
+        )
+    return testbed
+
+
+def init_api(
+    api: FastAPI, settings: ControllerSettings | list[ControllerSettings]
+):
+    """Create the controllers of the testbeds, the first one is the default.
+
+    Return the default controller.
+    """
+    if isinstance(settings, ControllerSettings):
+        settings = [settings]
+    testbeds: dict[str, Testbed] = {}
+    for testbed_settings in settings:
+        key = network_key(testbed_settings.network_id)
+        if key in testbeds:
+            raise ValueError(f"network {key} is configured twice")
+        if testbed_settings.controller_process:
+            controller = ControllerProcess(testbed_settings)
+        else:
+            controller = Controller(testbed_settings)
+        testbeds[key] = Testbed(controller)
+    controller = next(iter(testbeds.values())).controller
 
     @asynccontextmanager
     async def lifespan(app: FastAPI):
@@ -120,20 +267,23 @@ def init_api(api: FastAPI, settings: ControllerSettings):
         engine = create_db_engine(API_DB_URL)
         SessionLocal = create_session_factory(engine)
 
-        # Initialize DB schema
-        Base.metadata.create_all(bind=engine)
-
-        # Create triggers
-        with engine.connect() as conn:
-            create_prevent_overlap_trigger(conn)
+        # Initialize DB schema, indexes and triggers
+        init_db(engine)
+        app.state.records_cache = RecordsCache()
 
         # Run on startup
+        app.state.testbeds = testbeds
         app.state.controller = controller
+        for testbed in testbeds.values():
+            testbed.start()
+        app.state.token_cache = TokenCache()
+        app.state.firmware_store = FirmwareStore(f"{DATA_DIR}/firmwares")
 
         yield
 
         # Run on shutdown
-        controller.terminate()
+        for testbed in testbeds.values():
+            testbed.stop()
         engine.dispose()
 
     api.router.lifespan_context = lifespan
@@ -141,89 +291,422 @@ def init_api(api: FastAPI, settings: ControllerSettings):
     return controller
 
 
+def validate_devices(v):
+    """Device addresses, or selectors such as type=DotBotV3&battery>2.5V."""
+    if v is None:
+        return None
+    if isinstance(v, str):
+        v = [v]
+    if isinstance(v, list):
+        # ensure list of strings
+        if not all(isinstance(item, str) for item in v):
+            raise ValueError("devices must be a list of strings")
+        for item in v:
+            parse_selector(item)
+        return v
+    raise ValueError("devices must be a string or list of strings")
+
+
+def select_devices(request: Request, devices: list[str] | None):
+    """Resolve the selectors, 400 if they select no device."""
+    selected = get_testbed(request).controller.select_devices(devices)
+    if selected == []:
+        raise HTTPException(
+            status_code=400, detail="no devices match the selectors"
+        )
+    return selected
+
+
+DeviceSelection = Annotated[
+    Optional[Union[str, List[str]]], BeforeValidator(validate_devices)
+]
+
+
 class DeviceList(BaseModel):
-    devices: Optional[Union[str, List[str]]] = None
-
-    @field_validator("devices", mode="before")
-    def validate_devices(cls, v):
-        if v is None:
-            return None
-        if isinstance(v, str):
-            return [v]
-        if isinstance(v, list):
-            # ensure list of strings
-            if not all(isinstance(item, str) for item in v):
-                raise ValueError("devices must be a list of strings")
-            return v
-        raise ValueError("devices must be a string or list of strings")
+    devices: DeviceSelection = None
 
 
 class FlashRequest(BaseModel):
-    firmware_b64: str
-    devices: Optional[Union[str, List[str]]] = None
+    # the image itself, or the hash of an image uploaded to /firmware
+    firmware_b64: Optional[str] = None
+    firmware_hash: Optional[str] = None
+    devices: DeviceSelection = None
 
 
-@api.post("/flash", dependencies=[Depends(verify_jwt)])
-async def flash_firmware(payload: FlashRequest, request: Request):
-    controller: Controller = request.app.state.controller
+@api.post("/firmware", dependencies=[Depends(verify_jwt)])
+async def upload_firmware(request: Request):
+    """Upload a firmware image as the raw request body.
 
+    The image is stored under its SHA-256 hash, to pass as `firmware_hash`
+    to the flash requests.
+    """
+    store: FirmwareStore = request.app.state.firmware_store
+    try:
+        fw_hash, size = await store.store(request.stream())
+    except FirmwareTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except FirmwareEmpty as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return JSONResponse(content={"response": {"hash": fw_hash, "size": size}})
+
+
+@api.get("/firmware/{fw_hash}")
+async def firmware(fw_hash: str, request: Request):
+    """Tell whether an image is already uploaded, to skip its upload."""
+    store: FirmwareStore = request.app.state.firmware_store
     try:
-        fw_bytes = base64.b64decode(payload.firmware_b64)
-        fw = bytearray(fw_bytes)
-    except Exception as e:
+        size = store.size(fw_hash)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if size is None:
+        raise HTTPException(status_code=404, detail="unknown firmware")
+    return JSONResponse(content={"response": {"hash": fw_hash, "size": size}})
+
+
+def submit_flash_job(payload: FlashRequest, request: Request) -> FlashJob:
+    testbed = get_testbed(request)
+    controller: Controller = testbed.controller
+
+    if payload.firmware_hash is not None:
+        store: FirmwareStore = request.app.state.firmware_store
+        try:
+            fw = store.load(payload.firmware_hash)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="unknown firmware")
+    elif payload.firmware_b64 is not None:
+        try:
+            fw = bytearray(base64.b64decode(payload.firmware_b64))
+        except Exception as e:
+            raise HTTPException(
+                status_code=400, detail=f"invalid firmware encoding: {e}"
+            )
+    else:
         raise HTTPException(
-            status_code=400, detail=f"invalid firmware encoding: {e}"
+            status_code=400, detail="firmware_b64 or firmware_hash required"
         )
 
-    # Normalize devices
-    devices = payload.devices
+    devices = select_devices(request, payload.devices)
     if all(
-        controller.status_data[device].status != StatusType.Bootloader
-        for device in devices
+        status.status != StatusType.Bootloader
+        for status in (
+            [controller.status_data.get(device) for device in devices]
+            if devices
+            else list(controller.status_data.values())
+        )
+        if status is not None
     ):
         raise HTTPException(
             status_code=400, detail="no ready devices to flash"
         )
 
-    async with controller_lock:
+    return testbed.flash_jobs.submit(fw, devices)
 
-        start_data = (
-            await run_in_threadpool(controller.start_ota, fw, devices)
-            if devices
-            else await run_in_threadpool(controller.start_ota, fw)
+
+@testbed_api.post("/flash", dependencies=[Depends(verify_jwt)])
+async def flash_firmware(payload: FlashRequest, request: Request):
+    """Flash the devices and answer once done, see /flash/jobs to not wait."""
+    job = submit_flash_job(payload, request)
+    await get_testbed(request).flash_jobs.wait(job)
+    if job.state != JobState.Done:
+        # a canceled job has no error
+        raise HTTPException(
+            status_code=400, detail=job.error or f"flash job {job.state.value}"
         )
 
-        if start_data["missed"]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"{len(start_data['missed'])} acknowledgments are missing "
-                f"({', '.join(sorted(set(start_data['missed'])))})",
-            )
+    return JSONResponse(content={"response": "success"})
 
-        data = await run_in_threadpool(
-            controller.transfer, fw, start_data["acked"]
-        )
 
-    if all(device.success for device in data.values()) is False:
-        raise HTTPException(status_code=400, detail="transfer failed")
+@testbed_api.post(
+    "/flash/jobs", status_code=202, dependencies=[Depends(verify_jwt)]
+)
+async def submit_flash(payload: FlashRequest, request: Request):
+    """Queue a flash job, its progress is at /flash/jobs/{job_id}."""
+    job = submit_flash_job(payload, request)
+    controller: Controller = get_testbed(request).controller
+    progress = await run_in_threadpool(job.progress, controller)
+    return JSONResponse(status_code=202, content={"response": progress})
+
+
+def get_flash_job(job_id: str, request: Request) -> FlashJob:
+    job = get_testbed(request).flash_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown flash job")
+    return job
+
+
+@testbed_api.get("/flash/jobs/{job_id}")
+async def flash_job(job_id: str, request: Request):
+    """Return the state of a flash job, with the progress of each device."""
+    job = get_flash_job(job_id, request)
+    controller: Controller = get_testbed(request).controller
+    progress = await run_in_threadpool(job.progress, controller)
+    return JSONResponse(content={"response": progress})
+
+
+@testbed_api.get("/flash/jobs/{job_id}/stream")
+async def flash_job_stream(job_id: str, request: Request):
+    """Stream the progress of a flash job as server-sent events.
+
+    The stream ends with the final state of the job.
+    """
+    job = get_flash_job(job_id, request)
+    flash_jobs: FlashJobManager = get_testbed(request).flash_jobs
+
+    async def event_stream():
+        subscriber = await flash_jobs.subscribe(job)
+        try:
+            while True:
+                try:
+                    messages, _ = await asyncio.wait_for(
+                        subscriber.get(), STREAM_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                # only the latest progress matters
+                yield f"data: {messages[-1]}\n\n"
+                if json.loads(messages[-1])["state"] in FINISHED_STATE_VALUES:
+                    break
+        finally:
+            flash_jobs.unsubscribe(job, subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
-    return JSONResponse(content={"response": "success"})
 
+@testbed_api.delete("/flash/jobs/{job_id}", dependencies=[Depends(verify_jwt)])
+async def cancel_flash_job(job_id: str, request: Request):
+    """Cancel a pending flash job or interrupt the running one."""
+    job = get_flash_job(job_id, request)
+    if job.finished:
+        raise HTTPException(status_code=409, detail="flash job is finished")
+    testbed = get_testbed(request)
+    controller: Controller = testbed.controller
 
-@api.get("/status")
-async def status(request: Request):
-    controller: Controller = request.app.state.controller
-    response = {
-        k: {
-            **asdict(v),
-            "device": v.device.name,
-            "status": v.status.name,
-        }
-        for k, v in controller.status_data.items()
+    def cancel():
+        testbed.flash_jobs.cancel(job)
+        return job.progress(controller)
+
+    progress = await run_in_threadpool(cancel)
+    return JSONResponse(content={"response": progress})
+
+
+def serialize_status(status: NodeStatus) -> dict:
+    return {
+        **asdict(status),
+        "device": status.device.name,
+        "status": status.status.name,
     }
+
+
+class StatusCache:
+    """Serialized /status body of the last status version of a controller."""
+
+    def __init__(self, controller: Controller):
+        self.controller = controller
+        self.version = None
+        self.body = b""
+        self.etag = ""
+        # distinguishes the versions of different controller runs
+        self._instance = secrets.token_hex(4)
+
+    def get(self) -> tuple[bytes, str]:
+        """Return the body and its ETag, serialized again only on change."""
+        version = self.controller.status_version
+        if version != self.version:
+            response = {
+                k: serialize_status(v)
+                for k, v in list(self.controller.status_data.items())
+            }
+            self.body = json_dumps({"response": response})
+            self.etag = f'"{self._instance}-{version}"'
+            self.version = version
+        return self.body, self.etag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+@testbed_api.get("/status")
+async def status(request: Request, devices: Optional[str] = None):
+    """Return the status of the devices.
+
+    The response is cached until the status changes, clients sending back
+    its ETag in `If-None-Match` get a 304 while nothing changed. `devices`
+    is a comma-separated list of device addresses and selectors to only
+    return some devices, such responses are not cached.
+    """
+    if devices:
+        try:
+            selected = select_devices(
+                request, validate_devices(split_devices(devices))
+            )
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail=str(exc))
+        status_data = get_testbed(request).controller.status_data
+        return Response(
+            content=json_dumps(
+                {
+                    "response": {
+                        addr: serialize_status(status_data[addr])
+                        for addr in selected
+                        if addr in status_data
+                    }
+                }
+            ),
+            media_type="application/json",
+            headers={"Cache-Control": "no-cache"},
+        )
+    cache: StatusCache = get_testbed(request).status_cache
+    body, etag = cache.get()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=body, media_type="application/json", headers=headers
+    )
+
+
+@testbed_api.get("/status/stream")
+async def status_stream(request: Request):
+    """Stream the status of the devices as server-sent events.
+
+    A `snapshot` event with all the devices is sent first, then `update`
+    events with only the changed and removed devices. A slow client gets a
+    new snapshot instead of the updates it missed.
+    """
+    controller: Controller = get_testbed(request).controller
+
+    async def event_stream():
+        subscriber = controller.status_stream.subscribe()
+        try:
+            while True:
+                try:
+                    messages, dropped = await asyncio.wait_for(
+                        subscriber.get(), STREAM_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if dropped:
+                    messages = [controller.status_stream.snapshot()]
+                yield "".join(messages)
+        finally:
+            controller.status_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@testbed_api.get("/telemetry")
+async def telemetry(request: Request):
+    controller: Controller = get_testbed(request).controller
+    snapshot = await run_in_threadpool(controller.telemetry_snapshot)
+    return JSONResponse(content={"response": snapshot})
+
+
+@testbed_api.get("/metrics")
+async def metrics(request: Request):
+    """Return the telemetry in the Prometheus text format."""
+    testbed = get_testbed(request)
+    controller = testbed.controller
+    content = await run_in_threadpool(controller.metrics)
+    content += prometheus_metrics(
+        {"flash": testbed.flash_jobs.telemetry, "http": HTTP_TELEMETRY}
+    )
+    return Response(
+        content=content,
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@testbed_api.get("/logs")
+async def logs(
+    request: Request,
+    device: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    contains: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = LOGSTORE_QUERY_LIMIT_DEFAULT,
+):
+    """Query the event logs, by device, reception time range and content.
+
+    Pages are chained with the returned `next_cursor`.
+    """
+    controller: Controller = get_testbed(request).controller
+    if controller.logstore is None:
+        raise HTTPException(status_code=404, detail="log store disabled")
+    try:
+        response = await run_in_threadpool(
+            controller.logstore.query,
+            device=device,
+            start=start,
+            end=end,
+            contains=contains,
+            cursor=cursor,
+            limit=limit,
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
     return JSONResponse(content={"response": response})
 
 
+@testbed_api.get("/logs/stream")
+async def logs_stream(request: Request, devices: Optional[str] = None):
+    """Stream the event logs as server-sent events.
+
+    `devices` is a comma-separated list of device addresses and selectors
+    to filter on, the selectors are resolved when the stream opens. When
+    the client is too slow, the oldest logs are dropped and a `dropped`
+    event reports how many.
+    """
+    controller: Controller = get_testbed(request).controller
+    try:
+        selected = select_devices(
+            request, validate_devices(split_devices(devices or ""))
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc))
+
+    async def event_stream():
+        subscriber = controller.eventlog_stream.subscribe(selected)
+        try:
+            while True:
+                try:
+                    messages, dropped = await asyncio.wait_for(
+                        subscriber.get(), STREAM_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                events = [f"data: {message}\n\n" for message in messages]
+                if dropped:
+                    events.insert(0, f"event: dropped\ndata: {dropped}\n\n")
+                yield "".join(events)
+        finally:
+            controller.eventlog_stream.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 class SettingsResponse(BaseModel):
     network_id: int
     area_width: int
@@ -231,9 +714,9 @@ class SettingsResponse(BaseModel):
     calibration_distance: int  # mm; the -d value used by dotbot-calibration
 
 
-@api.get("/settings", response_model=SettingsResponse)
+@testbed_api.get("/settings", response_model=SettingsResponse)
 async def settings(request: Request):
-    controller: Controller = request.app.state.controller
+    controller: Controller = get_testbed(request).controller
     map_size = controller.settings.map_size
     width_str, height_str = map_size.lower().split('x')
     width, height = int(width_str), int(height_str)
@@ -250,32 +733,184 @@ async def settings(request: Request):
     )
 
 
-@api.post("/start")
+@asynccontextmanager
+async def device_lease(request: Request, devices: list[str] | None, owner):
+    """Hold the devices of an operation, 409 if they stay busy."""
+    leases: DeviceLeases = get_testbed(request).device_leases
+    try:
+        lease = await leases.acquire_async(devices or ALL_DEVICES, owner)
+    except LeaseConflict as exc:
+        raise HTTPException(
+            status_code=fastapi_status.HTTP_409_CONFLICT, detail=str(exc)
+        )
+    try:
+        yield lease
+    finally:
+        lease.release()
+
+
+@testbed_api.post("/start")
 async def start(
     request: Request, payload: DeviceList, _token_payload=Depends(verify_jwt)
 ):
-    controller: Controller = request.app.state.controller
-    async with controller_lock:
-        await run_in_threadpool(controller.start, devices=payload.devices)
+    controller: Controller = get_testbed(request).controller
+    devices = select_devices(request, payload.devices)
+    async with device_lease(request, devices, "start"):
+        await run_in_threadpool(controller.start, devices=devices)
 
     return JSONResponse(content={"response": "done"})
 
 
-@api.post("/stop", dependencies=[Depends(verify_jwt)])
+@testbed_api.post("/stop", dependencies=[Depends(verify_jwt)])
 async def stop(request: Request, payload: DeviceList):
-    controller: Controller = request.app.state.controller
-    async with controller_lock:
-        await run_in_threadpool(controller.stop, devices=payload.devices)
+    controller: Controller = get_testbed(request).controller
+    devices = select_devices(request, payload.devices)
+    async with device_lease(request, devices, "stop"):
+        await run_in_threadpool(controller.stop, devices=devices)
 
     return JSONResponse(content={"response": "done"})
 
 
+class ResetRequest(BaseModel):
+    locations: dict[str, ResetLocation]
+
+    @property
+    def devices(self) -> list[str]:
+        return list(self.locations)
+
+    def run(self, controller: Controller) -> dict:
+        return controller.reset(self.locations, devices=self.devices)
+
+
+class MessageRequest(DeviceList):
+    message: str
+
+    def run(self, controller: Controller) -> dict:
+        return controller.send_message(self.message, devices=self.devices)
+
+
+class CalibrationRequest(DeviceList):
+    calibration_b64: str  # LH2 calibration file, as sent by calibrate-lh2
+
+    @field_validator("calibration_b64")
+    def validate_calibration(cls, v):
+        parse_lh2_calibration(base64.b64decode(v, validate=True))
+        return v
+
+    def run(self, controller: Controller) -> dict:
+        return controller.send_lh2_calibration(
+            base64.b64decode(self.calibration_b64), devices=self.devices
+        )
+
+
+class StartOperation(DeviceList):
+    command: Literal["start"]
+
+    def run(self, controller: Controller) -> dict:
+        return {"devices": controller.start(devices=self.devices)}
+
+
+class StopOperation(DeviceList):
+    command: Literal["stop"]
+
+    def run(self, controller: Controller) -> dict:
+        return {"devices": controller.stop(devices=self.devices)}
+
+
+class ResetOperation(ResetRequest):
+    command: Literal["reset"]
+
+
+class MessageOperation(MessageRequest):
+    command: Literal["message"]
+
+
+class CalibrationOperation(CalibrationRequest):
+    command: Literal["calibrate"]
+
+
+class BatchRequest(BaseModel):
+    operations: List[
+        Annotated[
+            Union[
+                StartOperation,
+                StopOperation,
+                ResetOperation,
+                MessageOperation,
+                CalibrationOperation,
+            ],
+            Field(discriminator="command"),
+        ]
+    ]
+
+
+async def run_operations(
+    request: Request, operations: list, owner: str
+) -> list[dict]:
+    """Run operations in turn, holding all their devices meanwhile."""
+    controller: Controller = get_testbed(request).controller
+    for operation in operations:
+        if isinstance(operation, DeviceList):
+            operation.devices = select_devices(request, operation.devices)
+    devices = set()
+    for operation in operations:
+        if not operation.devices:
+            devices = ALL_DEVICES
+            break
+        devices.update(operation.devices)
+
+    def run():
+        return [operation.run(controller) for operation in operations]
+
+    async with device_lease(request, devices and sorted(devices), owner):
+        return await run_in_threadpool(run)
+
+
+@testbed_api.post("/reset", dependencies=[Depends(verify_jwt)])
+async def reset(request: Request, payload: ResetRequest):
+    """Reset the devices to the given locations."""
+    (report,) = await run_operations(request, [payload], "reset")
+    return JSONResponse(content={"response": report})
+
+
+@testbed_api.post("/message", dependencies=[Depends(verify_jwt)])
+async def message(request: Request, payload: MessageRequest):
+    """Send a message to the running devices."""
+    (report,) = await run_operations(request, [payload], "message")
+    return JSONResponse(content={"response": report})
+
+
+@testbed_api.post("/calibrate", dependencies=[Depends(verify_jwt)])
+async def calibrate(request: Request, payload: CalibrationRequest):
+    """Send the LH2 calibration to the ready devices."""
+    (report,) = await run_operations(request, [payload], "calibrate")
+    return JSONResponse(content={"response": report})
+
+
+@testbed_api.post("/batch", dependencies=[Depends(verify_jwt)])
+async def batch(request: Request, payload: BatchRequest):
+    """Run several operations in a single request, in order."""
+    reports = await run_operations(request, payload.operations, "batch")
+    return JSONResponse(
+        content={
+            "response": [
+                {"command": operation.command, **report}
+                for operation, report in zip(
+                    payload.operations, reports, strict=True
+                )
+            ]
+        }
+    )
+
+
 class IssueRequest(BaseModel):
     start: str  # ISO8601 string
 
 
 @api.post("/issue_jwt")
-def issue_token(req: IssueRequest, db: Session = Depends(get_db)):
+def issue_token(
+    req: IssueRequest, request: Request, db: Session = Depends(get_db)
+):
     try:
         start = datetime.datetime.fromisoformat(
             req.start.replace("Z", "+00:00")
@@ -299,7 +934,9 @@ def issue_token(req: IssueRequest, db: Session = Depends(get_db)):
             status_code=fastapi_status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="private.pem not found; private key unavailable",
         )
-    token = jwt.encode(payload, private_key, algorithm=ALGORITHM)
+    token = jwt.encode(
+        payload, load_private_key(private_key), algorithm=ALGORITHM
+    )
 
     db_record = JWTRecord(jwt=token, date_start=start, date_end=end)
     db.add(db_record)
@@ -309,6 +946,7 @@ def issue_token(req: IssueRequest, db: Session = Depends(get_db)):
     except IntegrityError:
         db.rollback()
         raise HTTPException(status_code=400, detail="Timeslot already full")
+    request.app.state.records_cache.invalidate()
 
     return {"data": token}
 
@@ -336,21 +974,78 @@ class JWTRecordOut(BaseModel):
     }
 
 
+class RecordsCache:
+    """Serialized /records body, dropped on insert and after `ttl`.
+
+    The time window of /records moves, so the body expires even when no
+    reservation is added.
+    """
+
+    def __init__(self, ttl: float = RECORDS_CACHE_TTL):
+        self.ttl = ttl
+        self._body: bytes = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, compute) -> bytes:
+        with self._lock:
+            if self._body is None or time.monotonic() >= self._expires_at:
+                self._body = compute()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._body
+
+    def invalidate(self):
+        with self._lock:
+            self._body = None
+
+
 @api.get("/records", response_model=list[JWTRecordOut])
-def list_records(db: Session = Depends(get_db)):
-    now = datetime.datetime.now(datetime.timezone.utc)
-    yesterday = now - datetime.timedelta(days=1)
-    one_month_later = now + datetime.timedelta(days=30)
-    records = (
-        db.query(JWTRecord)
-        .filter(
-            JWTRecord.date_start >= yesterday,
-            JWTRecord.date_start <= one_month_later,
+def list_records(request: Request, db: Session = Depends(get_db)):
+    def compute() -> bytes:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        yesterday = now - datetime.timedelta(days=1)
+        one_month_later = now + datetime.timedelta(days=30)
+        records = (
+            db.query(JWTRecord)
+            .filter(
+                JWTRecord.date_start >= yesterday,
+                JWTRecord.date_start <= one_month_later,
+            )
+            .order_by(asc(JWTRecord.date_start))
+            .all()
+        )
+        return json_dumps(
+            [
+                JWTRecordOut.model_validate(record).model_dump(mode="json")
+                for record in records
+            ]
         )
-        .order_by(asc(JWTRecord.date_start))
-        .all()
+
+    body = request.app.state.records_cache.get(compute)
+    return Response(content=body, media_type="application/json")
+
+
+@api.get("/networks")
+async def networks(request: Request):
+    """List the networks of the testbeds, their routes are under
+    /networks/{network_id}."""
+    testbeds: dict[str, Testbed] = request.app.state.testbeds
+    return JSONResponse(
+        content={
+            "response": [
+                {
+                    "network_id": key,
+                    "devices": len(testbed.controller.status_data),
+                }
+                for key, testbed in testbeds.items()
+            ]
+        }
     )
-    return records
+
+
+# The routes of the first testbed are also served without prefix
+api.include_router(testbed_api)
+api.include_router(testbed_api, prefix="/networks/{network_id}")
 
 
 # Mount static files after all routes are defined
@@ -361,7 +1056,11 @@ def mount_frontend(api):
     if os.path.isdir(dashboard_dir):
         api.mount(
             "/",
-            StaticFiles(directory=dashboard_dir, html=True),
+            PrecompressedStaticFiles(
+                directory=dashboard_dir,
+                html=True,
+                cache_directory=f"{DATA_DIR}/static",
+            ),
             name="dashboard",
         )
     else:
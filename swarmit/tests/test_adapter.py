@@ -1,12 +1,40 @@
+import time
 from unittest.mock import patch
 
+import pytest
 from dotbot_utils.protocol import Packet
 from marilib.mari_protocol import Frame as MariFrame
 from marilib.mari_protocol import Header as MariHeader
-from marilib.model import EdgeEvent
+from marilib.mari_protocol import MetricsProbePayload
+from marilib.model import EdgeEvent, GatewayInfo, MariGateway
 
-from swarmit.testbed.adapter import MarilibCloudAdapter, MarilibEdgeAdapter
-from swarmit.testbed.protocol import PayloadStatus
+from swarmit.testbed.adapter import (
+    GatewayAdapterBase,
+    MarilibCloudAdapter,
+    MarilibEdgeAdapter,
+    MultiGatewayAdapter,
+)
+from swarmit.testbed.protocol import (
+    PayloadStart,
+    PayloadStatus,
+    PayloadType,
+)
+
+
+class FakeAdapter(GatewayAdapterBase):
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def init(self, on_frame_received: callable):
+        self.on_frame_received = on_frame_received
+
+    def close(self):
+        self.closed = True
+
+    def send_payload(self, destination, payload):
+        self.sent.append(destination)
 
 
 @patch("swarmit.testbed.adapter.MarilibSerialAdapter")
@@ -54,6 +82,11 @@ def test_marilib_edge_adapter(send_frame_mock, _, capsys):
     send_frame_mock.assert_called_once_with(
         dst=mari_frame.header.destination, payload=packet.to_bytes()
     )
+    counters = adapter.telemetry.snapshot()["counters"]
+    assert counters["frames_received"] == {"SWARMIT_STATUS": 2}
+    assert counters["frames_dropped"] == {"": 1}
+    assert counters["parse_errors"] == {"": 1}
+    assert counters["frames_sent"] == {"SWARMIT_STATUS": 1}
     adapter.close()
 
 
@@ -70,6 +103,64 @@ def test_marilib_edge_adapter_init_failed(serial_adapter_mock, capsys):
     assert "Error initializing MarilibEdge" in out
 
 
+@patch("swarmit.testbed.adapter.MarilibSerialAdapter")
+def test_marilib_edge_adapter_probes(_):
+    adapter = MarilibEdgeAdapter(port="p", baudrate=1, probe_period=0.05)
+    packets = []
+    adapter.init(lambda header, packet: packets.append((header, packet)))
+    node = adapter.mari.add_node(0x01)
+
+    def receive(payload):
+        frame = MariFrame(header=MariHeader(source=0x01), payload=payload)
+        adapter.mari.on_serial_data_received(
+            EdgeEvent.to_bytes(EdgeEvent.NODE_DATA) + frame.to_bytes()
+        )
+
+    status = Packet().from_payload(PayloadStatus(device=1, status=2))
+    receive(status.to_bytes())
+    assert [packet for _, packet in packets] == [status]
+
+    # marilib does not notify the probes, they are read from its statistics
+    adapter.mari.metrics_tester._register_pending_probe(node, 42, 42)
+    receive(
+        MetricsProbePayload(
+            edge_tx_ts_us=42,
+            gw_tx_count=10,
+            node_rx_count=9,
+            node_tx_count=10,
+            gw_rx_count=8,
+            rssi_at_gw=255 - 70,
+        ).to_bytes()
+    )
+    assert len(packets) == 1
+    deadline = time.monotonic() + 1
+    while len(packets) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    header, packet = packets[1]
+    assert header.source == 0x01
+    assert packet.payload_type == PayloadType.METRICS_PROBE
+    assert packet.payload.gw_tx_count == 10
+    assert packet.payload.gw_rx_count == 8
+    assert packet.payload.rssi_at_gw_dbm() == -70
+    links = adapter.telemetry.snapshot()["links"]
+    assert links["00000001"]["rssi_gw_dbm"] == -70
+
+    # a probe is notified once
+    time.sleep(0.1)
+    assert len(packets) == 2
+    adapter.mari.metrics_tester.stop()
+    adapter.close()
+
+
+def test_metrics_probe_parsing():
+    probe = MetricsProbePayload(gw_tx_count=10, node_rx_count=9)
+    packet = Packet.from_bytes(probe.to_bytes())
+    assert packet.payload_type == PayloadType.METRICS_PROBE
+    assert packet.payload.gw_tx_count == 10
+    assert packet.payload.node_rx_count == 9
+    assert packet.to_bytes() == probe.to_bytes()
+
+
 @patch("swarmit.testbed.adapter.MarilibMQTTAdapter")
 @patch("swarmit.testbed.adapter.MarilibCloud.send_frame")
 def test_marilib_cloud_adapter(send_frame_mock, _, capsys):
@@ -140,3 +231,85 @@ def test_marilib_cloud_adapter_init_failed(mqtt_adapter_mock, capsys):
     exit_mock.assert_called_with(1)
     out, _ = capsys.readouterr()
     assert "Error initializing MarilibCloud" in out
+
+
+def test_multi_gateway_adapter():
+    gateways = [FakeAdapter(), FakeAdapter()]
+    for index, gateway in enumerate(gateways):
+        gateway.telemetry.gauge("nodes_queue_depth", lambda index=index: index)
+        gateway.telemetry.count("parse_errors", value=index + 1)
+    adapter = MultiGatewayAdapter(gateways)
+    packets = []
+    adapter.init(lambda header, packet: packets.append((header, packet)))
+
+    packet = Packet().from_payload(PayloadStatus(device=1, status=2))
+    gateways[0].on_frame_received(MariHeader(source=0x01), packet)
+    gateways[1].on_frame_received(MariHeader(source=0x02), packet)
+    assert [header.source for header, _ in packets] == [0x01, 0x02]
+    assert adapter.routes == {0x01: 0, 0x02: 1}
+
+    # unicast is routed to the gateway the node was last heard on
+    adapter.send_payload(0x02, PayloadStart())
+    assert gateways[0].sent == []
+    assert gateways[1].sent == [0x02]
+
+    # broadcast and unknown nodes go through all gateways
+    adapter.send_payload(0xFFFFFFFFFFFFFFFF, PayloadStart())
+    adapter.send_payload(0x03, PayloadStart())
+    assert gateways[0].sent == [0xFFFFFFFFFFFFFFFF, 0x03]
+    assert gateways[1].sent == [0x02, 0xFFFFFFFFFFFFFFFF, 0x03]
+
+    # a node moving to another gateway is routed there
+    gateways[0].on_frame_received(MariHeader(source=0x02), packet)
+    assert adapter.partition([0x01, 0x02, 0x03]) == [[0x01, 0x02], [0x03]]
+
+    snapshot = adapter.telemetry.snapshot()
+    assert snapshot["gauges"]["routes"] == 2
+    assert snapshot["gauges"]["gateway_sends_queued"] == {"0": 0, "1": 0}
+    # the counters of the gateways are merged, their gauges labeled
+    assert snapshot["gauges"]["nodes_queue_depth"] == {"0": 0, "1": 1}
+    assert snapshot["counters"]["parse_errors"] == {"": 3}
+    assert snapshot["counters"]["gateway_frames_received"] == {
+        "0": 2,
+        "1": 1,
+    }
+    adapter.close()
+    assert all(gateway.closed for gateway in gateways)
+
+
+def test_multi_gateway_adapter_no_adapter():
+    with pytest.raises(ValueError):
+        MultiGatewayAdapter([])
+
+
+@patch("swarmit.testbed.adapter.MarilibSerialAdapter")
+def test_marilib_edge_adapter_ready(_):
+    adapter = MarilibEdgeAdapter(port="p", baudrate=1, busy_wait_timeout=1)
+    adapter.init(lambda header, packet: None)
+
+    # no gateway info received: readiness is bounded by the timeout
+    start = time.monotonic()
+    assert adapter.wait_ready(0.1) is False
+    assert time.monotonic() - start < 0.5
+    # the timeout is not consumed by previous waits
+    start = time.monotonic()
+    assert adapter.wait_ready(0.1) is False
+    assert time.monotonic() - start >= 0.1
+
+    adapter.mari.gateway.set_info(GatewayInfo(address=0x42))
+    adapter.mari.add_node(0x01)
+    assert adapter.wait_ready(1) is True
+    assert adapter.ready.is_set()
+    assert adapter.node_addresses() == [0x01]
+
+
+@patch("swarmit.testbed.adapter.MarilibMQTTAdapter")
+def test_marilib_cloud_adapter_ready(_):
+    adapter = MarilibCloudAdapter(
+        host="localhost", port=1883, use_tls=False, network_id=2
+    )
+    adapter.init(lambda header, packet: None)
+    assert adapter.wait_ready(0.1) is False
+    adapter.mari.gateways = {0x42: MariGateway(info=GatewayInfo(address=0x42))}
+    assert adapter.wait_ready(1) is True
+    assert adapter.node_addresses() == []
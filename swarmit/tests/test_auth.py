@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import os
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+)
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from swarmit.testbed import webserver
+from swarmit.testbed.auth import (
+    KeyFiles,
+    TokenCache,
+    load_private_key,
+    load_public_key,
+)
+
+
+def _write_keys(directory):
+    private_key = Ed25519PrivateKey.generate()
+    (directory / "private.pem").write_bytes(
+        private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    (directory / "public.pem").write_bytes(
+        private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+    )
+    return private_key
+
+
+def test_key_files_reload_on_change(tmp_path):
+    path = tmp_path / "public.pem"
+    path.write_text("first")
+    keys = KeyFiles(check_period=0)
+    assert keys.read(path) == "first"
+    path.write_text("second key")
+    os.utime(path, ns=(0, 0))
+    assert keys.read(path) == "second key"
+    path.unlink()
+    with pytest.raises(FileNotFoundError):
+        keys.read(path)
+
+    path.write_text("first")
+    keys = KeyFiles(check_period=60)
+    assert keys.read(path) == "first"
+    path.write_text("second key")
+    assert keys.read(path) == "first"
+
+
+def test_load_keys(tmp_path):
+    _write_keys(tmp_path)
+    pem = (tmp_path / "public.pem").read_text()
+    assert load_public_key(pem) is load_public_key(pem)
+    assert not isinstance(load_public_key(pem), str)
+    assert not isinstance(
+        load_private_key((tmp_path / "private.pem").read_text()), str
+    )
+    assert load_public_key("PUBLIC_KEY") == "PUBLIC_KEY"
+
+
+def test_token_cache():
+    cache = TokenCache(size=2)
+    key = object()
+    cache.put("a", key, {"sub": "a"})
+    cache.put("b", key, {"sub": "b"})
+    assert cache.get("a", key) == {"sub": "a"}
+    cache.put("c", key, {"sub": "c"})
+    # "b" was the least recently used
+    assert cache.get("b", key) is None
+    assert len(cache) == 2
+    assert cache.get("a", object()) is None
+    assert len(cache) == 1
+
+
+def test_verify_jwt_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(webserver, "DATA_DIR", f"{tmp_path}")
+    private_key = _write_keys(tmp_path)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    token = jwt.encode(
+        {
+            "nbf": now - datetime.timedelta(minutes=1),
+            "exp": now + datetime.timedelta(minutes=1),
+        },
+        private_key,
+        algorithm="EdDSA",
+    )
+    request = SimpleNamespace(
+        app=SimpleNamespace(state=SimpleNamespace(token_cache=TokenCache()))
+    )
+    credentials = HTTPAuthorizationCredentials(
+        scheme="Bearer", credentials=token
+    )
+    payload = asyncio.run(webserver.verify_jwt(request, credentials))
+    assert len(request.app.state.token_cache) == 1
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("the token should not be decoded again")
+
+    monkeypatch.setattr(jwt, "decode", no_decode)
+    assert asyncio.run(webserver.verify_jwt(request, credentials)) is payload
+
+    # expiry is enforced on cached tokens
+    monkeypatch.setattr(
+        "swarmit.testbed.webserver.time.time", lambda: payload["exp"]
+    )
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(webserver.verify_jwt(request, credentials))
+    assert exc.value.status_code == 401
+    assert exc.value.detail == "Token expired"
+    assert len(request.app.state.token_cache) == 0
@@ -0,0 +1,131 @@
+import time
+from unittest.mock import patch
+
+import pytest
+from dotbot_utils.protocol import Packet
+from marilib.mari_protocol import Frame as MariFrame
+from marilib.mari_protocol import Header as MariHeader
+from marilib.model import EdgeEvent
+
+from swarmit.testbed.adapter import MarilibEdgeAdapter, ReplayAdapter
+from swarmit.testbed.capture import (
+    CAPTURE_INBOUND,
+    CAPTURE_OUTBOUND,
+    CaptureWriter,
+    read_capture,
+)
+from swarmit.testbed.controller import Controller, ControllerSettings
+from swarmit.testbed.protocol import PayloadStart, PayloadStatus, StatusType
+
+
+def _status_bytes(status=StatusType.Bootloader):
+    return Packet.from_payload(
+        PayloadStatus(device=1, status=status.value, battery=2500)
+    ).to_bytes()
+
+
+def test_capture_round_trip(tmp_path):
+    path = tmp_path / "capture.bin"
+    capture = CaptureWriter(path)
+    capture.write_inbound(0x01, 0, b"\x01\x02")
+    capture.write_outbound(0, 0x01, b"\x03")
+    capture.close()
+
+    # Captures are append-only
+    capture = CaptureWriter(path)
+    capture.write_inbound(0x02, 0, b"")
+    capture.close()
+
+    records = list(read_capture(path))
+    assert [
+        (r.direction, r.source, r.destination, r.payload) for r in records
+    ] == [
+        (CAPTURE_INBOUND, 0x01, 0, b"\x01\x02"),
+        (CAPTURE_OUTBOUND, 0, 0x01, b"\x03"),
+        (CAPTURE_INBOUND, 0x02, 0, b""),
+    ]
+    assert records[0].timestamp <= records[1].timestamp
+
+    # A truncated last record is ignored
+    with open(path, "ab") as f:
+        f.write(b"\x00\x01")
+    assert len(list(read_capture(path))) == 3
+
+
+def test_capture_invalid_file(tmp_path):
+    path = tmp_path / "capture.bin"
+    path.write_bytes(b"invalid")
+    with pytest.raises(ValueError):
+        list(read_capture(path))
+    with pytest.raises(ValueError):
+        ReplayAdapter(tmp_path / "missing.bin")
+
+
+@patch("swarmit.testbed.adapter.MarilibSerialAdapter")
+@patch("swarmit.testbed.adapter.MarilibEdge.send_frame")
+def test_marilib_edge_adapter_capture(_, __, tmp_path):
+    capture = CaptureWriter(tmp_path / "capture.bin")
+    adapter = MarilibEdgeAdapter(port="p", baudrate=1, capture=capture)
+    adapter.init(lambda header, packet: None)
+    adapter.on_event(
+        EdgeEvent.NODE_DATA,
+        MariFrame(
+            header=MariHeader(source=0x01, destination=0),
+            payload=_status_bytes(),
+        ),
+    )
+    adapter.send_payload(0x01, PayloadStart())
+    capture.close()
+
+    records = list(read_capture(tmp_path / "capture.bin"))
+    assert records[0].direction == CAPTURE_INBOUND
+    assert records[0].source == 0x01
+    assert records[0].payload == _status_bytes()
+    assert records[1].direction == CAPTURE_OUTBOUND
+    assert records[1].destination == 0x01
+    assert records[1].payload == Packet.from_payload(PayloadStart()).to_bytes()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
+def test_controller_replay(tmp_path):
+    path = tmp_path / "capture.bin"
+    capture = CaptureWriter(path)
+    for address in range(1, 11):
+        capture.write_inbound(address, 0, _status_bytes())
+    capture.write_inbound(0x01, 0, b"`\x01invalid")
+    capture.write_outbound(0, 0x01, b"\x81")
+    capture.write_inbound(0x01, 0, _status_bytes(StatusType.Running))
+    capture.close()
+
+    controller = Controller(
+        ControllerSettings(
+            adapter="replay", capture_path=str(path), replay_speed=0
+        )
+    )
+    assert controller.interface.done.wait(1)
+    assert controller.interface.frames_replayed == 11
+    assert len(controller.known_devices) == 10
+    assert controller.running_devices == ["00000001"]
+    controller.start(devices=["00000002"], timeout=0.1)
+    assert controller.interface.frames_sent > 0
+    controller.terminate()
+
+
+def test_replay_speed(tmp_path):
+    path = tmp_path / "capture.bin"
+    with patch("swarmit.testbed.capture.time.time") as time_mock:
+        capture = CaptureWriter(path)
+        time_mock.return_value = 100
+        capture.write_inbound(0x01, 0, _status_bytes())
+        time_mock.return_value = 101
+        capture.write_inbound(0x01, 0, _status_bytes())
+        capture.close()
+
+    adapter = ReplayAdapter(path, speed=10)
+    frames = []
+    start = time.monotonic()
+    adapter.init(lambda header, packet: frames.append(packet))
+    assert adapter.done.wait(1)
+    assert 0.09 < time.monotonic() - start < 0.5
+    assert len(frames) == 2
+    adapter.close()
@@ -7,6 +7,7 @@ from click.testing import CliRunner
 from swarmit.cli.main import main
 from swarmit.testbed.controller import (
     ControllerSettings,
+    OtaPlan,
     StartOtaData,
     TransferDataStatus,
 )
@@ -14,21 +15,38 @@ from swarmit.testbed.controller import (
 CLI_HELP_EXPECTED = """Usage: main [OPTIONS] COMMAND [ARGS]...
 
 Options:
-  -c, --config-path FILE      Path to a .toml configuration file.
-  -p, --port TEXT             Serial port to use to send the bitstream to the
-                              gateway. Default: /dev/ttyACM0.
-  -b, --baudrate INTEGER      Serial port baudrate. Default: 1000000.
-  -H, --mqtt-host TEXT        MQTT host. Default: localhost.
-  -P, --mqtt-port INTEGER     MQTT port. Default: 1883.
-  -T, --mqtt-use_tls          Use TLS with MQTT.
-  -n, --network-id TEXT       Marilib network ID to use. Default: 0x1200
-  -a, --adapter [edge|cloud]  Choose the adapter to communicate with the
-                              gateway. Default: edge
-  -d, --devices TEXT          Subset list of device addresses to interact with,
-                              separated with ,
-  -v, --verbose               Enable verbose mode.
-  -V, --version               Show the version and exit.
-  -h, --help                  Show this message and exit.
+  -c, --config-path FILE          Path to a .toml configuration file.
+  -p, --port TEXT                 Serial port to use to send the bitstream to
+                                  the gateway, several ports separated with ,
+                                  shard the swarm across several gateways.
+                                  Default: /dev/ttyACM0.
+  -b, --baudrate INTEGER          Serial port baudrate. Default: 1000000.
+  -H, --mqtt-host TEXT            MQTT host. Default: localhost.
+  -P, --mqtt-port INTEGER         MQTT port. Default: 1883.
+  -T, --mqtt-use_tls              Use TLS with MQTT.
+  -n, --network-id TEXT           Marilib network ID to use, several IDs
+                                  separated with , shard the swarm across
+                                  several networks. Default: 0x1200
+  -a, --adapter [edge|cloud|sim|replay]
+                                  Choose the adapter to communicate with the
+                                  gateway. Default: edge
+  --capture-path FILE             Capture file: frames are appended to it with
+                                  the edge and cloud adapters, and read from it
+                                  with the replay adapter.
+  --replay-speed TEXT             Replay speed factor, or 'max' to replay as
+                                  fast as possible. Default: 1.
+  --eventlog-path DIRECTORY       Directory where the event logs of the devices
+                                  are written, as rotating compressed files.
+  --logstore-path FILE            SQLite file where the event logs of the
+                                  devices are indexed by device and time.
+  -d, --devices TEXT              Subset list of device addresses to interact
+                                  with, separated with ,. Selectors, such as
+                                  "type=DotBotV3 & battery>2.5V" or
+                                  "rect(x0,y0,x1,y1)", select the devices
+                                  matching them.
+  -v, --verbose                   Enable verbose mode.
+  -V, --version                   Show the version and exit.
+  -h, --help                      Show this message and exit.
 
 Commands:
   calibrate-lh2  Send LH2 calibration data to the robots.
@@ -37,6 +55,7 @@ Commands:
   monitor        Monitor running applications.
   reset          Reset robots locations.
   start          Start the user application.
+  stats          Print radio frame rates, errors and latencies.
   status         Print current status of the robots.
   stop           Stop the user application.
 """
@@ -203,6 +222,7 @@ def test_flash_no_device_ready(controller_mock, fw):
 def test_flash_user_abort(controller_mock, fw):
     runner = CliRunner()
     controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(waves=[["1"]], broadcast=True)
     result = runner.invoke(main, ["flash", str(fw)], input="n\n")
     assert "Do you want to continue?" in result.output
     assert "Abort" in result.output
@@ -215,6 +235,7 @@ def test_flash_user_abort(controller_mock, fw):
 def test_flash_missing_ota_ack(controller_mock, fw):
     runner = CliRunner()
     controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(waves=[["1"]], broadcast=True)
     result = runner.invoke(main, ["flash", str(fw)], input="y\n")
     assert "acknowledgments are missing" in result.output
     assert result.exit_code == 1
@@ -228,6 +249,7 @@ def test_flash_missing_ota_ack(controller_mock, fw):
 def test_flash_transfer_failed(controller_mock, fw):
     runner = CliRunner()
     controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(waves=[["1"]], broadcast=True)
     controller.start_ota.return_value = {
         "missed": [],
         "acked": ["1"],
@@ -250,6 +272,7 @@ def test_flash_transfer_failed(controller_mock, fw):
 def test_flash_transfer_success_no_start(controller_mock, fw):
     runner = CliRunner()
     controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(waves=[["1"]], broadcast=True)
     controller.start_ota.return_value = {
         "missed": [],
         "acked": ["1"],
@@ -272,6 +295,7 @@ def test_flash_transfer_success_no_start(controller_mock, fw):
 def test_flash_transfer_success_with_start(controller_mock, fw):
     runner = CliRunner()
     controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(waves=[["1"]], broadcast=True)
     controller.start_ota.return_value = {
         "missed": [],
         "acked": ["1"],
@@ -291,6 +315,40 @@ def test_flash_transfer_success_with_start(controller_mock, fw):
     controller.start.assert_called_once()
 
 
+@patch("swarmit.cli.main.Controller")
+def test_flash_waves(controller_mock, fw):
+    runner = CliRunner()
+    controller = controller_mock()
+    controller.plan_ota.return_value = OtaPlan(
+        waves=[["1", "2"], ["3"]],
+        skipped={"4": "battery 1200mV below 1500mV"},
+        marginal=["3"],
+    )
+    controller.start_ota.side_effect = lambda fw, devices: {
+        "missed": [],
+        "acked": devices,
+        "ota": StartOtaData(),
+    }
+    controller.transfer.side_effect = lambda fw, devices: {
+        addr: TransferDataStatus(success=True) for addr in devices
+    }
+    result = runner.invoke(
+        main, ["flash", str(fw), "-m", "2000", "-w", "2"], input="y\n"
+    )
+    assert result.exit_code == 0
+    assert "Devices skipped (1)" in result.output
+    assert "battery 1200mV below 1500mV" in result.output
+    assert "Wave 2/2 (1 devices)" in result.output
+    assert "Devices with a marginal link (1)" in result.output
+    assert controller_mock.call_args.args[0].ota_min_battery == 2000
+    assert controller_mock.call_args.args[0].ota_wave_size == 2
+    assert [c.args[1] for c in controller.start_ota.call_args_list] == [
+        ["1", "2"],
+        ["3"],
+    ]
+    assert controller.transfer.call_count == 2
+
+
 @patch("swarmit.cli.main.Controller")
 def test_monitor(controller_mock):
     runner = CliRunner()
@@ -353,6 +411,40 @@ def test_status_with_config(controller_mock, tmp_path):
     controller.terminate.assert_called_once()
 
 
+@patch("swarmit.cli.main.Controller")
+def test_eventlog_settings_from_config(controller_mock, tmp_path):
+    cfg_path = tmp_path / "cfg.toml"
+    cfg_path.write_text(
+        "eventlog_console_sample = 0\neventlog_device_rate = 5\n"
+    )
+    runner = CliRunner()
+    result = runner.invoke(main, ["-c", str(cfg_path), "status"])
+    assert result.exit_code == 0
+    settings = controller_mock.call_args.args[0]
+    assert settings.eventlog_console_sample == 0
+    assert settings.eventlog_device_rate == 5
+    assert settings.eventlog_global_rate == 5000
+
+
+@patch("swarmit.cli.main.Controller")
+def test_devices_regions(controller_mock):
+    runner = CliRunner()
+    result = runner.invoke(
+        main, ["-d", "00000001,rect(0,0,500,500),nearest(0,0,3)", "status"]
+    )
+    assert result.exit_code == 0
+    settings = controller_mock.call_args.args[0]
+    assert settings.devices == [
+        "00000001",
+        "rect(0,0,500,500)",
+        "nearest(0,0,3)",
+    ]
+
+    result = runner.invoke(main, ["-d", "radius(0,0)", "status"])
+    assert result.exit_code == 2
+    assert "expected radius(x,y,r)" in result.output
+
+
 @patch("swarmit.cli.main.Controller")
 def test_message(controller_mock):
     runner = CliRunner()
@@ -362,3 +454,22 @@ def test_message(controller_mock):
     assert result.exit_code == 0
     controller.send_message.assert_called_with(msg)
     controller.terminate.assert_called_once()
+
+
+@patch("swarmit.cli.main.Controller")
+def test_stats(controller_mock):
+    runner = CliRunner()
+    controller = controller_mock()
+    controller.telemetry_snapshot.return_value = {
+        "adapter": {
+            "counters": {"frames_received": {"SWARMIT_STATUS": 42}},
+            "gauges": {},
+            "histograms": {},
+            "links": {},
+        }
+    }
+    result = runner.invoke(main, ["stats", "-t", "0"])
+    assert result.exit_code == 0
+    assert "SWARMIT_STATUS" in result.output
+    assert "42" in result.output
+    controller.terminate.assert_called_once()
@@ -0,0 +1,134 @@
+import gzip
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from swarmit.testbed.compression import (
+    IMMUTABLE_CACHE_CONTROL,
+    REVALIDATE_CACHE_CONTROL,
+    CompressionMiddleware,
+    PrecompressedStaticFiles,
+    accepted_encodings,
+)
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("") == []
+    assert accepted_encodings("gzip, deflate") == ["gzip"]
+    assert accepted_encodings("deflate, GZIP;q=0.5") == ["gzip"]
+    assert accepted_encodings("gzip;q=0") == []
+
+
+def test_compression_middleware():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    async def large():
+        return JSONResponse(content={"devices": ["00000001"] * 100})
+
+    @app.get("/small")
+    async def small():
+        return JSONResponse(content={"devices": []})
+
+    client = TestClient(app)
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert int(response.headers["content-length"]) < 100
+    assert response.json() == {"devices": ["00000001"] * 100}
+
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    response = client.get("/large", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+
+
+def test_compression_middleware_brotli():
+    pytest.importorskip("brotli")
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/large")
+    async def large():
+        return JSONResponse(content={"devices": ["00000001"] * 100})
+
+    @app.get("/stream")
+    async def stream():
+        async def events():
+            for _ in range(10):
+                yield "data: " + "x" * 100 + "\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    client = TestClient(app)
+    response = client.get("/large", headers={"Accept-Encoding": "br"})
+    assert response.headers["content-encoding"] == "br"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert int(response.headers["content-length"]) < 100
+    assert response.json() == {"devices": ["00000001"] * 100}
+
+    response = client.get("/stream", headers={"Accept-Encoding": "br"})
+    assert "content-encoding" not in response.headers
+
+
+def test_precompressed_static_files(tmp_path):
+    build = tmp_path / "build"
+    (build / "assets").mkdir(parents=True)
+    (build / "index.html").write_text("<html>" + "x" * 2000 + "</html>")
+    bundle = "console.log('dashboard');" * 100
+    (build / "assets" / "index-Bx3fQ9a1.js").write_text(bundle)
+    (build / "assets" / "logo-Cq81mZp0.png").write_bytes(b"\x89PNG")
+    cache = tmp_path / "cache"
+    app = FastAPI()
+    app.mount(
+        "/",
+        PrecompressedStaticFiles(
+            directory=build, html=True, cache_directory=str(cache)
+        ),
+    )
+    client = TestClient(app)
+
+    response = client.get(
+        "/assets/index-Bx3fQ9a1.js", headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-type"].startswith("text/javascript")
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.text == bundle
+    cached = cache / "assets" / "index-Bx3fQ9a1.js.gz"
+    assert gzip.decompress(cached.read_bytes()).decode() == bundle
+
+    # the variant compressed on first request is served from the cache
+    mtime = os.stat(cached).st_mtime_ns
+    response = client.get(
+        "/assets/index-Bx3fQ9a1.js",
+        headers={
+            "Accept-Encoding": "gzip",
+            "If-None-Match": response.headers["etag"],
+        },
+    )
+    assert response.status_code == 304
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+    assert os.stat(cached).st_mtime_ns == mtime
+
+    # a variant written at build time is used as is
+    (build / "index.html.gz").write_bytes(gzip.compress(b"<html>built"))
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.text == "<html>built"
+    assert response.headers["cache-control"] == REVALIDATE_CACHE_CONTROL
+
+    response = client.get(
+        "/assets/index-Bx3fQ9a1.js", headers={"Accept-Encoding": "identity"}
+    )
+    assert "content-encoding" not in response.headers
+    assert response.text == bundle
+    response = client.get(
+        "/assets/logo-Cq81mZp0.png", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "content-encoding" not in response.headers
+    assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
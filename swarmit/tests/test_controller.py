@@ -11,6 +11,7 @@ from swarmit.testbed.controller import (
     ControllerSettings,
     ResetLocation,
 )
+from swarmit.testbed.eventlog import read_eventlog
 from swarmit.testbed.logger import setup_logging
 from swarmit.testbed.protocol import StatusType
 from swarmit.tests.utils import (
@@ -115,6 +116,11 @@ def test_controller_start_unicast():
     assert nodes[0].status == StatusType.Running
     assert nodes[1].status == StatusType.Bootloader
     assert nodes[2].status == StatusType.Running
+    histograms = controller.telemetry.snapshot()["histograms"]
+    assert histograms["command_confirm_latency start"]["count"] == 1
+    gauges = controller.telemetry.snapshot()["gauges"]
+    assert gauges["devices_by_status"]["Running"] == 2
+    assert gauges["devices_battery"]["ok"] == 3
 
 
 @patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
@@ -386,6 +392,67 @@ def test_controller_monitor_single_device(caplog):
     controller.terminate()
 
 
+@patch(
+    "swarmit.testbed.adapter.MarilibSerialAdapter", MarilibSerialAdapterMock
+)
+def test_controller_monitor_eventlog_file(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    setup_logging()
+    controller = Controller(
+        ControllerSettings(
+            eventlog_path=str(tmp_path),
+            eventlog_console_sample=0,
+            adapter_wait_timeout=0.1,
+        )
+    )
+    test_adapter = controller.interface.mari.serial_interface
+    node = SwarmitNode(address=0x01, adapter=test_adapter)
+    test_adapter.add_node(node)
+    node.start_log_event_task()
+    controller.monitor(run_forever=False, timeout=0.1)
+    controller.terminate()
+
+    assert "LOG event" not in caplog.text
+    records = [
+        record
+        for path in sorted(tmp_path.iterdir())
+        for record in read_eventlog(path)
+    ]
+    assert records
+    assert records[0]["device"] == "00000001"
+    assert records[0]["data"] == "Node 00000001 log event"
+
+
+@patch(
+    "swarmit.testbed.adapter.MarilibSerialAdapter", MarilibSerialAdapterMock
+)
+def test_controller_eventlog_rate_limit():
+    controller = Controller(
+        ControllerSettings(
+            eventlog_device_rate=10,
+            eventlog_device_burst=5,
+            eventlog_console_sample=0,
+            adapter_wait_timeout=0.1,
+        )
+    )
+    test_adapter = controller.interface.mari.serial_interface
+    node = SwarmitNode(address=0x01, adapter=test_adapter)
+    test_adapter.add_node(node)
+    # misbehaving firmware logging in a tight loop
+    node.log_event_task.event_interval = 0.001
+    node.start_log_event_task()
+    time.sleep(0.5)
+    node.status = StatusType.Running
+    time.sleep(0.3)
+    assert controller.status_data["00000001"].status == StatusType.Running
+    counters = controller.telemetry.snapshot()["counters"]
+    assert counters["eventlog_rate_limited"]["device"] > 0
+    snapshot = controller.telemetry_snapshot()["controller"]
+    assert snapshot["eventlog_top_limited"]["00000001"] > 0
+    assert counters["eventlog_records"][""] < 20
+    controller.terminate()
+
+
 @patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
 @patch(
     "swarmit.testbed.adapter.MarilibSerialAdapter", MarilibSerialAdapterMock
@@ -581,6 +648,11 @@ def test_controller_ota_broadcast():
     result = controller.transfer(firmware, ota_data["acked"])
     time.sleep(0.3)
     assert all([transfer.success for transfer in result.values()]) is True
+    # one send to ACK latency sample per device and chunk
+    histograms = controller.telemetry.snapshot()["histograms"]
+    assert histograms["ota_chunk_ack_latency"]["count"] == 2 * len(
+        controller.chunks
+    )
 
 
 @patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
@@ -615,6 +687,54 @@ def test_controller_ota_broadcast_verbose(capsys):
     assert "Transfer completed" in capsys.readouterr().out
 
 
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
+@patch("swarmit.testbed.controller.COMMAND_ATTEMPT_DELAY", 0.1)
+@patch("swarmit.testbed.controller.OTA_ACK_TIMEOUT_DEFAULT", 0.1)
+@patch(
+    "swarmit.testbed.adapter.MarilibSerialAdapter", MarilibSerialAdapterMock
+)
+def test_controller_multi_gateway():
+    controller = Controller(
+        ControllerSettings(
+            serial_ports=["p1", "p2"],
+            devices=["00000001", "00000002"],
+            adapter_wait_timeout=0.1,
+        )
+    )
+    gateways = [
+        adapter.mari.serial_interface
+        for adapter in controller.interface.adapters
+    ]
+    assert [gateway.port for gateway in gateways] == ["p1", "p2"]
+    nodes = [
+        SwarmitNode(address=addr, adapter=gateway)
+        for addr, gateway in zip([0x01, 0x02], gateways)
+    ]
+    for node, gateway in zip(nodes, gateways):
+        gateway.add_node(node)
+
+    # merged status view
+    assert sorted(controller.known_devices.keys()) == [
+        "00000001",
+        "00000002",
+    ]
+    assert controller.interface.routes == {0x01: 0, 0x02: 1}
+    assert controller._partition(["00000001", "00000002"]) == [
+        ["00000001"],
+        ["00000002"],
+    ]
+
+    firmware = b"\x00" * 2**12
+    ota_data = controller.start_ota(firmware)
+    assert ota_data["acked"] == ["00000001", "00000002"]
+    result = controller.transfer(firmware, ota_data["acked"])
+    assert all([transfer.success for transfer in result.values()]) is True
+    counters = controller.interface.telemetry.snapshot()["counters"]
+    assert counters["gateway_frames_sent"]["0"] > 0
+    assert counters["gateway_frames_sent"]["1"] > 0
+    controller.terminate()
+
+
 @patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
 @patch("swarmit.testbed.controller.OTA_ACK_TIMEOUT_DEFAULT", 0.1)
 @patch(
@@ -646,6 +766,38 @@ def test_controller_ota_unicast():
     assert all([transfer.success for transfer in result.values()]) is True
 
 
+@patch(
+    "swarmit.testbed.adapter.MarilibSerialAdapter", MarilibSerialAdapterMock
+)
+def test_controller_ota_start_latency():
+    controller = Controller(
+        ControllerSettings(
+            devices=["00000001"], adapter_wait_timeout=0.1, ota_timeout=0.2
+        )
+    )
+    test_adapter = controller.interface.mari.serial_interface
+    test_adapter.add_node(SwarmitNode(address=0x01, adapter=test_adapter))
+    send_payload = controller.send_payload
+    sent = []
+
+    def drop_first_start(destination, payload):
+        # the first notification is lost, the device acks the retry
+        sent.append(payload)
+        if len(sent) > 1:
+            send_payload(destination, payload)
+
+    controller.send_payload = drop_first_start
+    ota_data = controller.start_ota(b"\x00" * 1024)
+    assert ota_data["acked"] == ["00000001"]
+    assert controller.start_ota_data.retries == 2
+    histograms = controller.telemetry_snapshot()["controller"]["histograms"]
+    latency = histograms["ota_start_ack_latency"]
+    assert latency["count"] == 1
+    # measured from the first notification
+    assert latency["sum"] >= 0.2
+    controller.terminate()
+
+
 @patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.1)
 @patch("swarmit.testbed.controller.OTA_ACK_TIMEOUT_DEFAULT", 0.1)
 @patch(
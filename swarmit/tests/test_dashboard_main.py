@@ -17,16 +17,33 @@ MAIN_HELP_EXPECTED = """Usage: main [OPTIONS]
 Options:
   -c, --config-path FILE          Path to a .toml configuration file.
   -p, --port TEXT                 Serial port to use to send the bitstream to
-                                  the gateway. Default: /dev/ttyACM0.
+                                  the gateway, several ports separated with ,
+                                  shard the swarm across several gateways.
+                                  Default: /dev/ttyACM0.
   -b, --baudrate INTEGER          Serial port baudrate. Default: 1000000.
   -H, --mqtt-host TEXT            MQTT host. Default: localhost.
   -P, --mqtt-port INTEGER         MQTT port. Default: 1883.
   -T, --mqtt-use_tls              Use TLS with MQTT.
-  -n, --network-id TEXT           Marilib network ID to use. Default: 0x1200
-  -a, --adapter [edge|cloud]      Choose the adapter to communicate with the
+  -n, --network-id TEXT           Marilib network ID to use, several IDs
+                                  separated with , shard the swarm across
+                                  several networks. Default: 0x1200
+  -a, --adapter [edge|cloud|sim|replay]
+                                  Choose the adapter to communicate with the
                                   gateway. Default: edge
+  --capture-path FILE             Capture file: frames are appended to it with
+                                  the edge and cloud adapters, and read from it
+                                  with the replay adapter.
+  --replay-speed TEXT             Replay speed factor, or 'max' to replay as
+                                  fast as possible. Default: 1.
+  --eventlog-path DIRECTORY       Directory where the event logs of the devices
+                                  are written, as rotating compressed files.
+  --logstore-path FILE            SQLite file where the event logs of the
+                                  devices are indexed by device and time.
   -d, --devices TEXT              Subset list of device addresses to interact
-                                  with, separated with ,
+                                  with, separated with ,. Selectors, such as
+                                  "type=DotBotV3 & battery>2.5V" or
+                                  "rect(x0,y0,x1,y1)", select the devices
+                                  matching them.
   -m, --map-size TEXT             Size of the map on the ground in mm, in the
                                   format WIDTHxHEIGHT. Default: 2500x2500.
   --calibration-distance INTEGER  LH2 calibration distance in mm (the -d value
@@ -123,3 +140,48 @@ def test_dashboard_main_webbrowser(
     result = runner.invoke(main, ["--open-browser"])
     assert result.exit_code == 0
     webbrowser_open.assert_called_with("http://localhost:8001")
+
+
+@patch("swarmit.dashboard.main.async_web", new_callable=AsyncMock)
+def test_dashboard_main_testbeds(async_web, tmp_path):
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(
+        'adapter = "sim"\n'
+        'eventlog_path = "eventlogs"\n'
+        "ota_wave_size = 20\n"
+        "[[testbeds]]\n"
+        'swarmit_network_id = "1200"\n'
+        "[[testbeds]]\n"
+        'swarmit_network_id = "1201"\n'
+        'eventlog_path = "eventlogs-1201"\n'
+    )
+    runner = CliRunner()
+    result = runner.invoke(main, ["-c", str(config_path)])
+    assert result.exit_code == 0
+    settings = async_web.await_args.args[0]
+    assert [s.network_id for s in settings] == [0x1200, 0x1201]
+    assert [s.eventlog_path for s in settings] == [
+        "eventlogs",
+        "eventlogs-1201",
+    ]
+    assert all(s.adapter == "sim" for s in settings)
+    assert all(s.ota_wave_size == 20 for s in settings)
+    assert all(s.ota_min_battery == 1500 for s in settings)
+
+
+@patch("swarmit.dashboard.main.async_web", new_callable=AsyncMock)
+def test_dashboard_main_testbeds_shared_path(async_web, tmp_path):
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(
+        'adapter = "sim"\n'
+        'logstore_path = "logs.db"\n'
+        "[[testbeds]]\n"
+        'swarmit_network_id = "1200"\n'
+        "[[testbeds]]\n"
+        'swarmit_network_id = "1201"\n'
+    )
+    runner = CliRunner()
+    result = runner.invoke(main, ["-c", str(config_path)])
+    assert result.exit_code == 2
+    assert "testbeds 1200 and 1201 share the logstore_path" in result.output
+    async_web.assert_not_awaited()
@@ -0,0 +1,154 @@
+import logging
+import threading
+from unittest.mock import patch
+
+from swarmit.testbed.eventlog import (
+    EventLogConsole,
+    EventLogFile,
+    EventLogRateLimiter,
+    EventLogRecord,
+    EventLogSink,
+    read_eventlog,
+)
+from swarmit.testbed.logger import setup_logging
+
+
+def _record(index, device="00000001"):
+    return EventLogRecord(
+        device=device,
+        timestamp=index,
+        received_at=1000 + index,
+        data=f"event {index}".encode(),
+    )
+
+
+def test_eventlog_sink_batches():
+    batches = []
+    sink = EventLogSink([batches.append], batch_size=10)
+    for index in range(25):
+        sink.put(_record(index))
+    sink.close()
+    records = [record for batch in batches for record in batch]
+    assert [record.timestamp for record in records] == list(range(25))
+    assert all(len(batch) <= 10 for batch in batches)
+    counters = sink.telemetry.snapshot()["counters"]
+    assert counters["eventlog_records"] == {"": 25}
+
+
+def test_eventlog_sink_full_queue():
+    release = threading.Event()
+    batches = []
+
+    def slow_output(batch):
+        release.wait()
+        batches.append(batch)
+
+    sink = EventLogSink([slow_output], queue_size=2)
+    sink.put(_record(0))
+    # let the writer take the first record and block in the output
+    while sink._queue.qsize():
+        pass
+    for index in range(1, 5):
+        sink.put(_record(index))
+    release.set()
+    sink.close()
+    counters = sink.telemetry.snapshot()["counters"]
+    assert counters["eventlog_dropped"] == {"": 2}
+    assert sum(len(batch) for batch in batches) == 3
+
+
+def test_eventlog_sink_output_error():
+    batches = []
+
+    def broken_output(_):
+        raise OSError("disk full")
+
+    sink = EventLogSink([broken_output, batches.append])
+    sink.put(_record(0))
+    sink.close()
+    assert len(batches) == 1
+
+
+def test_eventlog_file_rotation(tmp_path):
+    output = EventLogFile(tmp_path, max_size=100, max_files=2)
+    sink = EventLogSink([output], batch_size=1)
+    for index in range(10):
+        sink.put(_record(index, device=f"{index:08X}"))
+    sink.close()
+    assert len(output.files) == 2
+    assert sorted(str(path) for path in tmp_path.iterdir()) == sorted(
+        output.files
+    )
+    records = [
+        record for path in output.files for record in read_eventlog(path)
+    ]
+    assert records[-1] == {
+        "device": "00000009",
+        "timestamp": 9,
+        "received_at": 1009,
+        "data": "event 9",
+    }
+
+
+def test_eventlog_console_sample(caplog):
+    caplog.set_level(logging.INFO)
+    setup_logging()
+    console = EventLogConsole(sample=3)
+    console([_record(index) for index in range(7)])
+    assert "LOG event" in caplog.text
+    assert "event 2" in caplog.text
+    assert "event 5" in caplog.text
+    assert "event 0" not in caplog.text
+    assert "event 1" not in caplog.text
+    assert caplog.text.count("LOG event") == 2
+
+
+@patch("swarmit.testbed.eventlog.time.monotonic")
+def test_eventlog_rate_limiter_device(monotonic):
+    monotonic.return_value = 0
+    limiter = EventLogRateLimiter(device_rate=2, device_burst=3, global_rate=0)
+    # the first records of a burst are kept
+    admitted = [limiter.admit(_record(index)) for index in range(5)]
+    assert [len(records) for records in admitted] == [1, 1, 1, 0, 0]
+    # other devices are not affected
+    assert len(limiter.admit(_record(5, device="00000002"))) == 1
+
+    monotonic.return_value = 1
+    records = limiter.admit(_record(6))
+    assert [record.data for record in records] == [
+        b"<2 records dropped>",
+        b"event 6",
+    ]
+    assert limiter.pending_markers() == []
+    counters = limiter.telemetry.snapshot()["counters"]
+    assert counters["eventlog_rate_limited"] == {"device": 2}
+    assert limiter.top_limited() == {"00000001": 2}
+
+
+@patch("swarmit.testbed.eventlog.time.monotonic")
+def test_eventlog_rate_limiter_defaults(monotonic):
+    monotonic.return_value = 0
+    limiter = EventLogRateLimiter()
+    # only the swarm is limited by default
+    admitted = [limiter.admit(_record(index)) for index in range(1000)]
+    assert all(len(records) == 1 for records in admitted)
+
+
+@patch("swarmit.testbed.eventlog.time.monotonic")
+def test_eventlog_rate_limiter_global(monotonic):
+    monotonic.return_value = 0
+    limiter = EventLogRateLimiter(device_rate=0, global_rate=2)
+    admitted = [
+        limiter.admit(_record(index, device=f"{index:08X}"))
+        for index in range(4)
+    ]
+    assert [len(records) for records in admitted] == [1, 1, 0, 0]
+    markers = limiter.pending_markers()
+    assert sorted(marker.device for marker in markers) == [
+        "00000002",
+        "00000003",
+    ]
+    assert markers[0].data == b"<1 records dropped>"
+    counters = limiter.telemetry.snapshot()["counters"]
+    assert counters["eventlog_rate_limited"] == {"global": 2}
+    assert limiter.top_limited(1) == {"00000002": 1}
@@ -0,0 +1,47 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from swarmit.testbed.firmware import (
+    FirmwareEmpty,
+    FirmwareStore,
+    FirmwareTooLarge,
+)
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_firmware_store(tmp_path):
+    store = FirmwareStore(tmp_path / "firmwares")
+    fw_hash, size = asyncio.run(store.store(_chunks(b"hello ", b"world")))
+    assert fw_hash == hashlib.sha256(b"hello world").hexdigest()
+    assert size == 11
+    assert store.size(fw_hash) == 11
+    assert store.load(fw_hash) == bytearray(b"hello world")
+    assert store.size("0" * 64) is None
+    with pytest.raises(FileNotFoundError):
+        store.load("0" * 64)
+    with pytest.raises(ValueError):
+        store.size("../../etc/passwd")
+    # the same image is stored once
+    asyncio.run(store.store(_chunks(b"hello world")))
+    assert os.listdir(tmp_path / "firmwares") == [f"{fw_hash}.bin"]
+
+
+def test_firmware_store_too_large(tmp_path):
+    store = FirmwareStore(tmp_path, max_size=8)
+    with pytest.raises(FirmwareTooLarge):
+        asyncio.run(store.store(_chunks(b"hello ", b"world")))
+    assert os.listdir(tmp_path) == []
+
+
+def test_firmware_store_empty(tmp_path):
+    store = FirmwareStore(tmp_path)
+    with pytest.raises(FirmwareEmpty):
+        asyncio.run(store.store(_chunks()))
+    assert os.listdir(tmp_path) == []
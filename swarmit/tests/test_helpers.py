@@ -1,4 +1,7 @@
-from swarmit.testbed.helpers import load_toml_config
+import pytest
+
+from swarmit.testbed import helpers
+from swarmit.testbed.helpers import json_dumps, load_toml_config
 
 TEST_CONFIG_TOML = """
 adapter = "edge"
@@ -21,3 +24,12 @@ def test_load_toml_config(tmp_path):
 def test_load_toml_config_empty():
     cfg = load_toml_config("")
     assert cfg == {}
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_json_dumps(monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(helpers, "orjson", None)
+    elif helpers.orjson is None:
+        pytest.skip("orjson not installed")
+    assert json_dumps({"a": [1, "b"]}) == b'{"a":[1,"b"]}'
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import threading
+import time
+
+from swarmit.testbed.controller import Chunk, OtaPlan, TransferDataStatus
+from swarmit.testbed.jobs import FlashJobManager, JobState
+
+
+class FakeController:
+    def __init__(self, missed=None, chunks=4, plan=None):
+        self.missed = missed or []
+        self.plan = plan
+        self.chunks = [None] * chunks
+        self.transfer_data = {}
+        self.block = threading.Event()
+        self.block.set()
+        self.canceled = threading.Event()
+
+    def plan_ota(self, devices=None):
+        if self.plan is not None:
+            return self.plan
+        return OtaPlan(
+            waves=[devices or ["00000001", "00000002"]],
+            broadcast=devices is None,
+        )
+
+    def start_ota(self, firmware, devices=None):
+        devices = devices or ["00000001", "00000002"]
+        return {
+            "acked": [addr for addr in devices if addr not in self.missed],
+            "missed": self.missed,
+            "skipped": {},
+        }
+
+    def transfer(self, firmware, devices):
+        self.transfer_data = {
+            addr: TransferDataStatus(chunks=[Chunk() for _ in self.chunks])
+            for addr in devices
+        }
+        for chunk in range(len(self.chunks)):
+            for addr in devices:
+                self.transfer_data[addr].chunks[chunk].acked = 1
+                self.transfer_data[addr].chunks[chunk].retries = 1
+            if chunk == 1:
+                self.block.wait()
+            if self.canceled.is_set():
+                break
+        for status in self.transfer_data.values():
+            status.success = all(chunk.acked for chunk in status.chunks)
+        return self.transfer_data
+
+    def transfer_progress(self):
+        return {
+            addr: status.progress()
+            for addr, status in self.transfer_data.items()
+        }
+
+    def cancel_ota(self):
+        self.canceled.set()
+        self.block.set()
+
+
+def wait_finished(job, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not job.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_flash_job_done():
+    manager = FlashJobManager(FakeController())
+    job = manager.submit(bytearray(b"firmware"))
+    assert manager.get(job.id) is job
+    wait_finished(job)
+    progress = job.progress(manager.controller)
+    assert progress["state"] == "done"
+    assert progress["chunks"] == 4
+    assert progress["acked"] == ["00000001", "00000002"]
+    assert progress["progress"]["00000001"] == {
+        "acked": 4,
+        "retries": 4,
+        "success": True,
+    }
+    # the next jobs don't change the progress of a finished job
+    manager.controller.transfer_data = {}
+    assert job.progress(manager.controller)["progress"]["00000002"]["acked"]
+    manager.close()
+
+
+def test_flash_job_missed_acknowledgments():
+    manager = FlashJobManager(FakeController(missed=["00000002"]))
+    job = manager.submit(bytearray(b"firmware"), ["00000001", "00000002"])
+    wait_finished(job)
+    assert job.state == JobState.Failed
+    assert job.error == "1 acknowledgments are missing (00000002)"
+    manager.close()
+
+
+def test_flash_job_waves():
+    controller = FakeController(
+        plan=OtaPlan(
+            waves=[["00000001", "00000002"], ["00000003"]],
+            skipped={"00000004": "battery 1200mV below 1500mV"},
+            marginal=["00000003"],
+        )
+    )
+    manager = FlashJobManager(controller)
+    job = manager.submit(bytearray(b"firmware"))
+    wait_finished(job)
+    progress = job.progress(controller)
+    assert progress["state"] == "done"
+    assert progress["waves"] == 2
+    assert progress["skipped"] == {"00000004": "battery 1200mV below 1500mV"}
+    assert progress["acked"] == ["00000001", "00000002", "00000003"]
+    assert progress["marginal"] == ["00000003"]
+    assert sorted(progress["progress"]) == progress["acked"]
+
+    # nothing left to flash
+    controller.plan = OtaPlan(skipped=controller.plan.skipped)
+    job = manager.submit(bytearray(b"firmware"))
+    wait_finished(job)
+    assert job.state == JobState.Failed
+    assert job.error == "no device to flash, 1 skipped"
+    manager.close()
+
+
+def test_flash_job_cancel():
+    controller = FakeController()
+    controller.block.clear()
+    manager = FlashJobManager(controller, progress_period=0.01)
+    running = manager.submit(bytearray(b"firmware"))
+    pending = manager.submit(bytearray(b"firmware"))
+    while running.state != JobState.Transferring:
+        time.sleep(0.01)
+    progress = running.progress(controller)
+    assert progress["progress"]["00000001"]["acked"] == 2
+    assert progress["eta"] is not None
+
+    manager.cancel(pending)
+    assert pending.state == JobState.Canceled
+    manager.cancel(running)
+    wait_finished(running)
+    assert running.state == JobState.Canceled
+    manager.close()
+
+
+def test_flash_job_subscribe():
+    async def run():
+        controller = FakeController()
+        controller.block.clear()
+        manager = FlashJobManager(controller, progress_period=0.01)
+        job = manager.submit(bytearray(b"firmware"))
+        first = await manager.subscribe(job)
+        second = await manager.subscribe(job)
+        messages, _ = await first.get()
+        assert json.loads(messages[0])["id"] == job.id
+        await second.get()
+        # progress is pushed while the job runs
+        while True:
+            messages, _ = await first.get()
+            if json.loads(messages[-1])["state"] == "transferring":
+                break
+        controller.block.set()
+        await manager.wait(job)
+        assert job.state == JobState.Done
+        while json.loads(messages[-1])["state"] != "done":
+            messages, _ = await second.get()
+        assert job.subscribers == []
+        manager.close()
+
+    asyncio.run(run())
+
+
+def test_flash_job_waits_for_its_devices():
+    manager = FlashJobManager(FakeController())
+    lease = manager.leases.acquire(["00000001"], "start")
+    job = manager.submit(bytearray(b"firmware"), ["00000001"])
+    time.sleep(0.1)
+    assert job.state == JobState.Pending
+    lease.release()
+    wait_finished(job)
+    assert job.state == JobState.Done
+
+    lease = manager.leases.acquire(["00000001"], "start")
+    job = manager.submit(bytearray(b"firmware"), ["00000001"])
+    manager.cancel(job)
+    wait_finished(job)
+    assert job.state == JobState.Canceled
+    lease.release()
+    manager.close()
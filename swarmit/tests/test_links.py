@@ -0,0 +1,56 @@
+import time
+
+from marilib.mari_protocol import MetricsProbePayload
+
+from swarmit.testbed.links import LinkState, LinkTracker
+
+
+def probe(gw_tx, node_rx, node_tx, gw_rx, rssi=-60):
+    return MetricsProbePayload(
+        gw_tx_count=gw_tx,
+        node_rx_count=node_rx,
+        node_tx_count=node_tx,
+        gw_rx_count=gw_rx,
+        rssi_at_node=rssi + 255,
+        rssi_at_gw=rssi + 255,
+    )
+
+
+def test_link_tracker_delivery():
+    tracker = LinkTracker(probe_period=1)
+    assert tracker.state("00000001") == LinkState.Unknown
+    tracker.record("00000001", probe(10, 10, 10, 10))
+    assert tracker.links["00000001"].delivery == 1
+    assert tracker.state("00000001") == LinkState.Good
+
+    # computed over the frames since the previous probe, then smoothed
+    tracker.record("00000001", probe(20, 15, 20, 15))
+    link = tracker.links["00000001"]
+    assert round(link.pdr_downlink, 2) == 0.85
+    assert round(link.pdr_uplink, 2) == 0.85
+    assert tracker.state("00000001") == LinkState.Marginal
+
+    # no downlink frame since the previous probe, the average is kept
+    tracker.record("00000001", probe(20, 15, 30, 25))
+    assert round(tracker.links["00000001"].pdr_downlink, 2) == 0.85
+
+    # the counters restarted with the device
+    tracker.record("00000001", probe(2, 2, 2, 2))
+    assert tracker.links["00000001"].pdr_downlink > 0.85
+
+    tracker.record("00000002", probe(10, 4, 10, 5))
+    assert tracker.state("00000002") == LinkState.OutOfRange
+    tracker.record("00000003", probe(10, 10, 10, 10, rssi=-90))
+    assert tracker.links["00000003"].rssi_dbm == -90
+    assert tracker.state("00000003") == LinkState.Marginal
+    assert tracker.states() == {
+        "good": 0,
+        "marginal": 2,
+        "out_of_range": 1,
+        "unknown": 0,
+    }
+
+    tracker.remove("00000002")
+    assert "00000002" not in tracker.links
+    tracker.links["00000003"].updated_at = time.time() - 10
+    assert tracker.state("00000003") == LinkState.Unknown
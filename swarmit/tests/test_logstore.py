@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import text
+
+from swarmit.testbed.eventlog import EventLogRecord
+from swarmit.testbed.logstore import EventLogStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EventLogStore(tmp_path / "logs.db")
+    store(
+        [
+            EventLogRecord(
+                device=f"{index % 3:08X}",
+                timestamp=index,
+                received_at=1000 + index,
+                data=f"event {index}{' 100%' if index == 7 else ''}".encode(),
+            )
+            for index in range(30)
+        ]
+    )
+    yield store
+    store.close()
+
+
+def test_logstore_query_device_and_time(store):
+    result = store.query(device="00000001", start=1010, end=1020)
+    assert [log["timestamp"] for log in result["logs"]] == [10, 13, 16, 19]
+    assert result["next_cursor"] is None
+    assert result["logs"][0] == {
+        "id": 11,
+        "device": "00000001",
+        "timestamp": 10,
+        "received_at": 1010,
+        "data": "event 10",
+    }
+
+
+def test_logstore_query_contains(store):
+    result = store.query(contains="%")
+    assert [log["timestamp"] for log in result["logs"]] == [7]
+    result = store.query(contains="event 2")
+    assert [log["timestamp"] for log in result["logs"]] == [2] + list(
+        range(20, 30)
+    )
+
+
+def test_logstore_query_pagination(store):
+    pages = []
+    cursor = None
+    while True:
+        result = store.query(device="00000000", cursor=cursor, limit=4)
+        pages.append([log["timestamp"] for log in result["logs"]])
+        cursor = result["next_cursor"]
+        if cursor is None:
+            break
+    assert pages == [[0, 3, 6, 9], [12, 15, 18, 21], [24, 27]]
+    with pytest.raises(ValueError):
+        store.query(cursor="invalid")
+
+
+def test_logstore_query_uses_indexes(store):
+    with store.engine.connect() as conn:
+        plan = " ".join(
+            str(row[-1])
+            for row in conn.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT * FROM event_logs "
+                    "WHERE device = '00000001' AND received_at >= 1010 "
+                    "ORDER BY received_at, id_"
+                )
+            )
+        )
+    assert "ix_event_logs_device_received_at" in plan
+    assert "TEMP B-TREE" not in plan
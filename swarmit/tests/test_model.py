@@ -1,14 +1,16 @@
 import datetime
 
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 
 from swarmit.testbed.model import (
     AwareDateTime,
     Base,
     JWTRecord,
+    create_db_engine,
     create_prevent_overlap_trigger,
+    init_db,
 )
 
 
@@ -153,3 +155,61 @@ def test_update_non_overlapping_succeeds(db_session):
     db_session.commit()  # Should not raise
 
     assert db_session.query(JWTRecord).count() == 2
+
+
+def _slot(index, minutes=30):
+    start = datetime.datetime(
+        2024, 1, 1, tzinfo=datetime.timezone.utc
+    ) + datetime.timedelta(minutes=30 * index)
+    return start, start + datetime.timedelta(minutes=minutes)
+
+
+def test_overlap_with_many_ranges(db_session):
+    for index in range(0, 20, 2):
+        start, end = _slot(index)
+        db_session.add(
+            JWTRecord(jwt=f"token{index}", date_start=start, date_end=end)
+        )
+    db_session.commit()
+
+    # fits in a gap, touching both neighbours
+    start, end = _slot(5)
+    db_session.add(JWTRecord(jwt="gap", date_start=start, date_end=end))
+    db_session.commit()
+
+    # overlaps several ranges
+    start = _slot(6)[0] + datetime.timedelta(minutes=10)
+    end = _slot(9)[1]
+    db_session.add(JWTRecord(jwt="overlap", date_start=start, date_end=end))
+    with pytest.raises(Exception) as excinfo:
+        db_session.commit()
+    assert "Overlapping date range detected" in str(excinfo.value)
+
+
+def test_init_db_upgrades_triggers_and_indexes(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path}/database.db")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "CREATE TABLE jwt_records (id_ INTEGER PRIMARY KEY, "
+                "jwt VARCHAR UNIQUE NOT NULL, date_start DATETIME NOT NULL, "
+                "date_end DATETIME NOT NULL)"
+            )
+        )
+    init_db(engine)
+    init_db(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        plan = " ".join(
+            str(row[-1])
+            for row in conn.execute(
+                text(
+                    "EXPLAIN QUERY PLAN SELECT date_end FROM jwt_records "
+                    "WHERE date_start < '2024-01-02' "
+                    "ORDER BY date_start DESC, date_end DESC LIMIT 1"
+                )
+            )
+        )
+    assert "ix_jwt_records_date_start_date_end" in plan
+    assert "TEMP B-TREE" not in plan
+    engine.dispose()
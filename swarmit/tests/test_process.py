@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from swarmit.testbed.controller import ControllerSettings, NodeStatus
+from swarmit.testbed.process import ControllerProcess, StatusTable
+from swarmit.testbed.protocol import DeviceType, StatusType
+from swarmit.testbed.simulator import SimulatorSettings
+
+
+def test_status_table():
+    table = StatusTable(capacity=4)
+    try:
+        assert table.read() == (0, {})
+        status_data = {
+            "00000001": NodeStatus(
+                device=DeviceType.DotBotV3,
+                status=StatusType.Running,
+                battery=3000,
+                pos_x=-10,
+                pos_y=2000,
+                last_updated_at=12.5,
+            ),
+            "DEADBEEF": NodeStatus(
+                device=DeviceType.Unknown,
+                status=StatusType.Bootloader,
+                battery=2500,
+                pos_x=0,
+                pos_y=0,
+                last_updated_at=13,
+            ),
+        }
+        table.write(status_data, 3)
+        reader = StatusTable(name=table.name)
+        version, read = reader.read()
+        assert version == 3
+        assert reader.version == 3
+        assert read == status_data
+        assert read["DEADBEEF"].last_updated_at == 13
+
+        table.write({}, 4)
+        assert reader.read() == (4, {})
+
+        # the devices beyond the capacity are left out
+        node = status_data["00000001"]
+        table.write({f"{addr:08X}": node for addr in range(1, 7)}, 5)
+        version, read = reader.read()
+        assert version == 5
+        assert list(read) == ["00000001", "00000002", "00000003", "00000004"]
+        reader.close()
+    finally:
+        table.close()
+        table.unlink()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            pytest.fail("condition not met in time")
+        time.sleep(0.05)
+
+
+def test_controller_process():
+    controller = ControllerProcess(
+        ControllerSettings(
+            adapter="sim",
+            adapter_wait_timeout=0.5,
+            simulator=SimulatorSettings(nodes=10, status_interval=0.1, seed=1),
+            controller_process=True,
+        )
+    )
+    try:
+        wait_for(lambda: len(controller.status_data) == 10)
+        version = controller.status_version
+        assert version > 0
+
+        assert len(controller.start(timeout=0.1)) == 10
+        wait_for(
+            lambda: all(
+                node.status == StatusType.Running
+                for node in controller.status_data.values()
+            )
+        )
+        assert controller.status_version > version
+
+        snapshot = controller.telemetry_snapshot()
+        assert sum(snapshot["adapter"]["counters"]["frames_sent"].values())
+        assert "swarmit_adapter_" in controller.metrics()
+        controller.transfer_data = {}
+        assert controller.transfer_data == {}
+        assert controller.transfer_progress() == {}
+        with pytest.raises(AttributeError):
+            controller.status
+
+        # the calls fail once the controller process is gone
+        controller._process.kill()
+        controller._process.join()
+        with pytest.raises(RuntimeError, match="controller process exited"):
+            controller.telemetry_snapshot()
+    finally:
+        controller.terminate()
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from swarmit.testbed.scheduler import (
+    ALL_DEVICES,
+    DeviceLeases,
+    FairLock,
+    LeaseConflict,
+)
+
+
+def test_disjoint_leases_held_together():
+    leases = DeviceLeases()
+    first = leases.acquire(["00000001", "00000002"], "first", timeout=0)
+    second = leases.acquire(["00000003"], "second", timeout=0)
+    assert leases.active == [first, second]
+    with pytest.raises(LeaseConflict) as exc:
+        leases.acquire(["00000002"], "third", timeout=0)
+    assert str(exc.value) == "devices busy: 00000002 (first)"
+    with pytest.raises(LeaseConflict) as exc:
+        leases.acquire(ALL_DEVICES, "all", timeout=0)
+    assert str(exc.value) == (
+        "devices busy: 00000001, 00000002 (first); 00000003 (second)"
+    )
+    first.release()
+    second.release()
+    with leases.acquire(ALL_DEVICES, "all", timeout=0):
+        with pytest.raises(LeaseConflict) as exc:
+            leases.acquire(["00000001"], "fourth", timeout=0)
+        assert str(exc.value) == "devices busy: all devices (all)"
+    assert leases.active == []
+
+
+def test_overlapping_leases_granted_in_order():
+    leases = DeviceLeases()
+    first = leases.acquire(["00000001"], "first")
+    granted = []
+
+    def acquire(devices, owner):
+        with leases.acquire(devices, owner, timeout=2):
+            granted.append(owner)
+
+    waiting_all = threading.Thread(target=acquire, args=(None, "all"))
+    waiting_all.start()
+    while not leases._waiting:
+        time.sleep(0.01)
+    # a later request doesn't overtake the request of the whole testbed
+    with pytest.raises(LeaseConflict) as exc:
+        leases.acquire(["00000002"], "second", timeout=0)
+    assert str(exc.value) == "devices busy: queued behind other operations"
+    first.release()
+    waiting_all.join()
+    assert granted == ["all"]
+    assert leases.active == []
+
+
+def test_lease_wait_canceled():
+    leases = DeviceLeases()
+    leases.acquire(["00000001"], "first")
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(LeaseConflict):
+        leases.acquire(["00000001"], "second", cancel=cancel)
+    assert not leases._waiting
+
+
+def test_acquire_async():
+    async def run():
+        leases = DeviceLeases(timeout=0.05)
+        first = leases.acquire(["00000001"], "first")
+        with pytest.raises(LeaseConflict):
+            await leases.acquire_async(["00000001"], "second")
+        waiting = asyncio.create_task(
+            leases.acquire_async(["00000001"], "third", timeout=2)
+        )
+        await asyncio.sleep(0.01)
+        threading.Thread(target=first.release).start()
+        lease = await waiting
+        assert leases.active == [lease]
+        lease.release()
+
+    asyncio.run(run())
+
+
+def test_fair_lock_order():
+    lock = FairLock()
+    order = []
+
+    def append(index):
+        with lock:
+            order.append(index)
+
+    lock.acquire()
+    threads = []
+    for index in range(5):
+        thread = threading.Thread(target=append, args=(index,))
+        thread.start()
+        threads.append(thread)
+        while lock._next_ticket != index + 2:
+            time.sleep(0.001)
+    assert lock.queued == 6
+    lock.release()
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2, 3, 4]
+    assert lock.queued == 0
@@ -0,0 +1,130 @@
+import time
+
+import pytest
+
+from swarmit.testbed.controller import NodeStatus
+from swarmit.testbed.protocol import DeviceType, StatusType
+from swarmit.testbed.selector import (
+    Clause,
+    StatusIndex,
+    parse_selector,
+    select_devices,
+    split_devices,
+)
+
+
+def node(device, status, battery, pos=(0, 0), seen=0):
+    return NodeStatus(
+        device=device,
+        status=status,
+        battery=battery,
+        pos_x=pos[0],
+        pos_y=pos[1],
+        last_updated_at=time.time() - seen,
+    )
+
+
+@pytest.fixture
+def index():
+    index = StatusIndex()
+    index.update(
+        "BC3D0001", node(DeviceType.DotBotV3, StatusType.Bootloader, 2900)
+    )
+    index.update(
+        "BC3D0002",
+        node(DeviceType.DotBotV3, StatusType.Running, 2450, (1000, 0)),
+    )
+    index.update(
+        "BC3D0003",
+        node(DeviceType.DotBotV2, StatusType.Bootloader, 2500, seen=30),
+    )
+    index.update(
+        "AA000001",
+        node(DeviceType.nRF5340DK, StatusType.Programming, 3300, (0, 900)),
+    )
+    return index
+
+
+def test_status_index_updates(index):
+    assert len(index) == 4
+    assert index.by_status([StatusType.Bootloader]) == {
+        "BC3D0001",
+        "BC3D0003",
+    }
+    index.update(
+        "BC3D0001", node(DeviceType.DotBotV3, StatusType.Running, 2000)
+    )
+    assert index.by_status([StatusType.Bootloader]) == {"BC3D0003"}
+    assert index.by_battery("<", 2100) == {"BC3D0001"}
+    index.remove("BC3D0003")
+    index.remove("BC3D0003")
+    assert len(index) == 3
+    assert index.by_status([StatusType.Bootloader]) == set()
+    assert index.by_prefix("BC3D") == {"BC3D0001", "BC3D0002"}
+    assert index.positions.within_radius(0, 0, 10) == ["BC3D0001"]
+
+
+def test_status_index_battery(index):
+    assert index.by_battery(">=", 2500) == {
+        "BC3D0001",
+        "BC3D0003",
+        "AA000001",
+    }
+    assert index.by_battery(">", 2500) == {"BC3D0001", "AA000001"}
+    assert index.by_battery("<=", 2450) == {"BC3D0002"}
+    assert index.by_battery("=", 2900) == {"BC3D0001"}
+    assert index.by_battery("!=", 2900) == {
+        "BC3D0002",
+        "BC3D0003",
+        "AA000001",
+    }
+
+
+def test_parse_selector():
+    assert parse_selector("BC3D0001") is None
+    assert parse_selector("battery >= 2.5V").clauses == [
+        Clause("battery", ">=", 2500)
+    ]
+    selector = parse_selector(
+        "type=dotbotv3|DotBotV2 & status!=Running seen<500ms addr=bc3d*"
+    )
+    assert selector.clauses == [
+        Clause("type", "=", [DeviceType.DotBotV3, DeviceType.DotBotV2]),
+        Clause("status", "!=", [StatusType.Running]),
+        Clause("seen", "<", 0.5),
+        Clause("addr", "=", ["BC3D*"]),
+    ]
+    with pytest.raises(ValueError, match="SailBot is not one of"):
+        parse_selector("type=SailBot")
+    with pytest.raises(ValueError, match="status takes = or !="):
+        parse_selector("status>Running")
+    with pytest.raises(ValueError, match="2.5X is not a number"):
+        parse_selector("battery>2.5X")
+    with pytest.raises(ValueError, match="invalid selector color=red"):
+        parse_selector("color=red")
+
+
+def test_select_devices(index):
+    assert split_devices("") == []
+    assert split_devices(
+        "BC3D0001, type=DotBotV3 & rect(0,0,10,10) & radius(0,0,5),x"
+    ) == ["BC3D0001", "type=DotBotV3 & rect(0,0,10,10) & radius(0,0,5)", "x"]
+    assert select_devices(None, index) is None
+    assert select_devices([], index) is None
+    assert select_devices(["BC3D0009"], index) == ["BC3D0009"]
+    assert select_devices(["type=DotBotV3 & battery>2.5V"], index) == [
+        "BC3D0001"
+    ]
+    assert select_devices(["status=Bootloader seen<10"], index) == ["BC3D0001"]
+    assert select_devices(["seen>10"], index) == ["BC3D0003"]
+    assert select_devices(["addr=BC3D* rect(500,-10,2000,10)"], index) == [
+        "BC3D0002"
+    ]
+    assert select_devices(["addr!=BC3D0001|AA*"], index) == [
+        "BC3D0002",
+        "BC3D0003",
+    ]
+    assert select_devices(
+        ["AA000001", "nearest(0,0,1)", "type=nRF5340DK"], index
+    ) == ["AA000001", "BC3D0001"]
+    assert select_devices(["type=DotBotV2 battery<2000"], index) == []
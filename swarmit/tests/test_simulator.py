@@ -0,0 +1,295 @@
+import time
+from unittest.mock import patch
+
+from swarmit.testbed.controller import Controller, ControllerSettings
+from swarmit.testbed.protocol import PayloadReset, PayloadStart, StatusType
+from swarmit.testbed.simulator import (
+    SimulatedAdapter,
+    SimulatedChannel,
+    SimulatorSettings,
+)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def test_simulated_channel():
+    channel = SimulatedChannel(rate=10, max_queue_delay=0.25)
+    assert channel.reserve(0) == 0
+    assert channel.reserve(0) == 0.1
+    assert channel.reserve(0) == 0.2
+    assert channel.reserve(0) is None
+    assert channel.dropped == 1
+    assert channel.queued(0) == 3
+    assert channel.queued(0.15) == 2
+    assert channel.reserve(1) == 1
+    assert channel.queued(2) == 0
+
+    unlimited = SimulatedChannel(rate=0, max_queue_delay=0)
+    assert unlimited.reserve(3) == 3
+    assert unlimited.queued(3) == 0
+
+
+def test_simulated_adapter():
+    adapter = SimulatedAdapter(
+        SimulatorSettings(nodes=20, status_interval=0.05, seed=42)
+    )
+    frames = []
+    adapter.init(lambda header, packet: frames.append((header, packet)))
+    time.sleep(0.2)
+    assert {header.source for header, _ in frames} == set(range(1, 21))
+
+    adapter.send_payload(0xFFFFFFFFFFFFFFFF, PayloadStart())
+    time.sleep(0.1)
+    adapter.close()
+    assert all(
+        node.status == StatusType.Running for node in adapter.nodes.values()
+    )
+    assert adapter.frames_sent == 1
+    assert adapter.frames_received == len(frames)
+
+
+def test_simulated_adapter_reset():
+    adapter = SimulatedAdapter(
+        SimulatorSettings(nodes=2, status_interval=0.05, reset_delay=0.2)
+    )
+    adapter.init(lambda header, packet: None)
+    adapter.send_payload(1, PayloadReset(pos_x=100, pos_y=200))
+    node = adapter.nodes[1]
+    wait_for(lambda: node.status == StatusType.Resetting)
+    assert node.status == StatusType.Resetting
+    assert (node.pos_x, node.pos_y) == (100, 200)
+    assert adapter.nodes[2].status == StatusType.Bootloader
+
+    # rebooted to the bootloader, the node can be started again
+    wait_for(lambda: node.status == StatusType.Bootloader)
+    adapter.send_payload(1, PayloadStart())
+    wait_for(lambda: node.status == StatusType.Running)
+    adapter.close()
+    assert node.status == StatusType.Running
+
+
+def test_simulated_adapter_loss():
+    adapter = SimulatedAdapter(
+        SimulatorSettings(nodes=10, status_interval=0.05, loss_rate=1)
+    )
+    frames = []
+    adapter.init(lambda header, packet: frames.append(packet))
+    time.sleep(0.1)
+    adapter.close()
+    assert not frames
+    assert adapter.frames_lost > 0
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+@patch("swarmit.testbed.controller.COMMAND_ATTEMPT_DELAY", 0.1)
+def test_controller_simulated_swarm():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            simulator=SimulatorSettings(
+                nodes=1000, status_interval=0.1, seed=1
+            ),
+        )
+    )
+    wait_for(lambda: len(controller.ready_devices) == 1000)
+    assert len(controller.ready_devices) == 1000
+
+    controller.start(timeout=0.1)
+    wait_for(lambda: len(controller.running_devices) == 1000)
+    assert len(controller.running_devices) == 1000
+
+    controller.stop(timeout=0.1)
+    wait_for(lambda: len(controller.ready_devices) == 1000)
+    assert len(controller.ready_devices) == 1000
+    controller.terminate()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+def test_controller_simulated_ota():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            ota_timeout=0.1,
+            simulator=SimulatorSettings(nodes=50, status_interval=0.1, seed=1),
+        )
+    )
+    firmware = bytearray(range(256)) * 4
+    start_data = controller.start_ota(firmware)
+    assert len(start_data["acked"]) == 50
+    data = controller.transfer(firmware, start_data["acked"])
+    assert all(device.success for device in data.values())
+    histograms = controller.telemetry_snapshot()["controller"]["histograms"]
+    assert histograms["ota_start_ack_latency"]["count"] == 50
+    assert histograms["ota_chunk_ack_latency"]["count"] == 50 * 8
+    controller.terminate()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+def test_controller_simulated_ota_battery():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            ota_timeout=0.1,
+            ota_wave_size=10,
+            simulator=SimulatorSettings(
+                nodes=30,
+                status_interval=0.1,
+                battery_min=1000,
+                battery_max=3000,
+                seed=1,
+            ),
+        )
+    )
+    assert len(controller.ready_devices) == 30
+    batteries = {
+        addr: node.battery for addr, node in controller.status_data.items()
+    }
+    plan = controller.plan_ota()
+    assert sorted(plan.skipped) == sorted(
+        addr for addr, battery in batteries.items() if battery < 1500
+    )
+    assert 0 < len(plan.skipped) < 30
+    assert plan.broadcast is False
+    assert [len(wave) for wave in plan.waves[:-1]] == [10] * (
+        len(plan.waves) - 1
+    )
+    # healthiest first
+    assert [batteries[addr] for addr in plan.devices] == sorted(
+        (batteries[addr] for addr in plan.devices), reverse=True
+    )
+
+    firmware = bytearray(range(256)) * 4
+    start_data = controller.start_ota(firmware)
+    assert start_data["skipped"] == plan.skipped
+    assert sorted(start_data["acked"]) == sorted(plan.devices)
+    # the skipped devices are not started with a broadcast
+    time.sleep(0.2)
+    assert sorted(controller.ready_devices) == sorted(plan.skipped)
+    controller.terminate()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+def test_controller_simulated_ota_links():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            ota_timeout=0.1,
+            link_probe_period=0.5,
+            simulator=SimulatorSettings(
+                nodes=30,
+                status_interval=0.1,
+                marginal_rate=0.3,
+                marginal_loss_rate=0.05,
+                seed=1,
+            ),
+        )
+    )
+    assert len(controller.ready_devices) == 30
+    marginal = sorted(
+        f"{address:08X}"
+        for address, node in controller.interface.nodes.items()
+        if node.loss_rate
+    )
+    assert 0 < len(marginal) < 30
+    wait_for(lambda: len(controller.links.links) == 30)
+    plan = controller.plan_ota()
+    assert sorted(plan.marginal) == marginal
+    assert plan.broadcast is True
+    assert controller.telemetry_snapshot()["controller"]["gauges"][
+        "devices_link"
+    ] == {
+        "good": 30 - len(marginal),
+        "marginal": len(marginal),
+        "out_of_range": 0,
+        "unknown": 0,
+    }
+
+    firmware = bytearray(range(256)) * 4
+    start_data = controller.start_ota(firmware)
+    assert len(start_data["acked"]) == 30
+    with patch.object(
+        controller, "send_chunk", wraps=controller.send_chunk
+    ) as send_chunk:
+        data = controller.transfer(firmware, start_data["acked"])
+    # the devices with a good link get the broadcast chunks
+    assert all(
+        status.success for addr, status in data.items() if addr not in marginal
+    )
+    broadcast = [c for c in send_chunk.call_args_list if len(c.args) == 3]
+    assert len(broadcast) == 8
+    assert sorted(broadcast[0].args[2]) == sorted(
+        set(start_data["acked"]) - set(marginal)
+    )
+    # the others in unicast, with a tighter retry window
+    unicast = [c for c in send_chunk.call_args_list if len(c.args) == 5]
+    assert sorted({c.args[1] for c in unicast}) == marginal
+    assert all(c.args[3:] == (0.05, 20) for c in unicast)
+    controller.terminate()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+def test_controller_simulated_ota_failure():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            devices=["00000001"],
+            ota_timeout=0.05,
+            ota_max_retries=2,
+            simulator=SimulatorSettings(
+                nodes=1, status_interval=0.1, ota_failure_rate=1
+            ),
+        )
+    )
+    firmware = bytearray(range(256)) * 4
+    start_data = controller.start_ota(firmware, devices=["00000001"])
+    assert start_data["acked"] == ["00000001"]
+    data = controller.transfer(firmware, start_data["acked"])
+    assert data["00000001"].success is False
+    controller.terminate()
+
+
+def test_controller_simulated_ready():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            simulator=SimulatorSettings(nodes=100, status_interval=0.1),
+        )
+    )
+    # The controller proceeds as soon as every node reported its status
+    start = time.monotonic()
+    assert len(controller.known_devices) == 100
+    assert time.monotonic() - start < 1
+    controller.terminate()
+
+
+@patch("swarmit.testbed.controller.COMMAND_TIMEOUT", 0.3)
+@patch("swarmit.testbed.controller.COMMAND_ATTEMPT_DELAY", 0.1)
+def test_controller_simulated_region():
+    controller = Controller(
+        ControllerSettings(
+            adapter="sim",
+            simulator=SimulatorSettings(
+                nodes=200, status_interval=0.1, seed=1
+            ),
+        )
+    )
+    assert len(controller.ready_devices) == 200
+    assert len(controller.status_index) == 200
+    expected = sorted(
+        addr
+        for addr, node in controller.status_data.items()
+        if node.pos_x <= 1250 and node.pos_y <= 1250
+    )
+    assert 0 < len(expected) < 200
+    started = controller.start(
+        devices=["rect(-5000,-5000,1250,1250)"], timeout=0.1
+    )
+    assert sorted(started) == expected
+    time.sleep(0.2)
+    assert sorted(controller.running_devices) == expected
+    assert controller.start(devices=["radius(-9000,-9000,1)"]) == []
+    controller.terminate()
@@ -0,0 +1,58 @@
+import pytest
+
+from swarmit.testbed.spatial import Region, SpatialIndex, parse_region
+
+
+@pytest.fixture
+def index():
+    index = SpatialIndex(cell_size=100)
+    positions = {
+        "00000001": (0, 0),
+        "00000002": (150, 50),
+        "00000003": (1000, 1000),
+        "00000004": (-120, 30),
+        "00000005": (240, 260),
+    }
+    for addr, (x, y) in positions.items():
+        index.update(addr, x, y)
+    return index
+
+
+def test_spatial_index_queries(index):
+    assert len(index) == 5
+    assert index.within_rect(0, 0, 150, 50) == ["00000001", "00000002"]
+    assert index.within_rect(250, 300, -200, -10) == [
+        "00000001",
+        "00000002",
+        "00000004",
+        "00000005",
+    ]
+    assert index.within_radius(0, 0, 130) == ["00000001", "00000004"]
+    assert index.within_radius(5000, 5000, 100) == []
+    assert index.nearest(100, 0, 2) == ["00000002", "00000001"]
+    assert index.nearest(900, 900, 1) == ["00000003"]
+    assert index.nearest(0, 0, 10)[-1] == "00000003"
+    assert index.nearest(0, 0, 0) == []
+    assert SpatialIndex().nearest(0, 0, 3) == []
+
+
+def test_spatial_index_updates(index):
+    index.update("00000003", 10, 10)
+    assert index.within_rect(0, 0, 20, 20) == ["00000001", "00000003"]
+    assert index.within_radius(1000, 1000, 10) == []
+    index.remove("00000001")
+    index.remove("00000001")
+    assert index.within_rect(0, 0, 20, 20) == ["00000003"]
+    assert len(index) == 4
+
+
+def test_parse_region():
+    assert parse_region("00000001") is None
+    assert parse_region("rect(0, 0, 500.5, 500)") == Region(
+        "rect", (0, 0, 500, 500)
+    )
+    assert parse_region("nearest(1,2,3)") == Region("nearest", (1, 2, 3))
+    with pytest.raises(ValueError, match=r"expected radius\(x,y,r\)"):
+        parse_region("radius(1,2)")
+    with pytest.raises(ValueError):
+        parse_region("rect(a,b,c,d)")
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import threading
+from types import SimpleNamespace
+
+from swarmit.testbed.controller import NodeStatus
+from swarmit.testbed.eventlog import EventLogRecord
+from swarmit.testbed.protocol import StatusType
+from swarmit.testbed.stream import EventLogBroadcaster, StatusBroadcaster
+from swarmit.testbed.webserver import logs_stream, status_stream
+
+
+def _record(index, device="00000001"):
+    return EventLogRecord(
+        device=device,
+        timestamp=index,
+        received_at=1000 + index,
+        data=f"event {index}".encode(),
+    )
+
+
+def test_broadcaster_fan_out():
+    async def run():
+        broadcaster = EventLogBroadcaster(buffer_size=3)
+        everything = broadcaster.subscribe()
+        filtered = broadcaster.subscribe(devices=["00000002"])
+        # records are pushed from the event log sink thread
+        thread = threading.Thread(
+            target=broadcaster,
+            args=(
+                [_record(index, f"{index % 2 + 1:08X}") for index in range(5)],
+            ),
+        )
+        thread.start()
+        thread.join()
+        messages, dropped = await everything.get()
+        assert [json.loads(m)["timestamp"] for m in messages] == [2, 3, 4]
+        assert dropped == 2
+        messages, dropped = await filtered.get()
+        assert [json.loads(m)["timestamp"] for m in messages] == [1, 3]
+        assert dropped == 0
+
+        broadcaster.unsubscribe(everything)
+        broadcaster.unsubscribe(filtered)
+        assert broadcaster.subscribers == []
+
+    asyncio.run(run())
+
+
+def test_logs_stream_endpoint():
+    async def run():
+        broadcaster = EventLogBroadcaster()
+        controller = SimpleNamespace(
+            eventlog_stream=broadcaster,
+            select_devices=lambda devices: devices or None,
+        )
+        testbed = SimpleNamespace(controller=controller)
+        request = SimpleNamespace(
+            app=SimpleNamespace(
+                state=SimpleNamespace(testbeds={"0001": testbed})
+            ),
+            path_params={},
+        )
+        response = await logs_stream(request, devices="00000001")
+        assert response.media_type == "text/event-stream"
+        events = response.body_iterator
+        chunk = asyncio.ensure_future(events.__anext__())
+        while not broadcaster.subscribers:
+            await asyncio.sleep(0.01)
+        broadcaster([_record(0, "00000002"), _record(1), _record(2)])
+        data = await chunk
+        assert data.count("data: ") == 2
+        assert json.loads(data.split("\n\n")[0][6:])["data"] == "event 1"
+        await events.aclose()
+        assert broadcaster.subscribers == []
+
+    asyncio.run(run())
+
+
+def _event(message):
+    name, data = message.strip().split("\n")
+    return name[len("event: ") :], json.loads(data[len("data: ") :])
+
+
+def test_status_broadcaster_deltas():
+    async def run():
+        status_data = {
+            "00000001": NodeStatus(pos_x=10, last_updated_at=1),
+            "00000002": NodeStatus(pos_x=20, last_updated_at=1),
+        }
+        broadcaster = StatusBroadcaster(status_data)
+        first = broadcaster.subscribe()
+        messages, _ = await first.get()
+        name, data = _event(messages[0])
+        assert name == "snapshot"
+        assert set(data["devices"]) == {"00000001", "00000002"}
+        assert data["devices"]["00000001"] == {
+            "device": "Unknown",
+            "status": "Bootloader",
+            "battery": 0,
+            "pos_x": 10,
+            "pos_y": 0,
+        }
+
+        # only refreshed, nothing to publish
+        status_data["00000001"] = NodeStatus(pos_x=10, last_updated_at=2)
+        broadcaster.publish()
+        status_data["00000002"] = NodeStatus(
+            status=StatusType.Running, pos_x=20
+        )
+        status_data["00000003"] = NodeStatus()
+        del status_data["00000001"]
+        second = broadcaster.subscribe()
+        broadcaster.publish()
+
+        messages, _ = await first.get()
+        assert len(messages) == 1
+        name, data = _event(messages[0])
+        assert name == "update"
+        assert set(data["updated"]) == {"00000002", "00000003"}
+        assert data["updated"]["00000002"]["status"] == "Running"
+        assert data["removed"] == ["00000001"]
+
+        # the new subscriber starts from the up-to-date snapshot
+        messages, _ = await second.get()
+        assert len(messages) == 1
+        name, data = _event(messages[0])
+        assert name == "snapshot"
+        assert set(data["devices"]) == {"00000002", "00000003"}
+        assert broadcaster.snapshot() is broadcaster.snapshot()
+
+    asyncio.run(run())
+
+
+def test_status_broadcaster_coalesces_positions():
+    async def run():
+        status_data = {"00000001": NodeStatus()}
+        broadcaster = StatusBroadcaster(status_data, interval=0.2)
+        broadcaster.start()
+        subscriber = broadcaster.subscribe()
+        await subscriber.get()
+        for pos_x in range(1, 11):
+            status_data["00000001"] = NodeStatus(pos_x=pos_x)
+            await asyncio.sleep(0.01)
+        messages, _ = await subscriber.get()
+        assert len(messages) == 1
+        assert _event(messages[0])[1]["updated"]["00000001"]["pos_x"] == 10
+
+        # status transitions are sent right away
+        status_data["00000001"] = NodeStatus(status=StatusType.Running)
+        broadcaster.wake()
+        messages, _ = await asyncio.wait_for(subscriber.get(), 0.1)
+        assert _event(messages[0])[1]["updated"]["00000001"]["status"] == (
+            "Running"
+        )
+        broadcaster.stop()
+
+    asyncio.run(run())
+
+
+def test_status_stream_endpoint():
+    async def run():
+        status_data = {"00000001": NodeStatus()}
+        broadcaster = StatusBroadcaster(status_data, buffer_size=1)
+        controller = SimpleNamespace(status_stream=broadcaster)
+        testbed = SimpleNamespace(controller=controller)
+        request = SimpleNamespace(
+            app=SimpleNamespace(
+                state=SimpleNamespace(testbeds={"0001": testbed})
+            ),
+            path_params={},
+        )
+        response = await status_stream(request)
+        assert response.media_type == "text/event-stream"
+        events = response.body_iterator
+        name, data = _event(await events.__anext__())
+        assert name == "snapshot"
+        assert list(data["devices"]) == ["00000001"]
+
+        # a client too slow to get all the updates gets a new snapshot
+        chunk = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.01)
+        for pos_x in range(3):
+            status_data["00000001"] = NodeStatus(pos_x=pos_x + 1)
+            broadcaster.publish()
+        name, data = _event(await chunk)
+        assert name == "snapshot"
+        assert data["devices"]["00000001"]["pos_x"] == 3
+        await events.aclose()
+        assert broadcaster.subscribers == []
+
+    asyncio.run(run())
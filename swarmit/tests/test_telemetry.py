@@ -0,0 +1,148 @@
+import threading
+
+from marilib.mari_protocol import MetricsProbePayload
+
+from swarmit.testbed.telemetry import (
+    Histogram,
+    Telemetry,
+    payload_type_name,
+    print_telemetry,
+    prometheus_metrics,
+)
+
+
+def test_payload_type_name():
+    assert payload_type_name(0x80) == "SWARMIT_STATUS"
+    assert payload_type_name(0x42) == "0x42"
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 0.2, 0.5))
+    assert histogram.quantile(0.5) == 0
+    for value in (0.05, 0.15, 0.15, 0.3, 1):
+        histogram.observe(value)
+    assert histogram.count == 5
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.quantile(0.5) == 0.2
+    assert histogram.quantile(0.8) == 0.5
+    assert histogram.quantile(1) == float("inf")
+    data = histogram.as_dict()
+    assert data["buckets"] == {"0.1": 1, "0.2": 2, "0.5": 1, "+Inf": 1}
+    assert data["p50"] == 0.2
+
+
+def test_telemetry_snapshot(capsys):
+    telemetry = Telemetry()
+    telemetry.count("frames_received", "SWARMIT_STATUS")
+    telemetry.count("frames_received", "SWARMIT_STATUS")
+    telemetry.count("parse_errors")
+    telemetry.observe("ota_chunk_ack_latency", 0.02)
+    telemetry.gauge("devices", lambda: 3)
+    telemetry.record_probe(
+        "00000001",
+        MetricsProbePayload(
+            rssi_at_node=200,
+            rssi_at_gw=190,
+            gw_tx_count=10,
+            node_rx_count=9,
+            node_tx_count=10,
+            gw_rx_count=8,
+        ),
+    )
+    snapshot = telemetry.snapshot()
+    assert snapshot["counters"] == {
+        "frames_received": {"SWARMIT_STATUS": 2},
+        "parse_errors": {"": 1},
+    }
+    assert snapshot["gauges"] == {"devices": 3}
+    assert snapshot["histograms"]["ota_chunk_ack_latency"]["count"] == 1
+    link = snapshot["links"]["00000001"]
+    assert link["rssi_node_dbm"] == -55
+    assert link["rssi_gw_dbm"] == -65
+    assert link["pdr_downlink"] == 0.9
+    assert link["pdr_uplink"] == 0.8
+
+    print_telemetry({"adapter": snapshot})
+    out, _ = capsys.readouterr()
+    assert "Adapter telemetry" in out
+    assert "SWARMIT_STATUS" in out
+    assert "ota_chunk_ack_latency" in out
+    assert "00000001" in out
+    assert "90.0%" in out
+
+    print_telemetry(
+        {"controller": {**snapshot, "eventlog_top_limited": {"0000000A": 7}}}
+    )
+    out, _ = capsys.readouterr()
+    assert "Event logs dropped" in out
+    assert "0000000A" in out
+
+
+def test_telemetry_threads():
+    telemetry = Telemetry()
+
+    def record():
+        for _ in range(1000):
+            telemetry.count("frames_sent", "SWARMIT_START")
+            telemetry.observe("request_latency", 0.02, "GET /status")
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    telemetry.count("frames_sent", "SWARMIT_START")
+    assert telemetry.counters["frames_sent"]["SWARMIT_START"] == 4001
+    histogram = telemetry.histograms[("request_latency", "GET /status")]
+    assert histogram.count == 4000
+    snapshot = telemetry.snapshot()
+    assert (
+        snapshot["histograms"]["request_latency GET /status"]["count"] == 4000
+    )
+
+    # the shards of the threads that ended are folded in a single one
+    assert len(telemetry._shards) == 2
+    for _ in range(3):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+    thread = threading.Thread(target=telemetry.count, args=("jobs", "done"))
+    thread.start()
+    thread.join()
+    assert len(telemetry._shards) == 3
+    assert telemetry.counters["frames_sent"]["SWARMIT_START"] == 7001
+    histogram = telemetry.histograms[("request_latency", "GET /status")]
+    assert histogram.count == 7000
+
+
+def test_prometheus_metrics():
+    telemetry = Telemetry()
+    telemetry.count("frames_received", "SWARMIT_STATUS", 2)
+    telemetry.count("parse_errors")
+    telemetry.gauge("devices", lambda: 3)
+    telemetry.gauge("devices_by_status", lambda: {"Running": 2, "Stopping": 1})
+    telemetry.observe("job_duration", 12, buckets=(10, 60))
+    telemetry.observe("command_confirm_latency", 0.3, "start", (0.1, 0.5))
+    assert prometheus_metrics({"controller": telemetry}).splitlines() == [
+        "# TYPE swarmit_controller_frames_received_total counter",
+        'swarmit_controller_frames_received_total{payload_type="SWARMIT_STATUS"} 2',
+        "# TYPE swarmit_controller_parse_errors_total counter",
+        "swarmit_controller_parse_errors_total 1",
+        "# TYPE swarmit_controller_devices gauge",
+        "swarmit_controller_devices 3",
+        "# TYPE swarmit_controller_devices_by_status gauge",
+        'swarmit_controller_devices_by_status{status="Running"} 2',
+        'swarmit_controller_devices_by_status{status="Stopping"} 1',
+        "# TYPE swarmit_controller_command_confirm_latency_seconds histogram",
+        'swarmit_controller_command_confirm_latency_seconds_bucket{command="start",le="0.1"} 0',
+        'swarmit_controller_command_confirm_latency_seconds_bucket{command="start",le="0.5"} 1',
+        'swarmit_controller_command_confirm_latency_seconds_bucket{command="start",le="+Inf"} 1',
+        'swarmit_controller_command_confirm_latency_seconds_sum{command="start"} 0.3',
+        'swarmit_controller_command_confirm_latency_seconds_count{command="start"} 1',
+        "# TYPE swarmit_controller_job_duration_seconds histogram",
+        'swarmit_controller_job_duration_seconds_bucket{le="10"} 0',
+        'swarmit_controller_job_duration_seconds_bucket{le="60"} 1',
+        'swarmit_controller_job_duration_seconds_bucket{le="+Inf"} 1',
+        "swarmit_controller_job_duration_seconds_sum 12.0",
+        "swarmit_controller_job_duration_seconds_count 1",
+    ]
@@ -1,12 +1,25 @@
+import asyncio
 import base64
 import datetime
+import hashlib
+import json
+from types import SimpleNamespace
 
 import pytest
 from fastapi.testclient import TestClient
 
-from swarmit.testbed.controller import ControllerSettings
+from swarmit.testbed.controller import ControllerSettings, NodeStatus
+from swarmit.testbed.eventlog import EventLogRecord
+from swarmit.testbed.jobs import FlashJobManager
+from swarmit.testbed.logstore import EventLogStore
 from swarmit.testbed.protocol import StatusType
-from swarmit.testbed.webserver import api, init_api, mount_frontend
+from swarmit.testbed.webserver import (
+    StatusCache,
+    api,
+    init_api,
+    mount_frontend,
+    status,
+)
 from swarmit.tests.utils import (
     MarilibSerialAdapterMock,
     SwarmitNode,
@@ -81,6 +94,161 @@ def test_status_endpoint(client):
     assert "response" in res.json()
 
 
+def test_status_selectors(client):
+    res = client.get(
+        "/status", params={"devices": "status=Bootloader & battery>1.5V"}
+    )
+    assert res.status_code == 200
+    assert "ETag" not in res.headers
+    assert sorted(res.json()["response"]) == ["00000001", "00000002"]
+    res = client.get("/status", params={"devices": "00000003,status=Stopping"})
+    assert list(res.json()["response"]) == ["00000003"]
+    res = client.get("/status", params={"devices": "status=Stopping"})
+    assert res.status_code == 400
+    res = client.get("/status", params={"devices": "status>Running"})
+    assert res.status_code == 422
+    assert res.json()["detail"].endswith("status takes = or !=")
+
+
+def test_networks(client, tmp_path):
+    controllers = init_api(
+        api,
+        [
+            ControllerSettings(
+                network_id=network_id, adapter="edge", adapter_wait_timeout=0.1
+            )
+            for network_id in (0x0001, 0x00AB)
+        ],
+    )
+    with TestClient(api) as networks_client:
+        testbeds = networks_client.app.state.testbeds
+        assert list(testbeds) == ["0001", "00AB"]
+        assert networks_client.app.state.controller is controllers
+        controller = testbeds["00AB"].controller
+        test_adapter = controller.interface.mari.serial_interface
+        test_adapter.add_node(SwarmitNode(address=0x05, adapter=test_adapter))
+
+        res = networks_client.get("/networks")
+        assert res.json()["response"] == [
+            {"network_id": "0001", "devices": 0},
+            {"network_id": "00AB", "devices": 1},
+        ]
+        res = networks_client.get("/networks/00ab/status")
+        assert list(res.json()["response"]) == ["00000005"]
+        # the routes without prefix are the ones of the first network
+        assert networks_client.get("/status").json()["response"] == {}
+        assert (
+            networks_client.get("/networks/0x0001/settings").json()[
+                "network_id"
+            ]
+            == 1
+        )
+        res = networks_client.get("/networks/FFFF/status")
+        assert res.status_code == 404
+        assert res.json()["detail"] == "unknown network: FFFF"
+
+
+def test_status_endpoint_etag():
+    controller = SimpleNamespace(
+        status_data={"00000001": NodeStatus(battery=2000)}, status_version=1
+    )
+    cache = StatusCache(controller)
+    testbed = SimpleNamespace(status_cache=cache)
+    app = SimpleNamespace(state=SimpleNamespace(testbeds={"0000": testbed}))
+
+    def get(headers={}):
+        return asyncio.run(
+            status(SimpleNamespace(app=app, headers=headers, path_params={}))
+        )
+
+    res = get()
+    etag = res.headers["etag"]
+    assert res.status_code == 200
+    assert json.loads(res.body)["response"]["00000001"]["battery"] == 2000
+    body = cache.body
+
+    res = get({"if-none-match": etag})
+    assert res.status_code == 304
+    assert res.body == b""
+    res = get({"if-none-match": f'"other", W/{etag}'})
+    assert res.status_code == 304
+    assert get().headers["etag"] == etag
+    assert cache.body is body
+
+    controller.status_data["00000001"] = NodeStatus(battery=1000)
+    controller.status_version += 1
+    res = get({"if-none-match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+    assert json.loads(res.body)["response"]["00000001"]["battery"] == 1000
+
+
+def test_telemetry_endpoint(client):
+    res = client.get("/telemetry")
+    assert res.status_code == 200
+    assert res.json()["response"]["adapter"]["counters"]["frames_received"]
+    assert "devices" in res.json()["response"]["controller"]["gauges"]
+
+
+def test_metrics_endpoint(client):
+    client.get("/status")
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    assert (
+        'swarmit_adapter_frames_received_total{payload_type="SWARMIT_STATUS"}'
+        in res.text
+    )
+    assert 'swarmit_controller_devices_by_status{status="Running"}' in res.text
+    assert 'swarmit_controller_devices_battery{level="low"}' in res.text
+    assert "swarmit_flash_jobs_queued 0" in res.text
+    assert (
+        'swarmit_http_request_latency_seconds_count{route="GET /status"}'
+        in res.text
+    )
+    assert 'swarmit_http_responses_total{status_code="200"}' in res.text
+
+
+def test_logs_endpoint(client, tmp_path):
+    controller = client.app.state.controller
+    res = client.get("/logs")
+    assert res.status_code == 404
+
+    controller.logstore = EventLogStore(tmp_path / "logs.db")
+    controller.logstore(
+        [
+            EventLogRecord(
+                device=f"{index % 2:08X}",
+                timestamp=index,
+                received_at=1000 + index,
+                data=f"event {index}".encode(),
+            )
+            for index in range(10)
+        ]
+    )
+    res = client.get(
+        "/logs", params={"device": "00000001", "start": 1002, "limit": 2}
+    )
+    assert res.status_code == 200
+    response = res.json()["response"]
+    assert [log["data"] for log in response["logs"]] == ["event 3", "event 5"]
+    res = client.get(
+        "/logs",
+        params={"device": "00000001", "cursor": response["next_cursor"]},
+    )
+    response = res.json()["response"]
+    assert [log["data"] for log in response["logs"]] == ["event 7", "event 9"]
+    assert response["next_cursor"] is None
+
+    res = client.get("/logs", params={"contains": "event 4"})
+    assert [log["timestamp"] for log in res.json()["response"]["logs"]] == [4]
+
+    res = client.get("/logs", params={"cursor": "invalid"})
+    assert res.status_code == 400
+    controller.logstore.close()
+    controller.logstore = None
+
+
 def test_settings_endpoint(client):
     res = client.get("/settings")
     assert res.status_code == 200
@@ -193,6 +361,138 @@ def test_stop_endpoint(client):
     assert res.json() == {"response": "done"}
 
 
+def test_stop_devices_busy(client):
+    leases = client.app.state.testbeds["03E7"].device_leases
+    leases.timeout = 0.05
+    lease = leases.acquire(["00000003"], "flash job 1234")
+    res = client.post(
+        "/stop",
+        json={"devices": ["00000003"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 409
+    assert res.json()["detail"] == "devices busy: 00000003 (flash job 1234)"
+    # other devices are not held by the lease
+    res = client.post(
+        "/stop",
+        json={"devices": ["00000004"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    lease.release()
+
+
+def test_reset_endpoint(client):
+    res = client.post(
+        "/reset",
+        json={
+            "locations": {
+                "00000001": {"pos_x": 100, "pos_y": 200},
+                "00000003": {"pos_x": 300, "pos_y": 400},
+            }
+        },
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    assert res.json()["response"] == {
+        "devices": ["00000001"],
+        "skipped": ["00000003"],
+        "broadcast": False,
+    }
+
+
+def test_message_endpoint(client, capsys):
+    res = client.post(
+        "/message",
+        json={"message": "Hello robot!", "devices": ["00000002", "00000003"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    assert res.json()["response"]["devices"] == ["00000003"]
+    assert res.json()["response"]["skipped"] == ["00000002"]
+    out = capsys.readouterr().out
+    assert "Node 00000003 received message: Hello robot!" in out
+    assert "Node 00000002 received message" not in out
+
+
+def test_message_region(client, capsys):
+    # the test nodes all report the position (2500, 2500)
+    res = client.post(
+        "/message",
+        json={"message": "Hello robot!", "devices": "radius(2500,2500,10)"},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    assert res.json()["response"]["devices"] == ["00000003"]
+    assert res.json()["response"]["skipped"] == ["00000001", "00000002"]
+    res = client.post(
+        "/message",
+        json={"message": "Hello robot!", "devices": ["rect(0,0,100,100)"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 400
+    assert res.json()["detail"] == "no devices match the selectors"
+    res = client.post(
+        "/stop",
+        json={"devices": ["rect(0,0,100)"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 422
+
+
+def test_calibrate_endpoint(client, monkeypatch):
+    monkeypatch.setattr("swarmit.testbed.controller.COMMAND_MAX_ATTEMPTS", 1)
+    calibration = base64.b64encode(bytes([1]) + bytes(range(36))).decode()
+    res = client.post(
+        "/calibrate",
+        json={"calibration_b64": calibration, "devices": ["00000001"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    assert res.json()["response"]["devices"] == ["00000001"]
+
+    res = client.post(
+        "/calibrate",
+        json={"calibration_b64": base64.b64encode(b"\x01\x02").decode()},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 422
+    assert "Invalid calibration file size" in res.json()["detail"][0]["msg"]
+
+
+def test_batch_endpoint(client, capsys):
+    res = client.post(
+        "/batch",
+        json={
+            "operations": [
+                {"command": "start", "devices": ["00000001"]},
+                {"command": "message", "message": "Go!"},
+                {
+                    "command": "reset",
+                    "locations": {"00000002": {"pos_x": 1, "pos_y": 2}},
+                },
+            ]
+        },
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 200
+    start, message, reset = res.json()["response"]
+    assert start == {"command": "start", "devices": ["00000001"]}
+    assert message["command"] == "message"
+    assert message["broadcast"] is True
+    assert reset["devices"] == ["00000002"]
+    out = capsys.readouterr().out
+    assert "Node 00000001 received message: Go!" in out
+    assert "Node 00000003 received message: Go!" in out
+
+    res = client.post(
+        "/batch",
+        json={"operations": [{"command": "flash"}]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 422
+
+
 def test_stop_no_public_key(client, monkeypatch):
     monkeypatch.setattr(
         "swarmit.testbed.webserver.get_public_key", public_key_not_found
@@ -254,7 +554,7 @@ def test_flash_when_device_not_ready(client):
 
 def test_flash_missing_start_ota(client, monkeypatch):
     def fake_start_ota(self, fw, devices=None):
-        return {"missed": ["00000001"], "acked": []}
+        return {"missed": ["00000001"], "acked": [], "skipped": {}}
 
     monkeypatch.setattr(
         "swarmit.testbed.controller.Controller.start_ota", fake_start_ota
@@ -292,6 +592,88 @@ def test_flash_transfer_failed(client, monkeypatch):
     assert res.json()["detail"] == "transfer failed"
 
 
+def test_flash_canceled(client, monkeypatch):
+    wait = FlashJobManager.wait
+
+    async def cancel_and_wait(self, job):
+        self.cancel(job)
+        await wait(self, job)
+
+    monkeypatch.setattr(FlashJobManager, "wait", cancel_and_wait)
+
+    fw = base64.b64encode(b"abc").decode()
+    res = client.post(
+        "/flash",
+        json={"firmware_b64": fw, "devices": ["00000001"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 400
+    assert res.json()["detail"] == "flash job canceled"
+
+
+def test_flash_uploaded_firmware(client):
+    headers = {"Authorization": "Bearer FAKE_TOKEN"}
+    fw_hash = hashlib.sha256(b"hello").hexdigest()
+    assert client.get(f"/firmware/{fw_hash}").status_code == 404
+    assert client.get("/firmware/invalid").status_code == 400
+
+    res = client.post("/firmware", content=b"", headers=headers)
+    assert res.status_code == 400
+    assert res.json()["detail"] == "empty firmware"
+    res = client.post("/firmware", content=b"hello", headers=headers)
+    assert res.status_code == 200
+    assert res.json()["response"] == {"hash": fw_hash, "size": 5}
+    res = client.get(f"/firmware/{fw_hash}")
+    assert res.json()["response"]["size"] == 5
+
+    res = client.post(
+        "/flash",
+        json={"firmware_hash": fw_hash, "devices": ["00000001"]},
+        headers=headers,
+    )
+    assert res.status_code == 200
+    assert res.json() == {"response": "success"}
+
+    res = client.post(
+        "/flash/jobs", json={"firmware_hash": "0" * 64}, headers=headers
+    )
+    assert res.status_code == 404
+    res = client.post("/flash/jobs", json={}, headers=headers)
+    assert res.status_code == 400
+
+
+def test_flash_jobs(client):
+    fw = base64.b64encode(b"hello").decode()
+    res = client.post(
+        "/flash/jobs",
+        json={"firmware_b64": fw, "devices": ["00000001"]},
+        headers={"Authorization": "Bearer FAKE_TOKEN"},
+    )
+    assert res.status_code == 202
+    job_id = res.json()["response"]["id"]
+    assert res.json()["response"]["firmware_size"] == 5
+
+    with client.stream("GET", f"/flash/jobs/{job_id}/stream") as stream:
+        states = [
+            json.loads(line[6:])["state"]
+            for line in stream.iter_lines()
+            if line.startswith("data: ")
+        ]
+    assert states[-1] == "done"
+
+    res = client.get(f"/flash/jobs/{job_id}")
+    assert res.status_code == 200
+    response = res.json()["response"]
+    assert response["state"] == "done"
+    assert response["progress"]["00000001"]["success"] is True
+
+    res = client.delete(
+        f"/flash/jobs/{job_id}", headers={"Authorization": "Bearer FAKE_TOKEN"}
+    )
+    assert res.status_code == 409
+    assert client.get("/flash/jobs/unknown").status_code == 404
+
+
 def test_issue_jwt(client):
     start_time = (
         datetime.datetime.now(datetime.timezone.utc)
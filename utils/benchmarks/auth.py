@@ -0,0 +1,89 @@
+"""Benchmark the authentication overhead of the dashboard requests.
+
+Compare the former verification, which read public.pem and verified the
+token signature on every request, with the cached verify_jwt.
+
+Usage: python utils/benchmarks/auth.py [--requests N]
+"""
+
+import argparse
+import asyncio
+import datetime
+import tempfile
+import time
+from types import SimpleNamespace
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+)
+from fastapi.security import HTTPAuthorizationCredentials
+
+from swarmit.testbed import webserver
+from swarmit.testbed.auth import TokenCache
+
+
+def legacy_verify(token: str):
+    with open(f"{webserver.DATA_DIR}/public.pem") as f:
+        public_key = f.read()
+    return jwt.decode(token, public_key, algorithms=[webserver.ALGORITHM])
+
+
+def timed(label: str, requests: int, func):
+    start = time.perf_counter()
+    for _ in range(requests):
+        func()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label}: {elapsed / requests * 1e6:.1f}us/request "
+        f"({requests / elapsed:.0f} requests/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=10000)
+    args = parser.parse_args()
+    private_key = Ed25519PrivateKey.generate()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    token = jwt.encode(
+        {"nbf": now, "exp": now + datetime.timedelta(minutes=30)},
+        private_key,
+        algorithm=webserver.ALGORITHM,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        webserver.DATA_DIR = directory
+        with open(f"{directory}/public.pem", "wb") as f:
+            f.write(
+                private_key.public_key().public_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PublicFormat.SubjectPublicKeyInfo,
+                )
+            )
+        request = SimpleNamespace(
+            app=SimpleNamespace(
+                state=SimpleNamespace(token_cache=TokenCache())
+            )
+        )
+        credentials = HTTPAuthorizationCredentials(
+            scheme="Bearer", credentials=token
+        )
+        loop = asyncio.new_event_loop()
+        timed(
+            "before (read + verify)",
+            args.requests,
+            lambda: legacy_verify(token),
+        )
+        timed(
+            "after (cached key + token)",
+            args.requests,
+            lambda: loop.run_until_complete(
+                webserver.verify_jwt(request, credentials)
+            ),
+        )
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
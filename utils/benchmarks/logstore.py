@@ -0,0 +1,79 @@
+"""Benchmark the event log store insertion rate and query latency.
+
+Usage: python utils/benchmarks/logstore.py [--records N] [--devices N]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from swarmit.testbed.eventlog import EVENTLOG_BATCH_SIZE, EventLogRecord
+from swarmit.testbed.logstore import EventLogStore
+
+
+def timed(label: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f"{label}: {(time.perf_counter() - start) * 1000:.1f}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--devices", type=int, default=500)
+    args = parser.parse_args()
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        store = EventLogStore(os.path.join(directory, "logs.db"))
+        devices = [f"{index:016X}" for index in range(args.devices)]
+        start = time.perf_counter()
+        for offset in range(0, args.records, EVENTLOG_BATCH_SIZE):
+            store(
+                [
+                    EventLogRecord(
+                        device=random.choice(devices),
+                        timestamp=index,
+                        received_at=index / 1000,
+                        data=f"sensor={random.randint(0, 1000)}".encode(),
+                    )
+                    for index in range(
+                        offset, min(offset + EVENTLOG_BATCH_SIZE, args.records)
+                    )
+                ]
+            )
+        elapsed = time.perf_counter() - start
+        print(
+            f"insert: {args.records} records in {elapsed:.1f}s "
+            f"({args.records / elapsed:.0f} records/s)"
+        )
+        middle = args.records / 2000
+        timed(
+            "device + time range",
+            store.query,
+            device=devices[0],
+            start=middle,
+            end=middle + 60,
+        )
+        timed("time range", store.query, start=middle, end=middle + 1)
+        timed(
+            "device + contains",
+            store.query,
+            device=devices[0],
+            contains="sensor=42",
+        )
+        page = store.query(device=devices[0], limit=100)
+        timed(
+            "device, next page",
+            store.query,
+            device=devices[0],
+            cursor=page["next_cursor"],
+            limit=100,
+        )
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
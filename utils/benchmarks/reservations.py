@@ -0,0 +1,139 @@
+"""Benchmark the reservation inserts and the /records query.
+
+The database holds back-to-back 30 minute reservations. The overlap
+triggers formerly scanned the whole table, the current ones do a single
+index lookup.
+
+Usage: python utils/benchmarks/reservations.py [--reservations N]
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+from sqlalchemy import asc, insert, text
+from sqlalchemy.exc import IntegrityError
+
+from swarmit.testbed.model import (
+    JWTRecord,
+    create_db_engine,
+    create_session_factory,
+    init_db,
+)
+
+SLOT = datetime.timedelta(minutes=30)
+LEGACY_TRIGGER = """
+CREATE TRIGGER prevent_overlap
+BEFORE INSERT ON jwt_records
+FOR EACH ROW
+BEGIN
+    SELECT CASE
+        WHEN EXISTS (
+            SELECT 1 FROM jwt_records
+            WHERE NEW.date_start < date_end
+            AND NEW.date_end > date_start
+        )
+        THEN RAISE (ABORT, 'Overlapping date range detected')
+    END;
+END;
+"""
+
+
+def populate(engine, count: int, origin: datetime.datetime):
+    with engine.begin() as conn:
+        conn.execute(
+            insert(JWTRecord),
+            [
+                {
+                    "jwt": f"token{index}",
+                    "date_start": origin + index * SLOT,
+                    "date_end": origin + (index + 1) * SLOT,
+                }
+                for index in range(count)
+            ],
+        )
+
+
+def measure(label: str, engine, count: int, origin: datetime.datetime):
+    session = create_session_factory(engine)()
+    start = time.perf_counter()
+    inserts = 100
+    for index in range(inserts):
+        session.add(
+            JWTRecord(
+                jwt=f"new{index}",
+                date_start=origin + (count + index) * SLOT,
+                date_end=origin + (count + index + 1) * SLOT,
+            )
+        )
+        session.commit()
+    insert_time = (time.perf_counter() - start) / inserts
+    start = time.perf_counter()
+    rejected = 0
+    for index in range(inserts):
+        session.add(
+            JWTRecord(
+                jwt=f"overlap{index}",
+                date_start=origin + (index * 7) * SLOT,
+                date_end=origin + (index * 7 + 1) * SLOT,
+            )
+        )
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            rejected += 1
+    reject_time = (time.perf_counter() - start) / inserts
+    now = origin + (count // 2) * SLOT
+    start = time.perf_counter()
+    records = (
+        session.query(JWTRecord)
+        .filter(
+            JWTRecord.date_start >= now - datetime.timedelta(days=1),
+            JWTRecord.date_start <= now + datetime.timedelta(days=30),
+        )
+        .order_by(asc(JWTRecord.date_start))
+        .all()
+    )
+    query_time = time.perf_counter() - start
+    session.close()
+    assert rejected == inserts
+    print(
+        f"{label}: insert {insert_time * 1000:.2f}ms, "
+        f"rejected overlap {reject_time * 1000:.2f}ms, "
+        f"/records query ({len(records)} rows) {query_time * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reservations", type=int, default=100000)
+    args = parser.parse_args()
+    origin = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = create_db_engine(
+            f"sqlite:///{os.path.join(directory, 'legacy.db')}"
+        )
+        with legacy.begin() as conn:
+            JWTRecord.__table__.create(bind=conn)
+            for index in JWTRecord.__table__.indexes:
+                index.drop(bind=conn)
+        populate(legacy, args.reservations, origin)
+        with legacy.begin() as conn:
+            conn.execute(text(LEGACY_TRIGGER))
+        measure("before (scan)", legacy, args.reservations, origin)
+        legacy.dispose()
+
+        engine = create_db_engine(
+            f"sqlite:///{os.path.join(directory, 'database.db')}"
+        )
+        init_db(engine)
+        populate(engine, args.reservations, origin)
+        measure("after (index)", engine, args.reservations, origin)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
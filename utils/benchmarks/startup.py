@@ -0,0 +1,160 @@
+"""Benchmark the controller start-up latency with the edge and cloud adapters.
+
+The serial port and the MQTT broker are replaced by loopback stand-ins that
+behave like a Mari gateway: they report the gateway info every slotframe,
+announce the nodes and forward their status.
+
+Usage: python utils/benchmarks/startup.py [--nodes N] [--runs N]
+"""
+
+import argparse
+import statistics
+import threading
+import time
+from unittest.mock import patch
+
+from dotbot_utils.protocol import Packet
+from marilib.mari_protocol import Frame, Header
+from marilib.model import EdgeEvent, GatewayInfo, NodeInfoCloud, NodeInfoEdge
+from marilib.protocol import PacketType
+
+from swarmit.testbed.controller import Controller, ControllerSettings
+from swarmit.testbed.protocol import PayloadStatus
+
+GATEWAY_ADDRESS = 0x1234567890ABCDEF
+SLOTFRAME = 0.1  # s
+
+
+class LoopbackGateway(threading.Thread):
+    """Emit the events of a Mari gateway with a few nodes attached."""
+
+    def __init__(self, nodes: int, cloud: bool):
+        super().__init__(daemon=True)
+        self.nodes = list(range(1, nodes + 1))
+        self.cloud = cloud
+        self.on_data_received = None
+        self._stop_event = threading.Event()
+
+    def _node_info(self, address):
+        if self.cloud:
+            return NodeInfoCloud(
+                address=address, gateway_address=GATEWAY_ADDRESS
+            )
+        return NodeInfoEdge(address=address)
+
+    def _emit(self, event: EdgeEvent, data: bytes):
+        self.on_data_received(EdgeEvent.to_bytes(event) + data)
+
+    def run(self):
+        info = GatewayInfo(
+            address=GATEWAY_ADDRESS,
+            network_id=0x1200,
+            schedule_stats=bytes(32),
+        )
+        status = Packet.from_payload(PayloadStatus(device=1, status=0))
+        for address in self.nodes:
+            self._emit(
+                EdgeEvent.NODE_JOINED, self._node_info(address).to_bytes()
+            )
+        while not self._stop_event.is_set():
+            self._emit(EdgeEvent.GATEWAY_INFO, info.to_bytes())
+            for address in self.nodes:
+                frame = Frame(
+                    header=Header(
+                        destination=GATEWAY_ADDRESS if self.cloud else 0,
+                        source=address,
+                        type_=PacketType.DATA,
+                    ),
+                    payload=status.to_bytes(),
+                )
+                self._emit(EdgeEvent.NODE_DATA, frame.to_bytes())
+            self._stop_event.wait(SLOTFRAME)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class LoopbackSerialAdapter:
+    """Stand-in for the marilib serial adapter."""
+
+    nodes = 10
+
+    def __init__(self, port, baudrate):
+        self.port = port
+        self.gateway = LoopbackGateway(self.nodes, cloud=False)
+
+    def init(self, on_data_received: callable):
+        self.gateway.on_data_received = on_data_received
+        self.gateway.start()
+
+    def send_data(self, data: bytes):
+        pass
+
+    def close(self):
+        self.gateway.stop()
+
+
+class LoopbackMQTTAdapter:
+    """Stand-in for the marilib MQTT adapter, acting as a local broker."""
+
+    nodes = 10
+
+    def __init__(self, host, port, is_edge: bool, use_tls: bool = False):
+        self.host = host
+        self.port = port
+        self.gateway = LoopbackGateway(self.nodes, cloud=True)
+
+    def set_network_id(self, network_id: str):
+        pass
+
+    def set_on_data_received(self, on_data_received: callable):
+        self.gateway.on_data_received = on_data_received
+
+    def init(self):
+        self.gateway.start()
+
+    def send_data_to_edge(self, data: bytes):
+        pass
+
+    def close(self):
+        self.gateway.stop()
+
+
+def measure(adapter: str, runs: int) -> list[float]:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        controller = Controller(ControllerSettings(adapter=adapter))
+        devices = len(controller.known_devices)
+        durations.append(time.perf_counter() - start)
+        controller.terminate()
+        if adapter == "cloud":
+            controller.interface.mari.mqtt_interface.close()
+        assert devices == LoopbackSerialAdapter.nodes, devices
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--nodes", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    LoopbackSerialAdapter.nodes = args.nodes
+    LoopbackMQTTAdapter.nodes = args.nodes
+    with patch(
+        "swarmit.testbed.adapter.MarilibSerialAdapter", LoopbackSerialAdapter
+    ), patch(
+        "swarmit.testbed.adapter.MarilibMQTTAdapter", LoopbackMQTTAdapter
+    ):
+        for adapter in ("edge", "cloud"):
+            durations = measure(adapter, args.runs)
+            print(
+                f"{adapter:>5}: {args.nodes} nodes, "
+                f"mean {statistics.mean(durations) * 1000:.0f}ms, "
+                f"min {min(durations) * 1000:.0f}ms, "
+                f"max {max(durations) * 1000:.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Benchmark the requests per second sustained by the /status endpoint.
+
+Pollers request /status in a loop, in-process through the ASGI interface,
+while a thread updates the status of the devices. The legacy handler, which
+serialized the whole status on every request, is measured as the baseline.
+
+Usage: python utils/benchmarks/status.py [--devices N] [--pollers N]
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from dataclasses import asdict
+from types import SimpleNamespace
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from swarmit.testbed.controller import NodeStatus
+from swarmit.testbed.protocol import StatusType
+from swarmit.testbed.webserver import StatusCache, status
+
+
+async def legacy_status(request: Request):
+    controller = request.app.state.controller
+    response = {
+        k: {
+            **asdict(v),
+            "device": v.device.name,
+            "status": v.status.name,
+        }
+        for k, v in list(controller.status_data.items())
+    }
+    return JSONResponse(content={"response": response})
+
+
+class Swarm(threading.Thread):
+    """Refresh the status of all devices, moving `moving` of them."""
+
+    def __init__(self, controller, period: float, moving: int):
+        super().__init__(daemon=True)
+        self.controller = controller
+        self.period = period
+        self.moving = moving
+        self.stop_event = threading.Event()
+
+    def run(self):
+        step = 0
+        while not self.stop_event.wait(self.period):
+            step += 1
+            for index, addr in enumerate(list(self.controller.status_data)):
+                status = NodeStatus(
+                    status=StatusType.Running,
+                    battery=2900,
+                    pos_x=index + (step if index < self.moving else 0),
+                    last_updated_at=time.time(),
+                )
+                if self.controller.status_data[addr] != status:
+                    self.controller.status_version += 1
+                self.controller.status_data[addr] = status
+
+
+async def poll(client, deadline, etag: bool) -> int:
+    requests = 0
+    headers = {}
+    while time.monotonic() < deadline:
+        response = await client.get("/status", headers=headers)
+        if etag and "etag" in response.headers:
+            headers = {"If-None-Match": response.headers["etag"]}
+        requests += 1
+    return requests
+
+
+async def measure(app, pollers: int, duration: float, etag: bool) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        deadline = time.monotonic() + duration
+        counts = await asyncio.gather(
+            *(poll(client, deadline, etag) for _ in range(pollers))
+        )
+    return sum(counts) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--pollers", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+    controller = SimpleNamespace(
+        status_data={
+            f"{index:08X}": NodeStatus(status=StatusType.Running, battery=2900)
+            for index in range(args.devices)
+        },
+        status_version=0,
+    )
+    legacy = FastAPI()
+    legacy.get("/status")(legacy_status)
+    legacy.state.controller = controller
+    cached = FastAPI()
+    cached.get("/status")(status)
+    cached.state.status_cache = StatusCache(controller)
+    # status frames every 0.5s, idle swarm then 10% of the robots moving
+    for moving in (0, args.devices // 10):
+        swarm = Swarm(controller, 0.5, moving)
+        swarm.start()
+        print(
+            f"{args.devices} devices, {moving} moving, "
+            f"{args.pollers} pollers"
+        )
+        for label, app, etag in (
+            ("  before (asdict + json)", legacy, False),
+            ("  after (cached body)", cached, False),
+            ("  after (cached body + If-None-Match)", cached, True),
+        ):
+            rate = asyncio.run(measure(app, args.pollers, args.duration, etag))
+            print(f"{label}: {rate:.0f} requests/s")
+        swarm.stop_event.set()
+        swarm.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@
 
 # pylint: disable=too-few-public-methods
 
+import gzip
+import importlib.util
 import os
 import shlex
 import subprocess
@@ -13,6 +15,39 @@ NPM_INSTALL_CMD = "npm install --no-progress"
 NPM_BUILD_CMD = "npm run build"
 
 
+def load_assets_module():
+    """Loads the frontend file types, without importing swarmit."""
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    path = os.path.join(root, "swarmit", "testbed", "assets.py")
+    spec = importlib.util.spec_from_file_location("swarmit_assets", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+COMPRESSIBLE_EXTENSIONS = load_assets_module().COMPRESSIBLE_EXTENSIONS
+
+
+def precompress_frontend(build_dir):
+    """Writes the .gz (and .br, when brotli is installed) of the assets."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    for directory, _, files in os.walk(build_dir):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(directory, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            with open(f"{path}.gz", "wb") as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(f"{path}.br", "wb") as f:
+                    f.write(brotli.compress(data, quality=11))
+
+
 def build_frontend(root):
     """Builds the ReactJS frontend."""
     frontend_dir = os.path.join(root, "swarmit", "dashboard", "frontend")
@@ -26,6 +61,7 @@ def build_frontend(root):
         subprocess.run(
             shlex.split(NPM_BUILD_CMD), cwd=frontend_dir, check=True
         )
+        precompress_frontend(os.path.join(frontend_dir, "build"))
 
 
 class CustomBuildHook(BuildHookInterface):